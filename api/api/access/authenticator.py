@@ -1,8 +1,10 @@
 # Built-in deps
 import base64
+import hashlib
 import logging
 import os
-from datetime import datetime, timedelta
+import secrets
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
 from types import SimpleNamespace
 from typing import List, Optional, Union
@@ -24,6 +26,11 @@ from api.access.exceptions import InvalidCredsException, NoInvitationFound
 JWT_KEY = os.getenv("JWT_KEY")
 JWT_ALG = "HS256"
 
+# Access tokens are checked without the database, so they stay short-lived: role changes and
+# deleted users take effect within this window. Refresh tokens renew them; each refresh restarts the window.
+ACCESS_TOKEN_TTL = timedelta(minutes=int(os.getenv("ACCESS_TOKEN_MINUTES", "15")))
+REFRESH_TOKEN_TTL = timedelta(days=int(os.getenv("REFRESH_TOKEN_DAYS", "7")))
+
 logger = logging.getLogger("receep")
 
 
@@ -32,13 +39,15 @@ class AuthMetadata:
     user_id: Optional[int]
     username: Optional[str]
     roles: List[str] = []  # "admin"
-    config: Optional[dict]
+    config: Optional[dict] = None
 
 
-def _create_jwt_token(username, expiration_delta: timedelta) -> dict:
-    expiration = datetime.now() + expiration_delta
+def _create_jwt_token(user: User, expiration_delta: timedelta) -> dict:
+    expiration = datetime.now(timezone.utc) + expiration_delta
     payload = {
-        "sub": username,
+        "sub": user.username,
+        "uid": user.id,
+        "roles": [r.name for r in user.roles],
         "exp": expiration,
         "type": "bearer"
     }
@@ -48,6 +57,10 @@ def _create_jwt_token(username, expiration_delta: timedelta) -> dict:
     )
 
 
+def _hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
 def _verify_totp(key: str, token: str):
     totp = pyotp.TOTP(key)
     if totp.verify(token):
@@ -63,9 +76,9 @@ class Authenticator:
     def totp_enabled(self) -> bool:
         return os.getenv("TOTP_ENABLED", "0") == "1"
 
-    def create_jwt(self, payload: SimpleNamespace, expiration_delta=timedelta(days=7)) -> Union[dict, None]:
+    def create_jwt(self, payload: SimpleNamespace) -> Union[dict, None]:
         """
-        Validates user credentials and returns a dictionary containing 'token' and 'token_type'
+        Validates user credentials and returns a dictionary containing 'token', 'token_type' and 'refresh_token'
         If the username/password combination is correct but TOTP is not provided, returns None.
         Raises InvalidCredsException if username is not found or if the password is wrong.
         """
@@ -84,7 +97,39 @@ class Authenticator:
             if not _verify_totp(key, payload.totp):
                 raise InvalidCredsException
 
-        return _create_jwt_token(payload.username, expiration_delta)
+        return self.issue_tokens(user)
+
+    def issue_tokens(self, user: User) -> dict:
+        """
+        Returns a short-lived access token ('token', 'token_type') and a new 'refresh_token' for the user.
+        Only the hash of the refresh token is stored.
+        """
+        refresh_token = secrets.token_urlsafe(32)
+        self.db.create_refresh_token(
+            user.id, _hash_refresh_token(refresh_token), REFRESH_TOKEN_TTL)
+
+        result = _create_jwt_token(user, ACCESS_TOKEN_TTL)
+        result.update(refresh_token=refresh_token)
+        return result
+
+    def refresh(self, refresh_token: str) -> dict:
+        """
+        Exchanges a refresh token for a new access token and a new refresh token; the presented one is revoked.
+        Raises InvalidCredsException if the refresh token is unknown, expired or already used.
+        """
+        new_refresh_token = secrets.token_urlsafe(32)
+        user = self.db.use_refresh_token(_hash_refresh_token(refresh_token),
+                                         _hash_refresh_token(new_refresh_token),
+                                         REFRESH_TOKEN_TTL)
+        if not user:
+            raise InvalidCredsException
+
+        result = _create_jwt_token(user, ACCESS_TOKEN_TTL)
+        result.update(refresh_token=new_refresh_token)
+        return result
+
+    def revoke(self, refresh_token: str) -> None:
+        self.db.revoke_refresh_token(_hash_refresh_token(refresh_token))
 
     def create_user(self, username: str) -> None:
         create_success = self.db.create_user(username)
@@ -147,10 +192,11 @@ class Authenticator:
                 - "token" (str): JWT token for authentication.
                 - "message"
                 - "token_type"
+                - "refresh_token"
         """
         self.create_user(username)
         result = self.setup_password(username, password)
-        result.update(_create_jwt_token(username, timedelta(days=7)))
+        result.update(self.issue_tokens(self.db.get_user_by_username(username)))
 
         return result
 
@@ -163,15 +209,24 @@ class Authenticator:
             raise NoInvitationFound
 
         result = self.setup_password(username, password)
-        result.update(_create_jwt_token(username, timedelta(days=7)))
+        result.update(self.issue_tokens(user))
 
         return result
 
     def get_auth_metadata(self, token: Optional[str]):
         metadata = AuthMetadata()
 
-        metadata.username = jwt.decode(
-            token, JWT_KEY, algorithms=[JWT_ALG]).get("sub")
+        payload = jwt.decode(token, JWT_KEY, algorithms=[JWT_ALG])
+        metadata.username = payload.get("sub")
+
+        if "uid" in payload:
+            # The claims are trusted as signed; no database round trip.
+            metadata.authenticated = True
+            metadata.user_id = payload["uid"]
+            metadata.roles = payload.get("roles", [])
+            return metadata
+
+        # Tokens issued before the claims were added
         user = self.db.get_user_by_username(metadata.username)
         if user:
             metadata.authenticated = True
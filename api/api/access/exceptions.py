@@ -4,3 +4,7 @@ class InvalidCredsException(Exception):
 
 class NoInvitationFound(Exception):
     pass
+
+
+class AuthBusy(Exception):
+    pass
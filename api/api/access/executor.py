@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+import threading
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
+
+from api.access.exceptions import AuthBusy
+from utils.timing import span
+
+logger = logging.getLogger("receep")
+
+T = TypeVar("T")
+
+# bcrypt releases the GIL, so a few threads hash in parallel without starving the event loop.
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "2"))
+# Calls waiting for a worker beyond this are rejected with 503 instead of piling up.
+AUTH_QUEUE_LIMIT = int(os.getenv("AUTH_QUEUE_LIMIT", "32"))
+
+
+class AuthExecutor:
+    """
+    Runs deliberately slow auth work (bcrypt, TOTP QR codes) on a small dedicated thread pool,
+    so a burst of logins neither blocks the event loop nor takes over the threadpool that serves other requests.
+    """
+
+    def __init__(self, workers: int = AUTH_WORKERS, queue_limit: int = AUTH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+        # Metrics
+        self.rejected = 0
+        self.max_queue_depth = 0
+
+    @property
+    def active(self) -> int:
+        return min(self._in_flight, self.workers)
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Calls waiting for a worker.
+        """
+        return max(self._in_flight - self.workers, 0)
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_limit:
+                self.rejected += 1
+                logger.warning(f"Auth executor is saturated. {self.queue_depth=} {self.rejected=}")
+                raise AuthBusy
+            self._in_flight += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        try:
+            loop = asyncio.get_running_loop()
+            # The copied context lets the request's timing count the statements func issues. "auth" includes the
+            # time spent waiting for a worker.
+            with span("auth"):
+                return await loop.run_in_executor(self._executor, copy_context().run, partial(func, *args, **kwargs))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+instance = AuthExecutor()
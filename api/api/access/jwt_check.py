@@ -0,0 +1,110 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+JWT_CHECK_PATH = "/jwt/check"
+# Decoded tokens kept in memory. A receipt grid fetches one thumbnail per receipt, each checked with the same token.
+TOKEN_CACHE_SIZE = 4096
+# How long nginx may reuse a positive answer for the same cookie, capped by the token's expiry.
+JWT_CHECK_CACHE_SECONDS = 30
+
+
+class TokenCache:
+    """
+    Maps raw tokens to their verified claims, so repeated checks of the same token skip the signature verification.
+    Entries leave the cache when their token expires. Invalid tokens are not cached.
+    Only used from the event loop, so there is no lock.
+    """
+
+    def __init__(self, key: str, algorithm: str, maxsize: int = TOKEN_CACHE_SIZE):
+        self.key = key
+        self.algorithm = algorithm
+        self.maxsize = maxsize
+        self._claims: OrderedDict[str, dict] = OrderedDict()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._claims)
+
+    def get(self, token: str) -> Optional[dict]:
+        claims = self._claims.get(token)
+        if claims is not None:
+            if claims["exp"] > time.time():
+                self._claims.move_to_end(token)
+                self.hits += 1
+                return claims
+            del self._claims[token]
+
+        self.misses += 1
+
+        try:
+            claims = jwt.decode(token, self.key, algorithms=[self.algorithm])
+        except jwt.PyJWTError:
+            return None
+        if "exp" not in claims:
+            # Could not be evicted.
+            return None
+
+        self._claims[token] = claims
+        if len(self._claims) > self.maxsize:
+            self._claims.popitem(last=False)
+        return claims
+
+
+class JwtCheckMiddleware:
+    """
+    Answers GET /jwt/check, the nginx auth_request for every receipt file, before FastAPI's routing and
+    dependency injection. 204 with X-User-Id if the jwt cookie holds a valid access token, 401 otherwise.
+
+    Positive answers carry X-Accel-Expires, so nginx can cache them per cookie; browsers are told not to.
+    Tokens issued before access tokens carried uid are passed on to the regular route, which looks the user up.
+    """
+
+    def __init__(self, app: ASGIApp, tokens: TokenCache):
+        self.app = app
+        self.tokens = tokens
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] != JWT_CHECK_PATH:
+            await self.app(scope, receive, send)
+            return
+
+        token = _get_jwt_cookie(scope)
+        claims = self.tokens.get(token) if token else None
+
+        if claims is None:
+            await _respond(send, 401, [(b"content-length", b"0")])
+            return
+
+        if "uid" not in claims:
+            await self.app(scope, receive, send)
+            return
+
+        max_age = min(JWT_CHECK_CACHE_SECONDS, int(claims["exp"] - time.time()))
+        await _respond(send, 204, [
+            (b"x-user-id", str(claims["uid"]).encode()),
+            (b"x-accel-expires", str(max(max_age, 0)).encode()),
+        ])
+
+
+def _get_jwt_cookie(scope: Scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            return cookie_parser(value.decode("latin-1")).get("jwt")
+    return None
+
+
+async def _respond(send: Send, status: int, headers: list) -> None:
+    await send(dict(
+        type="http.response.start",
+        status=status,
+        headers=headers + [(b"cache-control", b"private, no-store")],
+    ))
+    await send(dict(type="http.response.body", body=b""))
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Callable, Dict, Iterator, Optional
+
+from sqlalchemy import Engine, text
+
+logger = logging.getLogger("receep")
+
+# How long the first event of a batch waits for more events to coalesce with.
+BATCH_INTERVAL_SECONDS = 0.05
+
+NOTIFY_CHANNEL = "receep_changes"
+# pg_notify payloads must stay under 8000 bytes. Each entry of a payload takes at most ~25 bytes.
+NOTIFY_BATCH_SIZE = 250
+LISTEN_RECONNECT_SECONDS = 5
+
+# Called on the event loop with {user_id: latest data version}.
+Deliver = Callable[[Dict[int, int]], None]
+
+
+class Broker:
+    """
+    Carries data version changes from the thread that committed them to every API worker's websocket hub.
+
+    publish() is thread-safe and only records the latest version per user. A flusher task on the event loop sends
+    everything recorded during BATCH_INTERVAL_SECONDS as one batch, so a burst of writes by one user turns into
+    a single notification.
+    """
+
+    def __init__(self, batch_interval: float = BATCH_INTERVAL_SECONDS):
+        self.batch_interval = batch_interval
+
+        self._pending: Dict[int, int] = dict()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._deliver: Optional[Deliver] = None
+
+    def publish(self, user_id: int, version: int) -> None:
+        loop = self._loop
+        if loop is None:
+            # Not started, ex. a one-off script using the Database. Nobody is listening.
+            return
+
+        with self._lock:
+            is_first = not self._pending
+            self._pending[user_id] = max(version, self._pending.get(user_id, 0))
+
+        if is_first:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def stop(self) -> None:
+        self._loop = None
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.batch_interval)
+            self._wakeup.clear()
+
+            with self._lock:
+                batch, self._pending = self._pending, dict()
+
+            if batch:
+                try:
+                    await self._send(batch)
+                except Exception:
+                    logger.exception(f"Failed to send change notifications. users={len(batch)}")
+
+    async def _send(self, batch: Dict[int, int]) -> None:
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """
+    Delivers within the current process only. Use it when the API runs a single worker.
+    """
+
+    async def _send(self, batch: Dict[int, int]) -> None:
+        self._deliver(batch)
+
+
+def encode_notify_payloads(batch: Dict[int, int]) -> Iterator[str]:
+    items = list(batch.items())
+    for i in range(0, len(items), NOTIFY_BATCH_SIZE):
+        yield json.dumps(dict(items[i:i + NOTIFY_BATCH_SIZE]))
+
+
+def decode_notify_payload(payload: str) -> Dict[int, int]:
+    return {int(user_id): version for user_id, version in json.loads(payload).items()}
+
+
+class PostgresBroker(Broker):
+    """
+    Delivers to every process listening on the same database through LISTEN/NOTIFY, so no extra service is needed.
+
+    Batches are sent with pg_notify over a pooled connection. Each process keeps one dedicated connection that
+    LISTENs, registered with the event loop, and delivers what arrives, including its own batches.
+    Notifications sent while the listening connection is down are lost; websocket clients resync when they reconnect.
+    """
+
+    def __init__(self, engine: Engine, batch_interval: float = BATCH_INTERVAL_SECONDS):
+        super().__init__(batch_interval)
+        self.engine = engine
+        self._connection = None
+        self._reconnect: Optional[asyncio.TimerHandle] = None
+
+    async def start(self, deliver: Deliver) -> None:
+        await super().start(deliver)
+        await self._listen()
+
+    async def stop(self) -> None:
+        loop = self._loop
+        await super().stop()
+
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        if self._connection is not None:
+            self._close_listener(loop)
+
+    async def _send(self, batch: Dict[int, int]) -> None:
+        await self._loop.run_in_executor(None, self._notify, batch)
+
+    def _notify(self, batch: Dict[int, int]) -> None:
+        with self.engine.begin() as conn:
+            for payload in encode_notify_payloads(batch):
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                             dict(channel=NOTIFY_CHANNEL, payload=payload))
+
+    def _connect(self):
+        # A connection of its own, outside the pool, that stays in autocommit mode.
+        connection = self.engine.raw_connection()
+        dbapi_connection = connection.driver_connection
+        connection.detach()
+        dbapi_connection.autocommit = True
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return dbapi_connection
+
+    async def _listen(self) -> None:
+        self._reconnect = None
+        loop = self._loop
+        if loop is None:
+            return
+
+        try:
+            self._connection = await loop.run_in_executor(None, self._connect)
+        except Exception:
+            logger.exception(f"Failed to LISTEN. Retrying in {LISTEN_RECONNECT_SECONDS}s.")
+            self._schedule_reconnect()
+            return
+
+        loop.add_reader(self._connection.fileno(), self._on_readable)
+
+    def _schedule_reconnect(self) -> None:
+        loop = self._loop
+        if loop is not None:
+            self._reconnect = loop.call_later(
+                LISTEN_RECONNECT_SECONDS, lambda: asyncio.ensure_future(self._listen()))
+
+    def _close_listener(self, loop: asyncio.AbstractEventLoop) -> None:
+        connection, self._connection = self._connection, None
+        try:
+            loop.remove_reader(connection.fileno())
+        except Exception:
+            pass
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _on_readable(self) -> None:
+        batch: Dict[int, int] = dict()
+        try:
+            self._connection.poll()
+            while self._connection.notifies:
+                notify = self._connection.notifies.pop(0)
+                for user_id, version in decode_notify_payload(notify.payload).items():
+                    batch[user_id] = max(version, batch.get(user_id, 0))
+        except Exception:
+            logger.exception(f"Lost the LISTEN connection. Reconnecting in {LISTEN_RECONNECT_SECONDS}s.")
+            self._close_listener(self._loop)
+            self._schedule_reconnect()
+
+        if batch:
+            self._deliver(batch)
+
+
+def create_broker(name: str, engine: Engine) -> Broker:
+    assert name in ("memory", "postgres"), f"EVENT_BROKER must be one of: memory, postgres. {name=}"
+    if name == "postgres":
+        return PostgresBroker(engine)
+    return InMemoryBroker()
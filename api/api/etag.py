@@ -0,0 +1,32 @@
+from typing import Optional
+
+
+class NotModified(Exception):
+    def __init__(self, etag: str):
+        self.etag = etag
+        super().__init__(f"Not modified. {etag=}")
+
+
+def make_etag(user_id: int, version: int) -> str:
+    """
+    Changes when the requesting user's data changes.
+    """
+    return f'W/"user-{user_id}-{version}"'
+
+
+def _strip_weak_prefix(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison as described in RFC 9110 section 13.1.2.
+    """
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    candidates = {_strip_weak_prefix(c.strip()) for c in if_none_match.split(",")}
+    return _strip_weak_prefix(etag) in candidates
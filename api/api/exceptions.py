@@ -2,8 +2,11 @@
 from functools import wraps
 import logging
 
-from fastapi.responses import JSONResponse
-from persistence.exceptions import DuplicateReceipt, DuplicateUsernameException
+from fastapi.responses import JSONResponse, Response
+from persistence.exceptions import DuplicateReceipt, DuplicateUsernameException, NotFound
+
+from api.access.exceptions import AuthBusy
+from api.etag import NotModified
 
 logger = logging.getLogger("receep")
 
@@ -61,6 +64,31 @@ def duplicate_receipt_handler(_, e: DuplicateReceipt):
     )
 
 
+@handler(NotFound)
+def not_found_handler(*args, **kwargs):
+    return JSONResponse(
+        status_code=404,
+        content=dict(message="Not found")
+    )
+
+
+@handler(NotModified)
+def not_modified_handler(_, e: NotModified):
+    return Response(
+        status_code=304,
+        headers={"ETag": e.etag, "Cache-Control": "private, no-cache"}
+    )
+
+
+@handler(AuthBusy)
+def auth_busy_handler(*args, **kwargs):
+    return JSONResponse(
+        status_code=503,
+        content=dict(message="Too many sign-in attempts in progress. Try again shortly."),
+        headers={"Retry-After": "1"}
+    )
+
+
 def register_exception_handlers(fastapi_app):
     for cls, func in _HANDLERS.values():
         fastapi_app.add_exception_handler(cls, func)
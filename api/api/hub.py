@@ -0,0 +1,126 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Set
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger("receep")
+
+# Messages waiting to be sent to one connection. A connection that falls this far behind is dropped.
+SEND_QUEUE_SIZE = 64
+# A single send that takes longer than this drops the connection.
+SEND_TIMEOUT_SECONDS = 10
+
+# Close code asking the client to reconnect later. Clients resync on reconnect, so nothing is lost.
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket, user_id: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        # Set when the connection is dropped for falling behind.
+        self.dropped = asyncio.Event()
+
+
+class Hub:
+    """
+    Fans messages out to the open websockets of a user.
+
+    Each connection has a bounded send queue drained by its own task, so a slow client never delays the others.
+    publish() is thread-safe and never blocks, so it can be called from the threadpool that runs sync endpoints.
+    """
+
+    def __init__(self):
+        self._channels: Dict[int, Set[Connection]] = dict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self._channels.values())
+
+    def publish(self, user_id: int, message: dict) -> None:
+        loop = self._loop
+        if loop is None or user_id not in self._channels:
+            return
+
+        text = json.dumps(message)
+        loop.call_soon_threadsafe(self._fan_out, user_id, text)
+
+    def _fan_out(self, user_id: int, text: str) -> None:
+        for connection in list(self._channels.get(user_id, ())):
+            try:
+                connection.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping a slow websocket consumer. {user_id=}")
+                self._drop(connection)
+
+    def _register(self, connection: Connection) -> None:
+        self._channels.setdefault(connection.user_id, set()).add(connection)
+
+    def _unregister(self, connection: Connection) -> None:
+        connections = self._channels.get(connection.user_id)
+        if connections is None:
+            return
+
+        connections.discard(connection)
+        if not connections:
+            del self._channels[connection.user_id]
+
+    def _drop(self, connection: Connection) -> None:
+        self._unregister(connection)
+        connection.dropped.set()
+
+    async def _send(self, connection: Connection) -> None:
+        while True:
+            text = await connection.queue.get()
+            try:
+                await asyncio.wait_for(connection.websocket.send_text(text), SEND_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropping a stalled websocket consumer. user_id={connection.user_id}")
+                self._drop(connection)
+                return
+            except Exception:
+                # The client went away. _receive notices the disconnect as well.
+                return
+
+    async def _receive(self, connection: Connection) -> None:
+        # Incoming messages are ignored; receiving is how a disconnect is noticed.
+        try:
+            while True:
+                await connection.websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    async def serve(self, websocket: WebSocket, user_id: int) -> None:
+        """
+        Streams the user's messages to an accepted websocket until either side closes it.
+        """
+        self._loop = asyncio.get_running_loop()
+
+        connection = Connection(websocket, user_id)
+        self._register(connection)
+
+        tasks = [
+            asyncio.create_task(self._send(connection)),
+            asyncio.create_task(self._receive(connection)),
+            asyncio.create_task(connection.dropped.wait()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._unregister(connection)
+
+        if connection.dropped.is_set():
+            try:
+                await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            except Exception:
+                pass
+
+
+instance = Hub()
@@ -0,0 +1,34 @@
+from typing import Dict
+
+import numpy as np
+
+# Indexed by the ISO weekday - 1, like datetime.weekday().
+WEEKDAYS = np.array(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"], dtype=object)
+# 1970-01-01, day 0 of datetime64[D], was a Thursday.
+EPOCH_WEEKDAY = 3
+
+
+def line_item_arrays(columns: Dict[str, tuple], tz: float = 0) -> Dict[str, object]:
+    """
+    Expects the output of Database.get_line_item_columns.
+    Returns the fields of reports.line_item_to_dict as columns, computed for all rows at once.
+    Numeric columns are NumPy arrays, which ORJSONResponse serializes natively. vendor_id is nullable and stays a list.
+    """
+    count = len(columns["epoch"])
+    epoch = np.fromiter(columns["epoch"], dtype=np.int64, count=count)
+    local = (epoch + round(tz * 3600)).astype("datetime64[s]")
+
+    days = local.astype("datetime64[D]")
+    months = days.astype("datetime64[M]")
+    years = months.astype("datetime64[Y]")
+
+    return dict(
+        amount=np.fromiter(columns["amount"], dtype=np.float64, count=count),
+        category_id=np.fromiter(columns["category_id"], dtype=np.int64, count=count),
+        tx_id=np.fromiter(columns["tx_id"], dtype=np.int64, count=count),
+        vendor_id=list(columns["vendor_id"]),
+        year=years.astype(np.int64) + 1970,
+        month=months.astype(np.int64) % 12 + 1,
+        day=(days - months).astype(np.int64) + 1,
+        day_of_week=WEEKDAYS[(days.astype(np.int64) + EPOCH_WEEKDAY) % 7].tolist(),
+    )
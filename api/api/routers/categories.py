@@ -2,15 +2,19 @@ import logging
 
 from pydantic import BaseModel
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
 from persistence.database import instance as db_instance
 
 from api.access.authenticator import AuthMetadata
-from api.shared import get_auth_metadata
-from api.utils import get_api_safe_json
+from api.shared import check_etag, get_auth_metadata
+from api.serializers import CATEGORY
+from api.typeahead import TypeaheadCache
 
 router = APIRouter()
 logger = logging.getLogger("receep")
 
+typeahead_cache = TypeaheadCache(CATEGORY, db_instance.get_categories_with_usage, db_instance.get_data_version)
+
 
 class UpsertRequest(BaseModel):
     id: int
@@ -23,24 +27,37 @@ class UpsertRequest(BaseModel):
 @router.get("/categories/single/{id}")
 def get_category(
     id: int,
-    _: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
 ):
-    category = db_instance.get_category_by_id(id=id)
-    return get_api_safe_json(category)
+    category = db_instance.get_category_by_id(id=id, user_id=auth_metadata.user_id)
+    return ORJSONResponse(CATEGORY.one(category), headers=cache_headers)
 
 
 @router.get("/categories/paginated")
 def get_categories(
     offset: int = Query(0, ge=0),
     limit: int = Query(100, le=500),
-    metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+    metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
 ):
     categories = db_instance.get_categories_by_user_id(
         user_id=metadata.user_id, offset=offset, limit=limit)
-    return dict(
+    return ORJSONResponse(dict(
         next_offset=offset+len(categories),
-        items=get_api_safe_json(categories)
-    )
+        items=CATEGORY.many(categories)
+    ), headers=cache_headers)
+
+
+@router.get("/categories/typeahead")
+def typeahead_categories(
+    q: str = Query("", max_length=64),
+    limit: int = Query(10, ge=1, le=50),
+    metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
+):
+    items = typeahead_cache.search(user_id=metadata.user_id, query=q, limit=limit)
+    return ORJSONResponse(dict(items=items), headers=cache_headers)
 
 
 @router.post("/categories")
@@ -55,7 +72,7 @@ def create_category(
         with_autotax=payload.with_autotax
     )
 
-    return category
+    return ORJSONResponse(CATEGORY.to_dict(category))
 
 
 @router.put("/categories/{id}")
@@ -72,7 +89,7 @@ def update_category(
         with_autotax=payload.with_autotax
     )
 
-    return category
+    return ORJSONResponse(CATEGORY.to_dict(category))
 
 
 @router.delete("/categories/{id}")
@@ -0,0 +1,33 @@
+import logging
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from persistence.database import get_engine
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger("receep")
+
+router = APIRouter()
+
+
+@router.get("/health/live", include_in_schema=False)
+def live():
+    """
+    The process is up and serving requests.
+    """
+    return dict(status="ok")
+
+
+@router.get("/health/ready", include_in_schema=False)
+def ready():
+    """
+    The worker can serve traffic: it gets a connection from its pool and the database answers.
+    """
+    try:
+        with get_engine().connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except SQLAlchemyError as e:
+        logger.warning(f"Readiness check failed. {e.__class__.__name__}: {e}")
+        return JSONResponse(status_code=503, content=dict(status="unavailable", reason="database"))
+    return dict(status="ok")
@@ -0,0 +1,52 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import Engine
+from sqlalchemy.pool import QueuePool
+
+from api.access.executor import AuthExecutor
+from api.access.jwt_check import TokenCache
+from api.hub import Hub
+from logic.ocr import OcrPool
+from utils.metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Internal only: nginx does not proxy it. Prometheus scrapes the API container directly.
+    Under gunicorn, any worker answers with the values of all workers. See utils/metrics.py.
+    """
+    return PlainTextResponse(REGISTRY.expose(), media_type=CONTENT_TYPE)
+
+
+def register_app_metrics(engine: Engine, auth_executor: AuthExecutor, hub: Hub, tokens: TokenCache,
+                         ocr_pool: OcrPool) -> None:
+    """
+    Metrics read from the app's long-lived objects on every scrape.
+    """
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        Gauge("receep_db_pool_size", "Connections the pool keeps open.", function=pool.size)
+        Gauge("receep_db_pool_checked_out", "Connections in use.", function=pool.checkedout)
+        Gauge("receep_db_pool_overflow", "Connections open beyond the pool size.", function=pool.overflow)
+        Gauge("receep_db_pool_checked_in", "Idle connections in the pool.", function=pool.checkedin)
+
+    Gauge("receep_auth_active", "Auth calls running on the auth executor.", function=lambda: auth_executor.active)
+    Gauge("receep_auth_queue_depth", "Auth calls waiting for a worker.", function=lambda: auth_executor.queue_depth)
+    Counter("receep_auth_rejected_total", "Auth calls rejected because the executor was saturated.",
+            function=lambda: auth_executor.rejected)
+
+    Counter("receep_jwt_check_cache_hits_total", "/jwt/check tokens found in the decoded-token cache.",
+            function=lambda: tokens.hits)
+    Counter("receep_jwt_check_cache_misses_total", "/jwt/check tokens that had to be decoded.",
+            function=lambda: tokens.misses)
+    Gauge("receep_jwt_check_cache_size", "Tokens in the decoded-token cache.", function=lambda: len(tokens))
+
+    Gauge("receep_websocket_connections", "Open websockets.", function=lambda: hub.connection_count)
+
+    Gauge("receep_ocr_active", "Receipts being recognized by the OCR pool.", function=lambda: ocr_pool.active)
+    Gauge("receep_ocr_queue_depth", "Receipts waiting for an OCR worker.", function=lambda: ocr_pool.queue_depth)
+    Counter("receep_ocr_skipped_total", "Receipts left to the backfill because the OCR queue was full.",
+            function=lambda: ocr_pool.skipped)
@@ -1,12 +1,15 @@
 import logging
+from typing import Optional
 
 from fastapi import APIRouter, Depends, Query, UploadFile
+from fastapi.responses import ORJSONResponse
+from logic import ocr
 from logic.receep import instance as app_instance
 from persistence.database import instance as db_instance
 
 from api.access.authenticator import AuthMetadata
-from api.shared import get_auth_metadata
-from api.utils import get_api_safe_json
+from api.shared import check_etag, get_auth_metadata, to_utc
+from api.serializers import RECEIPT
 
 router = APIRouter()
 logger = logging.getLogger("receep")
@@ -16,19 +19,61 @@ logger = logging.getLogger("receep")
 def get_stuff(
     offset: int = Query(0, ge=0),
     limit: int = Query(100, le=500),
-    _: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+    has_transactions: Optional[bool] = Query(None),
+    created_after: Optional[float] = Query(None),
+    created_before: Optional[float] = Query(None),
+    content_type: Optional[str] = Query(None),  # prefix. Ex. "image/"
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
 ):
-    receipts = db_instance.get_receipts(offset=offset, limit=limit)
-    return dict(
-        next_offset=offset+len(receipts),
-        items=get_api_safe_json(receipts)
+    receipts = db_instance.get_receipts(
+        offset=offset,
+        limit=limit,
+        user_id=auth_metadata.user_id,
+        has_transactions=has_transactions,
+        start=to_utc(created_after) if created_after is not None else None,
+        end=to_utc(created_before) if created_before is not None else None,
+        content_type=content_type,
     )
+    return ORJSONResponse(dict(
+        next_offset=offset+len(receipts),
+        items=RECEIPT.many(receipts)
+    ), headers=cache_headers)
+
+
+@router.get("/receipts/search")
+def search_receipts(
+    q: str = Query(..., min_length=1),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, le=500),
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
+):
+    receipts = db_instance.search_receipts(auth_metadata.user_id, q, offset=offset, limit=limit)
+    return ORJSONResponse(dict(
+        next_offset=offset+len(receipts),
+        items=RECEIPT.many(receipts)
+    ), headers=cache_headers)
 
 
 @router.get("/receipts/single/{receipt_id}")
-def get_single_receipt(receipt_id: int, _: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))):
-    receipt = db_instance.get_receipt(receipt_id=receipt_id)
-    return get_api_safe_json(receipt)
+def get_single_receipt(
+    receipt_id: int,
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
+):
+    receipt = db_instance.get_receipt(receipt_id=receipt_id, user_id=auth_metadata.user_id)
+    return ORJSONResponse(RECEIPT.to_dict(receipt), headers=cache_headers)
+
+
+@router.get("/receipts/{receipt_id}/text")
+def get_receipt_text(
+    receipt_id: int,
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
+):
+    receipt_text = db_instance.get_receipt_text(receipt_id, user_id=auth_metadata.user_id)
+    return ORJSONResponse(dict(text=receipt_text.text, lines=receipt_text.lines), headers=cache_headers)
 
 
 @router.post("/receipts")
@@ -36,7 +81,8 @@ async def upload_file(file: UploadFile, metadata: AuthMetadata = Depends(get_aut
     try:
         receipt = app_instance.upload(
             metadata.user_id, file.content_type, file.file)
-        return get_api_safe_json(receipt)
+        ocr.instance.submit(receipt.id)
+        return ORJSONResponse(RECEIPT.to_dict(receipt))
     finally:
         file.file.close()
 
@@ -48,7 +94,9 @@ async def rotate_receipt(receipt_id: int, auth_metadata: AuthMetadata = Depends(
         user_id=auth_metadata.user_id,
         delta=90
     )
-    return get_api_safe_json(updated_receipt)
+    if updated_receipt is not None:
+        ocr.instance.submit(updated_receipt.id)
+    return ORJSONResponse(RECEIPT.one(updated_receipt))
 
 
 @router.delete("/receipts/{receipt_id}")
@@ -1,31 +1,53 @@
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Optional
 import logging
 
-from api.utils import get_api_safe_json
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
 from persistence.database import instance as db_instance
 
 from api.access.authenticator import AuthMetadata
-from api.shared import get_auth_metadata
-from persistence.schema import LineItem
+from api.report_arrays import line_item_arrays
+from api.shared import get_auth_metadata, to_utc
+from sqlalchemy import Row
 
 logger = logging.getLogger("receep")
 
 router = APIRouter()
 
 
-def line_item_to_dict(line_item: LineItem, tz: float = 0) -> dict:
-    tx_time: datetime = line_item.transaction.timestamp
+def get_report_timezone(
+    timezone: Optional[str] = Query(None, max_length=64),  # IANA name. Ex. America/Vancouver.
+    tz: float = Query(0),  # in hours. Ex. UTC-7 is -7. Ignored when timezone is set.
+) -> SimpleNamespace:
+    """
+    With an IANA name, Postgres converts each timestamp with the offset in effect at that time, DST included.
+    The fixed offset in hours is kept for older clients.
+    """
+    if timezone is None:
+        return SimpleNamespace(name="UTC", offset=tz)
+
+    if timezone not in db_instance.get_timezone_names():
+        raise HTTPException(status_code=400, detail=f"Unknown timezone. {timezone=}")
+    return SimpleNamespace(name=timezone, offset=0)
+
+
+def line_item_to_dict(line_item: Row, tz: float = 0) -> dict:
+    """
+    Expects a row from one of the Database.get_line_items* methods. Its timestamp is already local
+    when the query was given a timezone name; tz is a fixed offset on top of it.
+    """
+    tx_time: datetime = line_item.timestamp
 
     if tz:
-        tzinfo = timezone(timedelta(hours=tz))
-        tx_time = tx_time.replace(tzinfo=tzinfo)
+        tx_time = tx_time + timedelta(hours=tz)
 
     return dict(
         amount=line_item.amount,
         category_id=line_item.category_id,
-        tx_id=line_item.transaction.id,
-        vendor_id=line_item.transaction.vendor_id,
+        tx_id=line_item.tx_id,
+        vendor_id=line_item.vendor_id,
         year=tx_time.year,
         month=tx_time.month,
         day=tx_time.day,
@@ -33,11 +55,11 @@ def line_item_to_dict(line_item: LineItem, tz: float = 0) -> dict:
     )
 
 
-def paginated_line_items_response(line_items: list, offset: int, tz: float) -> dict:
-    return dict(
+def paginated_line_items_response(line_items: list, offset: int, tz: float) -> ORJSONResponse:
+    return ORJSONResponse(dict(
         next_offset=offset + len(line_items),
-        items=get_api_safe_json([line_item_to_dict(li, tz) for li in line_items])
-    )
+        items=[line_item_to_dict(li, tz) for li in line_items]
+    ))
 
 
 @router.get("/reports/annual-expense-report/paginated")
@@ -46,18 +68,66 @@ def get_annual_expense_report(
     end: float = Query(),
     offset: int = Query(0, ge=0),
     limit: int = Query(100, le=500),
-    tz: float = Query(0),  # in hours. Ex. UTC-7 is -7.
+    zone: SimpleNamespace = Depends(get_report_timezone),
     auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
 ):
     line_items = db_instance.get_line_items(
         user_id=auth_metadata.user_id,
-        start=datetime.fromtimestamp(start),
-        end=datetime.fromtimestamp(end),
+        start=to_utc(start),
+        end=to_utc(end),
         offset=offset,
-        limit=limit
+        limit=limit,
+        tz_name=zone.name
+    )
+
+    return paginated_line_items_response(line_items, offset, zone.offset)
+
+
+@router.get("/reports/annual-expense-report/columns")
+def get_annual_expense_report_columns(
+    start: float = Query(),
+    end: float = Query(),
+    zone: SimpleNamespace = Depends(get_report_timezone),
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+):
+    """
+    The whole range in one response, column-oriented: {count, columns: {field: [values]}}.
+    The fields are the ones of the paginated endpoint's items.
+    """
+    columns = db_instance.get_line_item_columns(
+        user_id=auth_metadata.user_id,
+        start=to_utc(start),
+        end=to_utc(end),
+        tz_name=zone.name
+    )
+
+    return ORJSONResponse(dict(
+        count=len(columns["epoch"]),
+        columns=line_item_arrays(columns, zone.offset)
+    ))
+
+
+@router.get("/reports/monthly-expenses")
+def get_monthly_expenses(
+    start: float = Query(),
+    end: float = Query(),
+    zone: SimpleNamespace = Depends(get_report_timezone),
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+):
+    """
+    Line item totals per local calendar month and category, aggregated by Postgres.
+    """
+    if zone.offset:
+        raise HTTPException(status_code=400, detail="Pass an IANA timezone name; tz offsets are not supported here.")
+
+    rows = db_instance.get_monthly_expenses(
+        user_id=auth_metadata.user_id,
+        start=to_utc(start),
+        end=to_utc(end),
+        tz_name=zone.name
     )
 
-    return paginated_line_items_response(line_items, offset, tz)
+    return ORJSONResponse(dict(items=[row._asdict() for row in rows]))
 
 
 @router.get("/reports/line-items-by-vendor/paginated")
@@ -65,7 +135,7 @@ def get_line_items_by_vendor(
     vendor_id: int = Query(),
     offset: int = Query(0, ge=0),
     limit: int = Query(500, le=500),
-    tz: float = Query(0),  # in hours. Ex. UTC-7 is -7.
+    zone: SimpleNamespace = Depends(get_report_timezone),
     auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
 ):
     line_items = db_instance.get_line_items_by_vendor(
@@ -73,9 +143,10 @@ def get_line_items_by_vendor(
         vendor_id=vendor_id,
         offset=offset,
         limit=limit,
+        tz_name=zone.name,
     )
 
-    return paginated_line_items_response(line_items, offset, tz)
+    return paginated_line_items_response(line_items, offset, zone.offset)
 
 
 @router.get("/reports/line-items-by-category/paginated")
@@ -83,7 +154,7 @@ def get_line_items_by_category(
     category_id: int = Query(),
     offset: int = Query(0, ge=0),
     limit: int = Query(500, le=500),
-    tz: float = Query(0),  # in hours. Ex. UTC-7 is -7.
+    zone: SimpleNamespace = Depends(get_report_timezone),
     auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
 ):
     line_items = db_instance.get_line_items_by_category(
@@ -91,6 +162,7 @@ def get_line_items_by_category(
         category_id=category_id,
         offset=offset,
         limit=limit,
+        tz_name=zone.name,
     )
 
-    return paginated_line_items_response(line_items, offset, tz)
+    return paginated_line_items_response(line_items, offset, zone.offset)
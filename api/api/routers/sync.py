@@ -0,0 +1,60 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
+from persistence.database import CHANGES_OVERLAP
+from persistence.database import instance as db_instance
+
+from api.access.authenticator import AuthMetadata
+from api.serializers import CATEGORY, RECEIPT, TRANSACTION_WITH_LINE_ITEMS, VENDOR
+from api.shared import check_etag, get_auth_metadata
+
+logger = logging.getLogger("receep")
+
+router = APIRouter()
+
+
+def encode_sync_token(user_id: int, synced_at: datetime) -> str:
+    return f"{user_id}:{synced_at.isoformat()}"
+
+
+def decode_sync_token(token: Optional[str], user_id: int) -> Optional[datetime]:
+    """
+    Returns None, which means a full sync, if the token is missing, malformed, or was issued to another user.
+    """
+    if not token:
+        return None
+
+    try:
+        token_user_id, synced_at = token.split(":", 1)
+        if int(token_user_id) != user_id:
+            return None
+        return datetime.fromisoformat(synced_at)
+    except ValueError:
+        logger.info(f"Ignoring malformed sync token. {token=}")
+        return None
+
+
+@router.get("/sync")
+def sync(
+    since: Optional[str] = Query(None),
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
+):
+    synced_at = decode_sync_token(since, auth_metadata.user_id)
+    changes = db_instance.get_changes(
+        user_id=auth_metadata.user_id,
+        since=synced_at - CHANGES_OVERLAP if synced_at else None,
+    )
+
+    return ORJSONResponse(dict(
+        token=encode_sync_token(auth_metadata.user_id, changes.synced_at),
+        full=synced_at is None,
+        receipts=RECEIPT.many(changes.receipts),
+        transactions=TRANSACTION_WITH_LINE_ITEMS.many(changes.transactions),
+        vendors=VENDOR.many(changes.vendors),
+        categories=CATEGORY.many(changes.categories),
+        deleted=changes.deleted,
+    ), headers=cache_headers)
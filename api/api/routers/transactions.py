@@ -1,14 +1,15 @@
-from datetime import datetime
 import logging
 from typing import List, Optional
 
-from api.utils import get_api_safe_json
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
 from persistence.database import instance as db_instance
 from pydantic import BaseModel
 
 from api.access.authenticator import AuthMetadata
-from api.shared import get_auth_metadata
+from api.serializers import TRANSACTION, TRANSACTION_WITH_LINE_ITEMS
+from api.shared import check_etag, get_auth_metadata, to_utc
+from api.suggestions import SuggestionIndex
 
 logger = logging.getLogger("receep")
 
@@ -16,6 +17,9 @@ router = APIRouter()
 
 PERS_LINE_ITEM_ATTRS = ()
 
+suggestion_index = SuggestionIndex(db_instance.get_line_item_categories, db_instance.get_data_version,
+                                   db_instance.get_receipt_ocr)
+
 
 class LineItem(BaseModel):
     name: str
@@ -36,7 +40,8 @@ class UpsertRequest(BaseModel):
 def get_transactions(
     offset: int = Query(0, ge=0),
     limit: int = Query(100, le=500),
-    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
 ):
     txns = db_instance.get_transactions(
         user_id=auth_metadata.user_id,
@@ -44,10 +49,10 @@ def get_transactions(
         limit=limit
     )
 
-    return dict(
+    return ORJSONResponse(dict(
         next_offset=offset+len(txns),
-        items=get_api_safe_json(txns)
-    )
+        items=TRANSACTION.many(txns)
+    ), headers=cache_headers)
 
 
 @router.get("/transactions/search")
@@ -60,16 +65,36 @@ def search_transactions(
         vendor_name=vendor_name
     )
 
-    return dict(items=get_api_safe_json(txns))
+    return ORJSONResponse(dict(items=TRANSACTION.many(txns)))
+
+
+@router.get("/transactions/suggestions")
+def suggest_categories(
+    vendor_id: Optional[int] = Query(None),
+    receipt_id: Optional[int] = Query(None),
+    name: Optional[str] = Query(None, max_length=64),
+    limit: int = Query(5, ge=1, le=20),
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
+):
+    suggestions = suggestion_index.suggest(
+        user_id=auth_metadata.user_id,
+        vendor_id=vendor_id,
+        receipt_id=receipt_id,
+        name=name,
+        limit=limit,
+    )
+    return ORJSONResponse(suggestions, headers=cache_headers)
 
 
 @router.get("/transactions/single/{id}")
 def get_single_transaction(
     id: int,
-    _: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
 ):
-    t = db_instance.get_transaction(transaction_id=id)
-    return get_api_safe_json(t)
+    t = db_instance.get_transaction(transaction_id=id, user_id=auth_metadata.user_id)
+    return ORJSONResponse(TRANSACTION_WITH_LINE_ITEMS.to_dict(t), headers=cache_headers)
 
 
 @router.post("/transactions")
@@ -83,9 +108,9 @@ def create_transaction(
         vendor_id=payload.get("vendor_id"),
         receipt_id=payload.get("receipt_id"),
         line_items=payload.get("line_items"),
-        timestamp=datetime.fromtimestamp(payload.get("timestamp")),
+        timestamp=to_utc(payload.get("timestamp")),
     )
-    return get_api_safe_json(t)
+    return ORJSONResponse(TRANSACTION_WITH_LINE_ITEMS.to_dict(t))
 
 
 @router.put("/transactions/{transaction_id}")
@@ -101,10 +126,10 @@ def update_transaction(
         vendor_id=payload.get("vendor_id"),
         receipt_id=payload.get("receipt_id"),
         line_items=payload.get("line_items"),
-        timestamp=datetime.fromtimestamp(payload.get("timestamp")),
+        timestamp=to_utc(payload.get("timestamp")),
     )
 
-    return get_api_safe_json(t)
+    return ORJSONResponse(TRANSACTION_WITH_LINE_ITEMS.to_dict(t))
 
 
 @router.delete("/transactions/{transaction_id}")
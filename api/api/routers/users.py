@@ -1,14 +1,15 @@
 
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from persistence.database import instance as db_instance
 from pydantic import BaseModel
 
 from api.access.authenticator import AuthMetadata
 from api.access.authenticator import instance as auth_instance
 from api.access.exceptions import NoInvitationFound
-from api.shared import get_app_info, get_auth_metadata
+from api.access.executor import instance as auth_executor
+from api.shared import get_app_info, get_auth_metadata, set_refresh_cookie
 
 router = APIRouter()
 auth = auth_instance
@@ -32,9 +33,10 @@ class InviteRequest(BaseModel):
 
 
 @router.post("/signup", response_model=SignupResponse)
-async def signup(signup_req: SignupRequest, app_info=Depends(get_app_info)):
+async def signup(signup_req: SignupRequest, response: Response, app_info=Depends(get_app_info)):
     if app_info.user_count == 0 or app_info.signup == "OPEN":
-        return auth.signup(signup_req.username, signup_req.password)
+        result = await auth_executor.run(auth.signup, signup_req.username, signup_req.password)
+        return set_refresh_cookie(response, result)
 
     raise HTTPException(
         status_code=400,
@@ -43,7 +45,11 @@ async def signup(signup_req: SignupRequest, app_info=Depends(get_app_info)):
 
 
 @router.post("/invite")
-async def invite(payload: InviteRequest, metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)), app_info=Depends(get_app_info)):
+async def invite(
+    payload: InviteRequest,
+    metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    app_info=Depends(get_app_info)
+):
     if app_info.signup == "CLOSED":
         raise HTTPException(
             status_code=403,
@@ -61,8 +67,12 @@ async def invite(payload: InviteRequest, metadata: AuthMetadata = Depends(get_au
 
 
 @router.post("/invite/accept")
-async def accept_invite(payload: SignupRequest, _: AuthMetadata = Depends(get_auth_metadata())):
-    app_info = get_app_info()
+async def accept_invite(
+    payload: SignupRequest,
+    response: Response,
+    _: AuthMetadata = Depends(get_auth_metadata()),
+    app_info=Depends(get_app_info)
+):
     if app_info.signup == "CLOSED":
         raise HTTPException(
             status_code=403,
@@ -70,21 +80,25 @@ async def accept_invite(payload: SignupRequest, _: AuthMetadata = Depends(get_au
         )
 
     try:
-        return auth.accept_invite(payload.username, payload.password)
+        result = await auth_executor.run(auth.accept_invite, payload.username, payload.password)
     except NoInvitationFound:
         raise HTTPException(
             status_code=404,
             detail="No invitation found",
         )
 
+    return set_refresh_cookie(response, result)
+
 
 @router.get("/me")
-async def get_my_info(metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))):
+def get_my_info(metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))):
+    # The access token carries the identity and roles, but not the config.
+    user = db.get_user_by_id(metadata.user_id)
     return dict(
         user_id=metadata.user_id,
         username=metadata.username,
         roles=metadata.roles,
-        config=metadata.config
+        config=user.config if user else None
     )
 
 
@@ -2,16 +2,20 @@ import logging
 from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
 from persistence.database import instance as db_instance
 
 from api.access.authenticator import AuthMetadata
-from api.shared import get_auth_metadata
-from api.utils import get_api_safe_json
+from api.shared import check_etag, get_auth_metadata
+from api.serializers import VENDOR
+from api.typeahead import TypeaheadCache
 from pydantic import BaseModel
 
 router = APIRouter()
 logger = logging.getLogger("receep")
 
+typeahead_cache = TypeaheadCache(VENDOR, db_instance.get_vendors_with_usage, db_instance.get_data_version)
+
 
 class UpsertRequest(BaseModel):
     name: str
@@ -25,24 +29,37 @@ class MergeRequest(BaseModel):
 @router.get("/vendors/single/{id}")
 def get_vendor(
     id: int,
-    _: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+    auth_metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
 ):
-    vendor = db_instance.get_vendor_by_id(id=id)
-    return get_api_safe_json(vendor)
+    vendor = db_instance.get_vendor_by_id(id=id, user_id=auth_metadata.user_id)
+    return ORJSONResponse(VENDOR.one(vendor), headers=cache_headers)
 
 
 @router.get("/vendors/paginated")
 def get_vendors(
     offset: int = Query(0, ge=0),
     limit: int = Query(100, le=500),
-    metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+    metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
 ):
     vendors = db_instance.get_vendors_by_user_id(
         user_id=metadata.user_id, offset=offset, limit=limit)
-    return dict(
+    return ORJSONResponse(dict(
         next_offset=offset+len(vendors),
-        items=get_api_safe_json(vendors)
-    )
+        items=VENDOR.many(vendors)
+    ), headers=cache_headers)
+
+
+@router.get("/vendors/typeahead")
+def typeahead_vendors(
+    q: str = Query("", max_length=64),
+    limit: int = Query(10, ge=1, le=50),
+    metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True)),
+    cache_headers: dict = Depends(check_etag())
+):
+    items = typeahead_cache.search(user_id=metadata.user_id, query=q, limit=limit)
+    return ORJSONResponse(dict(items=items), headers=cache_headers)
 
 
 @router.post("/vendors")
@@ -54,11 +71,7 @@ def create_vendor(
         user_id=metadata.user_id,
         name=payload.name
     )
-    return dict(
-        id=vendor.id,
-        user_id=vendor.user_id,
-        name=vendor.name
-    )
+    return ORJSONResponse(VENDOR.to_dict(vendor))
 
 
 @router.put("/vendors/{id}")
@@ -73,7 +86,7 @@ def update_vendor(
         name=payload.name
     )
 
-    return vendor
+    return ORJSONResponse(VENDOR.to_dict(vendor))
 
 
 @router.delete("/vendors/{id}", status_code=204)
@@ -0,0 +1,60 @@
+import operator
+from datetime import timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import DateTime, inspect
+
+from persistence.schema import Category, LineItem, Receipt, Transaction, Vendor
+
+
+class ModelSerializer:
+    """
+    Converts ORM objects of a single model into API-safe dicts.
+
+    The column projection is computed once from the mapper, so serializing a row is one attrgetter call
+    plus a timestamp conversion for DateTime columns. Anything exposing the same attribute names
+    (ex. a Row from a column-projected query) can be serialized as well.
+    """
+
+    def __init__(self, model, nested: Dict[str, "ModelSerializer"] = None):
+        column_attrs = inspect(model).column_attrs
+        self.fields = tuple(attr.key for attr in column_attrs)
+        self.nested = nested or dict()
+
+        self._getter = operator.attrgetter(*self.fields)
+        self._datetime_indexes = tuple(
+            i for i, attr in enumerate(column_attrs) if isinstance(attr.columns[0].type, DateTime))
+
+    def to_dict(self, obj: Any) -> dict:
+        values = self._getter(obj)
+
+        if self._datetime_indexes:
+            values = list(values)
+            for i in self._datetime_indexes:
+                value = values[i]
+                if value is not None:
+                    # Stored as naive UTC. Convert to Unix timestamp.
+                    values[i] = value.replace(tzinfo=timezone.utc).timestamp()
+
+        result = dict(zip(self.fields, values))
+        for key, serializer in self.nested.items():
+            result[key] = serializer.many(getattr(obj, key))
+
+        return result
+
+    def one(self, obj: Optional[Any]) -> Optional[dict]:
+        if obj is None:
+            return None
+        return self.to_dict(obj)
+
+    def many(self, objs: Iterable[Any]) -> List[dict]:
+        to_dict = self.to_dict
+        return [to_dict(obj) for obj in objs]
+
+
+VENDOR = ModelSerializer(Vendor)
+CATEGORY = ModelSerializer(Category)
+LINE_ITEM = ModelSerializer(LineItem)
+TRANSACTION = ModelSerializer(Transaction)
+TRANSACTION_WITH_LINE_ITEMS = ModelSerializer(Transaction, nested=dict(line_items=LINE_ITEM))
+RECEIPT = ModelSerializer(Receipt, nested=dict(transactions=TRANSACTION))
@@ -1,27 +1,36 @@
 import logging
 import os
+from datetime import datetime, timezone
+from functools import lru_cache
 from types import SimpleNamespace
 from typing import Callable, List, Optional
 
 import jwt
-from fastapi import Depends, HTTPException, Request
-from fastapi_jwt_auth import AuthJWT
+from fastapi import Depends, HTTPException, Query, Request, Response, WebSocket
 from persistence.database import instance as db_instance
 from pydantic import BaseModel
 
 from api.access import authenticator
-from api.access.authenticator import JWT_KEY, AuthMetadata
+from api.access.authenticator import REFRESH_TOKEN_TTL, AuthMetadata
+from api.etag import NotModified, etag_matches, make_etag
 
 logger = logging.getLogger("receep")
 auth = authenticator.instance
 
 
+APP_INFO_MAX_AGE_SECONDS = 60
+
+REFRESH_COOKIE = "refresh_token"
+# Set to 1 when the app is served over https.
+SECURE_COOKIES = os.getenv("SECURE_COOKIES", "0") == "1"
+
 SIGNUP = os.getenv("SIGNUP")
 assert SIGNUP in ("OPEN", "CLOSED",
                   "INVITE_ONLY"), f"SIGNUP must be one of: OPEN, CLOSED, INVITE_ONLY. {SIGNUP=}"
 
 
 def get_app_info():
+    # Served from cached values; see Database.get_user_count.
     return SimpleNamespace(
         signup=SIGNUP,
         totp_enabled=auth.totp_enabled,
@@ -29,11 +38,58 @@ def get_app_info():
     )
 
 
+def get_app_info_cache_control(app_info: SimpleNamespace) -> str:
+    """
+    App info is the same for everyone, so shared caches (nginx) may keep it.
+    Until the first user signs up, it must not be cached: the UI offers the admin signup based on it.
+    """
+    if app_info.user_count == 0:
+        return "no-cache"
+    return f"public, max-age={APP_INFO_MAX_AGE_SECONDS}"
+
+
+def to_utc(epoch: float) -> datetime:
+    # Timestamps are stored as naive UTC.
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
 def get_jwt_cookie(request: Request):
     return request.cookies.get("jwt")
 
 
+def get_refresh_cookie(request: Request):
+    return request.cookies.get(REFRESH_COOKIE)
+
+
+def set_refresh_cookie(response: Response, result: dict) -> dict:
+    """
+    Moves the refresh token of an auth result into an HttpOnly cookie, out of reach of scripts.
+    Returns the rest of the result.
+    """
+    response.set_cookie(
+        REFRESH_COOKIE,
+        result.pop("refresh_token"),
+        max_age=int(REFRESH_TOKEN_TTL.total_seconds()),
+        path="/",
+        secure=SECURE_COOKIES,
+        httponly=True,
+        samesite="strict",
+    )
+    return result
+
+
+def clear_refresh_cookie(response: Response) -> None:
+    response.delete_cookie(REFRESH_COOKIE, path="/", secure=SECURE_COOKIES, httponly=True, samesite="strict")
+
+
 def get_auth_metadata(*, assert_roles: List[str] = None, assert_jwt: bool = False) -> Callable[[], AuthMetadata]:
+    # Identical arguments yield the same dependency, so FastAPI resolves it once per request
+    # even when several dependencies of an endpoint ask for it.
+    return _get_auth_metadata(tuple(assert_roles or ()), assert_jwt)
+
+
+@lru_cache(maxsize=None)
+def _get_auth_metadata(assert_roles: tuple, assert_jwt: bool) -> Callable[[], AuthMetadata]:
     def wrapper(token: str = Depends(get_jwt_cookie)) -> AuthMetadata:
         metadata = AuthMetadata()
         if token:
@@ -56,15 +112,39 @@ def get_auth_metadata(*, assert_roles: List[str] = None, assert_jwt: bool = Fals
     return wrapper
 
 
-@AuthJWT.load_config
-def get_ws_auth_config():
+def get_websocket_auth_metadata(websocket: WebSocket, token: Optional[str] = Query(None)) -> AuthMetadata:
     """
-    For websocket
+    Browsers send the jwt cookie with the websocket handshake. Other clients can pass the token as a query parameter,
+    which takes precedence over the cookie.
     """
-    class Settings(BaseModel):
-        authjwt_secret_key: str = JWT_KEY
+    token = token or websocket.cookies.get("jwt")
+    if token:
+        try:
+            return auth.get_auth_metadata(token)
+        except jwt.PyJWTError:
+            pass
+    return AuthMetadata()
+
 
-    return Settings()
+def check_etag() -> Callable[[], dict]:
+    """
+    Answers If-None-Match with 304 based on the requesting user's data version, before the endpoint touches the
+    main tables. Only for endpoints whose response is limited to the requesting user's data.
+    Returns the caching headers that the endpoint should attach to its response.
+    """
+
+    def wrapper(
+        request: Request,
+        metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))
+    ) -> dict:
+        version = db_instance.get_data_version(metadata.user_id)
+        etag = make_etag(metadata.user_id, version)
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise NotModified(etag)
+
+        return {"ETag": etag, "Cache-Control": "private, no-cache"}
+    return wrapper
 
 
 class Token(BaseModel):
@@ -0,0 +1,199 @@
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from persistence.database import CHANGES_OVERLAP
+
+# Least recently used users are evicted past this many entries.
+MAX_CACHED_USERS = 256
+# Lines of a receipt's recognized text that are compared with the line item names.
+MAX_OCR_LINES = 200
+
+# How much each source weighs in a category's score. A line item name says more about its category than the
+# vendor, who may sell several kinds of things.
+LINE_ITEM_WEIGHT = 3
+OCR_WEIGHT = 2
+VENDOR_WEIGHT = 1
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def name_key(name: Optional[str]) -> str:
+    """
+    The words of a line item name in lowercase, without punctuation or those with digits. Ex. "Latte 2x (large)" ->
+    "latte large"
+    """
+    if not name:
+        return ""
+    return " ".join(word for word in WORD.findall(name.lower()) if not any(c.isdigit() for c in word))
+
+
+def _subtract(counter: Counter, key) -> None:
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class UserStats:
+    """
+    How often each category was given to line items, overall, per vendor and per line item name.
+    Every transaction's contribution is kept, so a changed transaction replaces it and a deleted one removes it.
+    """
+
+    def __init__(self, version: int, synced_at: datetime):
+        self.version = version
+        self.synced_at = synced_at
+
+        # transaction_id -> (vendor_id, ((name key, category_id), ...))
+        self.transactions: Dict[int, Tuple[Optional[int], Tuple[Tuple[str, int], ...]]] = dict()
+        self.overall = Counter()
+        self.by_vendor: Dict[int, Counter] = defaultdict(Counter)
+        self.by_name: Dict[str, Counter] = defaultdict(Counter)
+
+    def apply(self, rows: List, deleted: List[int]) -> None:
+        """
+        Takes the rows of Database.get_line_item_categories.
+        """
+        line_items: Dict[int, Tuple[Optional[int], list]] = dict()
+        # Most names repeat, so each is normalized once.
+        keys: Dict[str, str] = dict()
+        for transaction_id, vendor_id, name, category_id in rows:
+            if transaction_id not in line_items:
+                line_items[transaction_id] = (vendor_id, [])
+            if category_id is not None:
+                key = keys.get(name)
+                if key is None:
+                    key = keys[name] = name_key(name)
+                line_items[transaction_id][1].append((key, category_id))
+
+        for transaction_id in deleted:
+            self._remove(transaction_id)
+        for transaction_id, (vendor_id, items) in line_items.items():
+            self._remove(transaction_id)
+            self._add(transaction_id, vendor_id, tuple(items))
+
+    def _add(self, transaction_id: int, vendor_id: Optional[int], items: Tuple[Tuple[str, int], ...]) -> None:
+        self.transactions[transaction_id] = (vendor_id, items)
+        for key, category_id in items:
+            self.overall[category_id] += 1
+            if vendor_id is not None:
+                self.by_vendor[vendor_id][category_id] += 1
+            if key:
+                self.by_name[key][category_id] += 1
+
+    def _remove(self, transaction_id: int) -> None:
+        vendor_id, items = self.transactions.pop(transaction_id, (None, ()))
+        for key, category_id in items:
+            _subtract(self.overall, category_id)
+            if vendor_id is not None:
+                _subtract(self.by_vendor[vendor_id], category_id)
+                if not self.by_vendor[vendor_id]:
+                    del self.by_vendor[vendor_id]
+            if key:
+                _subtract(self.by_name[key], category_id)
+                if not self.by_name[key]:
+                    del self.by_name[key]
+
+
+class SuggestionIndex:
+    """
+    Per-user in-memory statistics of the categories given to line items, to suggest the vendor and the categories
+    of a new transaction.
+
+    Like TypeaheadCache, a lookup reads the user's data version and answers from memory when it has not changed.
+    When it has, only the transactions changed since the last read are loaded and applied, so the index follows
+    writes from every API worker at the cost of one small query. load_changes(user_id, since) must return the
+    value of Database.get_line_item_categories, and get_receipt_ocr(receipt_id, user_id) that of
+    Database.get_receipt_ocr.
+    """
+
+    def __init__(self, load_changes: Callable, get_version: Callable[[int], int], get_receipt_ocr: Callable):
+        self.load_changes = load_changes
+        self.get_version = get_version
+        self.get_receipt_ocr = get_receipt_ocr
+
+        self._entries: "OrderedDict[int, UserStats]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_stats(self, user_id: int) -> UserStats:
+        # Read the version first: a write that lands while loading only causes a redundant refresh later.
+        version = self.get_version(user_id)
+
+        with self._lock:
+            stats = self._entries.get(user_id)
+            if stats is not None:
+                self._entries.move_to_end(user_id)
+                if stats.version == version:
+                    return stats
+                since = stats.synced_at - CHANGES_OVERLAP
+            else:
+                since = None
+
+        changes = self.load_changes(user_id, since=since)
+
+        with self._lock:
+            if stats is None:
+                stats = UserStats(version, changes.synced_at)
+                stats.apply(changes.rows, changes.deleted)
+                self._entries[user_id] = stats
+                while len(self._entries) > MAX_CACHED_USERS:
+                    self._entries.popitem(last=False)
+            elif changes.synced_at > stats.synced_at:
+                # Otherwise a concurrent refresh already applied more recent changes.
+                stats.apply(changes.rows, changes.deleted)
+                stats.version, stats.synced_at = version, changes.synced_at
+        return stats
+
+    def suggest(self, user_id: int, vendor_id: Optional[int] = None, receipt_id: Optional[int] = None,
+                name: Optional[str] = None, limit: int = 5) -> dict:
+        """
+        Returns the suggested vendor, if the receipt's OCR named one of the user's vendors and none was given,
+        and up to `limit` categories, best first. Each category's score is the weighted share of the line items
+        that got it, among those with the same name, matching a line of the receipt, or from the same vendor.
+        Without any of these, the user's most used categories are returned.
+        """
+        ocr_lines, vendor = [], None
+        if receipt_id is not None:
+            receipt = self.get_receipt_ocr(receipt_id, user_id)
+            if receipt is not None:
+                ocr_lines = (receipt.text or "").splitlines()[:MAX_OCR_LINES]
+                if vendor_id is None and receipt.vendor_id is not None:
+                    vendor_id = receipt.vendor_id
+                    vendor = dict(id=vendor_id, source="ocr")
+
+        stats = self._get_stats(user_id)
+        with self._lock:
+            sources = []
+            key = name_key(name)
+            if key in stats.by_name:
+                sources.append(("line_item", LINE_ITEM_WEIGHT, Counter(stats.by_name[key])))
+            ocr_counts = Counter()
+            for line in ocr_lines:
+                ocr_counts.update(stats.by_name.get(name_key(line), ()))
+            if ocr_counts:
+                sources.append(("ocr", OCR_WEIGHT, ocr_counts))
+            if vendor_id in stats.by_vendor:
+                sources.append(("vendor", VENDOR_WEIGHT, Counter(stats.by_vendor[vendor_id])))
+            if not sources:
+                sources.append(("overall", 1, Counter(stats.overall)))
+
+        total_weight = sum(weight for _, weight, _ in sources)
+        # category_id -> [score, weighted share of its main source, main source, line items in that source]
+        scores: Dict[int, list] = dict()
+        for source, weight, counts in sources:
+            total = sum(counts.values())
+            for category_id, count in counts.items():
+                share = weight * count / total
+                score = scores.setdefault(category_id, [0.0, 0.0, source, count])
+                score[0] += share / total_weight
+                if share > score[1]:
+                    score[1:] = share, source, count
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1][0], -item[1][3], item[0]))[:limit]
+        return dict(
+            vendor=vendor,
+            categories=[dict(id=category_id, score=round(score, 3), source=source, count=count)
+                        for category_id, (score, _, source, count) in ranked],
+        )
@@ -0,0 +1,90 @@
+import logging
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils import timing
+from utils.metrics import Counter, Histogram
+
+# One line per request: route, status, times and response size, as key=value pairs. The same values are passed
+# as extra fields, which the JSON log format outputs as separate keys.
+request_logger = logging.getLogger("receep.requests")
+
+REQUESTS = Counter("receep_http_requests_total", "HTTP requests, by route template and status.",
+                   ["method", "route", "status"])
+REQUEST_SECONDS = Histogram("receep_http_request_duration_seconds", "Time until the response body was sent.",
+                            ["method", "route"])
+
+
+class TimingMiddleware:
+    """
+    Times every HTTP request and reports where the time went: a Server-Timing header on the response
+    (total, db with the statement count, and the spans recorded with utils.timing.span) and one log line
+    once the body has been sent.
+
+    The header is written when the response starts. Time spent while streaming a body only shows in the log.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_timing = timing.RequestTiming()
+        token = timing.current_request.set(request_timing)
+        status = 500
+        response_bytes = 0
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(request_timing))
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            timing.current_request.reset(token)
+            total = time.perf_counter() - request_timing.started
+            # The router adds the matched route to the scope. Unmatched paths are not labelled by path: any client
+            # could make up new ones.
+            route = scope.get("route")
+            route_label = route.path if route else "unmatched"
+            REQUESTS.inc(method=scope["method"], route=route_label, status=str(status))
+            REQUEST_SECONDS.observe(total, method=scope["method"], route=route_label)
+            if request_logger.isEnabledFor(logging.INFO):
+                log_request(scope, request_timing, total, status, response_bytes)
+
+
+def log_request(scope: Scope, request_timing: timing.RequestTiming, total: float, status: int,
+                response_bytes: int) -> None:
+    route = scope.get("route")
+    fields = dict(
+        method=scope["method"],
+        route=route.path if route else scope["path"],
+        status=status,
+        total_ms=round(total * 1000, 1),
+        db_ms=round(request_timing.db_seconds * 1000, 1),
+        statements=request_timing.statements,
+    )
+    fields.update((f"{name}_ms", round(seconds * 1000, 1)) for name, seconds in request_timing.spans.items())
+    fields["bytes"] = response_bytes
+    request_logger.info(" ".join(f"{key}={value}" for key, value in fields.items()), extra=fields)
+
+
+def server_timing(request_timing: timing.RequestTiming) -> str:
+    total = time.perf_counter() - request_timing.started
+    metrics = [
+        f"total;dur={total * 1000:.1f}",
+        f'db;dur={request_timing.db_seconds * 1000:.1f};desc="{request_timing.statements} statements"',
+    ]
+    metrics += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in request_timing.spans.items()]
+    return ", ".join(metrics)
@@ -0,0 +1,110 @@
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from api.serializers import ModelSerializer
+
+# Users with more names than this are not cached; their lookups go to the (user_id, lower(name)) index instead.
+MAX_CACHED_NAMES = 10000
+# Least recently used users are evicted past this many entries.
+MAX_CACHED_USERS = 256
+
+# Match tiers, best first.
+PREFIX_MATCH = 0
+WORD_PREFIX_MATCH = 1
+SUBSTRING_MATCH = 2
+FUZZY_MATCH = 3
+
+
+def match_tier(name: str, query: str) -> Optional[int]:
+    """
+    Both arguments must be lowercase. Returns None when the name does not match.
+    Ex. for the query "mart": "Martin's" -> PREFIX_MATCH, "Wal Mart" -> WORD_PREFIX_MATCH,
+    "Walmart" -> SUBSTRING_MATCH, "Marathon Taxi" -> FUZZY_MATCH
+    """
+    if name.startswith(query):
+        return PREFIX_MATCH
+
+    position = name.find(query)
+    if position != -1:
+        while position != -1:
+            if not name[position - 1].isalnum():
+                return WORD_PREFIX_MATCH
+            position = name.find(query, position + 1)
+        return SUBSTRING_MATCH
+
+    # Fuzzy: the query's characters appear in order.
+    chars = iter(name)
+    if all(c in chars for c in query):
+        return FUZZY_MATCH
+
+    return None
+
+
+class TypeaheadCache:
+    """
+    Per-user in-memory list of names ranked by usage frequency.
+
+    A user's entry is reloaded whenever their data version changes, so a lookup costs one primary key read
+    when nothing changed. The loader is called as load(user_id, prefix=None, limit=None) and must return rows
+    with the serializer's columns plus a `usage` column. The same loader answers prefix-only lookups for users
+    with too many names to cache.
+    """
+
+    def __init__(self, serializer: ModelSerializer, load: Callable[..., List], get_version: Callable[[int], int]):
+        self.serializer = serializer
+        self.load = load
+        self.get_version = get_version
+
+        # user_id -> (version, [(lowercase name, usage, item)]), or (version, None) when the user has too many names
+        self._entries: "OrderedDict[int, Tuple[int, Optional[list]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _to_item(self, row) -> dict:
+        item = self.serializer.to_dict(row)
+        item["usage_count"] = row.usage
+        return item
+
+    def _get_entries(self, user_id: int) -> Optional[list]:
+        # Read the version first: a write that lands while loading only causes a redundant reload later.
+        version = self.get_version(user_id)
+
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached[0] == version:
+                self._entries.move_to_end(user_id)
+                return cached[1]
+
+        rows = self.load(user_id, limit=MAX_CACHED_NAMES + 1)
+        if len(rows) > MAX_CACHED_NAMES:
+            entries = None
+        else:
+            entries = [(row.name.lower(), row.usage, self._to_item(row)) for row in rows]
+
+        with self._lock:
+            self._entries[user_id] = (version, entries)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > MAX_CACHED_USERS:
+                self._entries.popitem(last=False)
+
+        return entries
+
+    def search(self, user_id: int, query: str, limit: int) -> List[dict]:
+        """
+        Returns up to `limit` items matching the query, best match tier first and most used first within a tier.
+        An empty query returns the most used names.
+        """
+        query = query.strip().lower()
+        entries = self._get_entries(user_id)
+
+        if entries is None:
+            return [self._to_item(row) for row in self.load(user_id, prefix=query, limit=limit)]
+
+        ranked = []
+        for name, usage, item in entries:
+            tier = match_tier(name, query) if query else PREFIX_MATCH
+            if tier is not None:
+                ranked.append((tier, -usage, name, item))
+
+        return [item for *_, item in heapq.nsmallest(limit, ranked, key=lambda r: r[:3])]
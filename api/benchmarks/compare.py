@@ -0,0 +1,49 @@
+"""
+Compares two result files of benchmarks.run by median time:
+
+    python -m benchmarks.compare baseline.json results.json --threshold 10
+
+Exits with 1 if any benchmark got slower than the threshold (in percent), so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+from typing import Dict
+
+
+def load_results(path: str) -> Dict[str, dict]:
+    with open(path) as f:
+        return {result["name"]: result for result in json.load(f)["results"] if "skipped" not in result}
+
+
+def compare(baseline: Dict[str, dict], current: Dict[str, dict], threshold: float) -> bool:
+    """
+    Prints one line per benchmark. Returns whether any benchmark regressed beyond the threshold.
+    """
+    regressed = False
+    print(f"{'benchmark':<45} {'baseline ms':>12} {'current ms':>12} {'change':>9}")
+    for name in sorted(baseline.keys() | current.keys()):
+        if name not in baseline or name not in current:
+            print(f"{name:<45} {'only in ' + ('current' if name in current else 'baseline'):>35}")
+            continue
+
+        before, after = baseline[name]["median_ms"], current[name]["median_ms"]
+        change = (after - before) / before * 100 if before else 0
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            regressed = True
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<45} {before:>12.3f} {after:>12.3f} {change:>+8.1f}%{flag}")
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10, help="percent change reported as a regression")
+    args = parser.parse_args()
+
+    sys.exit(1 if compare(load_results(args.baseline), load_results(args.current), args.threshold) else 0)
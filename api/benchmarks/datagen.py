@@ -0,0 +1,164 @@
+"""
+Synthetic data for the benchmarks. Everything is derived from a seed, so two runs with the same arguments
+produce the same rows and the same files.
+"""
+import hashlib
+import io
+import random
+import string
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Iterator, List
+
+from PIL import Image
+from sqlalchemy import Engine, insert
+
+from persistence.schema import Base, Category, LineItem, Receipt, Transaction, User, Vendor
+
+INSERT_BATCH_SIZE = 5000
+# Transactions are spread over this many days, ending at DATA_END.
+DATA_DAYS = 3 * 365
+DATA_END = datetime(2025, 1, 1)
+
+VENDOR_WORDS = ["Market", "Grocer", "Cafe", "Hardware", "Pharmacy", "Books", "Garden", "Fuel", "Bakery", "Deli",
+                "Electronics", "Outfitters", "Kitchen", "Supply", "Depot", "Mart", "Express", "Co"]
+CATEGORY_NAMES = ["Groceries", "Dining", "Transport", "Utilities", "Rent", "Health", "Entertainment", "Clothing",
+                  "Household", "Gifts", "Travel", "Education", "Insurance", "Pets", "Subscriptions", "Misc"]
+
+# One receipt per this many transactions.
+TRANSACTIONS_PER_RECEIPT = 4
+
+
+def _batches(rows: List[dict]) -> Iterator[List[dict]]:
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        yield rows[i:i + INSERT_BATCH_SIZE]
+
+
+def _insert_returning_ids(conn, model, rows: List[dict]) -> List[int]:
+    ids = []
+    for batch in _batches(rows):
+        ids.extend(conn.execute(insert(model).returning(model.id, sort_by_parameter_order=True), batch).scalars())
+    return ids
+
+
+def _vendor_names(rng: random.Random, count: int) -> List[str]:
+    names = set()
+    while len(names) < count:
+        prefix = "".join(rng.choices(string.ascii_uppercase, k=1)) + "".join(rng.choices(string.ascii_lowercase, k=4))
+        names.add(f"{prefix} {rng.choice(VENDOR_WORDS)}")
+    return sorted(names)
+
+
+def seed_database(
+    engine: Engine,
+    users: int,
+    vendors_per_user: int,
+    categories_per_user: int,
+    transactions: int,
+    line_items_per_transaction: int,
+    seed: int = 0,
+) -> SimpleNamespace:
+    """
+    Drops and recreates every table, then inserts the dataset. Transactions are split evenly across the users.
+    Returns user_ids, vendor_names ({user_id: [names]}) and counts ({table: rows}).
+    """
+    rng = random.Random(seed)
+    dataset = SimpleNamespace(user_ids=[], vendor_names=dict(), counts=dict())
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        dataset.user_ids = _insert_returning_ids(conn, User, [
+            dict(username=f"bench-{i}", config=dict()) for i in range(users)])
+
+        vendor_ids, category_ids = dict(), dict()
+        for user_id in dataset.user_ids:
+            names = _vendor_names(rng, vendors_per_user)
+            dataset.vendor_names[user_id] = names
+            vendor_ids[user_id] = _insert_returning_ids(conn, Vendor, [
+                dict(user_id=user_id, name=name) for name in names])
+            category_ids[user_id] = _insert_returning_ids(conn, Category, [
+                dict(user_id=user_id, name=CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + (f" {i}" if i >= 16 else ""))
+                for i in range(categories_per_user)])
+
+        transactions_per_user = transactions // users
+        line_item_count = 0
+        receipt_count = 0
+        for user_id in dataset.user_ids:
+            receipts = [
+                dict(user_id=user_id, content_type="image/jpeg", content_length=rng.randint(50_000, 5_000_000),
+                     content_hash=hashlib.sha256(f"{seed}-{user_id}-{i}".encode()).hexdigest(),
+                     rotation=0, ocr_metadata=dict())
+                for i in range(transactions_per_user // TRANSACTIONS_PER_RECEIPT)]
+            receipt_ids = _insert_returning_ids(conn, Receipt, receipts)
+            receipt_count += len(receipt_ids)
+
+            # Skewed vendor usage, like real spending: a few vendors get most transactions.
+            vendor_weights = [1 / (rank + 1) for rank in range(len(vendor_ids[user_id]))]
+            transaction_rows, amounts = [], []
+            for i in range(transactions_per_user):
+                items = [round(rng.uniform(1, 150), 2) for _ in range(line_items_per_transaction)]
+                amounts.append(items)
+                transaction_rows.append(dict(
+                    user_id=user_id,
+                    vendor_id=rng.choices(vendor_ids[user_id], weights=vendor_weights)[0],
+                    receipt_id=receipt_ids[i // TRANSACTIONS_PER_RECEIPT]
+                    if i // TRANSACTIONS_PER_RECEIPT < len(receipt_ids) else None,
+                    amount=sum(items),
+                    timestamp=DATA_END - timedelta(seconds=rng.randint(0, DATA_DAYS * 86400)),
+                ))
+            transaction_ids = _insert_returning_ids(conn, Transaction, transaction_rows)
+
+            line_items = [
+                dict(name=f"item {j}", transaction_id=transaction_id, amount_input=str(amount), amount=amount,
+                     category_id=rng.choice(category_ids[user_id]))
+                for transaction_id, items in zip(transaction_ids, amounts)
+                for j, amount in enumerate(items)]
+            for batch in _batches(line_items):
+                conn.execute(insert(LineItem), batch)
+            line_item_count += len(line_items)
+
+    dataset.counts = dict(
+        users=len(dataset.user_ids),
+        vendors=sum(len(names) for names in dataset.vendor_names.values()),
+        transactions=transactions_per_user * len(dataset.user_ids),
+        line_items=line_item_count,
+        receipts=receipt_count,
+    )
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    return dataset
+
+
+def make_image(width: int, height: int, image_format: str = "JPEG", seed: int = 0) -> bytes:
+    """
+    A noisy image, so that it compresses about as badly as a photo of a receipt.
+    """
+    rng = random.Random(seed)
+    noise = Image.frombytes("L", (width // 4, height // 4), rng.randbytes((width // 4) * (height // 4)))
+    img = Image.merge("RGB", [noise, noise.rotate(90, expand=False), noise.transpose(Image.FLIP_LEFT_RIGHT)])
+    img = img.resize((width, height))
+
+    buffer = io.BytesIO()
+    img.save(buffer, image_format, **(dict(quality=85) if image_format == "JPEG" else dict()))
+    return buffer.getvalue()
+
+
+def make_pdf(pages: int, width: int = 1275, height: int = 1650, seed: int = 0) -> bytes:
+    """
+    A PDF with one scanned-looking page per image, at 150 dpi letter size by default.
+    """
+    images = [Image.open(io.BytesIO(make_image(width, height, seed=seed + i))) for i in range(pages)]
+
+    buffer = io.BytesIO()
+    images[0].save(buffer, "PDF", save_all=True, append_images=images[1:], resolution=150)
+    return buffer.getvalue()
+
+
+def unique_copies(payload: bytes, count: int) -> List[bytes]:
+    """
+    Copies that hash differently: receipts are deduplicated by content hash. JPEG and PDF readers
+    ignore bytes after the end of the file.
+    """
+    return [payload + f"\n{i}".encode() for i in range(count)]
@@ -0,0 +1,60 @@
+"""
+Production server settings: gunicorn managing Uvicorn workers. start.sh uses it unless RELOAD=1.
+
+The app is built once in the master before forking (preload_app); building it does no I/O. Each worker opens
+its own database pool when it first needs a connection, in its lifespan startup. The schema is migrated by
+`python -m persistence.migrations` before gunicorn starts, never by the workers.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+
+# Set before the app is loaded, so that every worker writes its metrics there. See utils/metrics.py.
+metrics_dir = os.environ.setdefault("METRICS_DIR", "/tmp/receep-metrics")
+
+bind = os.getenv("BIND", "0.0.0.0:80")
+worker_class = "uvicorn.workers.UvicornWorker"
+# PIL, hashing and JSON encoding hold the GIL, so one worker per core.
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+preload_app = True
+
+# Workers are recycled after this many requests, give or take the jitter, to bound slow leaks. 0 disables it.
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+# Seconds that stopping workers get to finish in-flight requests, on SIGTERM or when recycled.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Uploads of large PDFs can take a while; the timeout only applies to a worker that stops responding.
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
+
+accesslog = None
+errorlog = "-"
+loglevel = "info"
+
+logger = logging.getLogger("receep")
+
+
+def on_starting(server):
+    # Values left by a previous server would be added to this one's.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    # Runs in the master, after the preload and before the first fork.
+    if workers > 1 and os.getenv("EVENT_BROKER", "postgres") == "memory":
+        logger.warning(f"EVENT_BROKER=memory only notifies websockets held by the writing worker. {workers=}")
+
+
+def post_fork(server, worker):
+    from persistence.database import dispose_engine
+
+    # The master should not have connected, but if something did, the worker must not reuse its sockets.
+    dispose_engine(close=False)
+
+
+def child_exit(server, worker):
+    from utils.metrics import REGISTRY
+
+    REGISTRY.archive_process(worker.pid)
@@ -0,0 +1,289 @@
+"""
+Replays a mix of receep traffic against a running API and reports latency and throughput per endpoint.
+
+Signs up --users users and seeds each with categories, vendors, receipts and transactions through the API.
+Then every user runs scenarios picked by weight, back to back, for --duration seconds:
+
+    login           POST /login
+    initial_load    GET /me and GET /sync, like the UI's fetchInitialData
+    pagination      walks the receipt, transaction, vendor and category pages until they run out
+    receipt_grid    a page of receipts, then one /jwt/check per thumbnail, like nginx's auth_request
+    upload          POST /receipts with a new JPEG
+    transaction     POST /transactions with a few line items
+    report          the annual expense report columns and the monthly totals
+
+Run it against a running API with SIGNUP=OPEN. The results are in the format of benchmarks.run, so
+benchmarks.compare can diff them against a baseline:
+
+    python -m loadtest.traffic_mix --base-url http://localhost:8000 --users 20 --duration 60 --output mix.json
+    python -m benchmarks.compare baseline.json mix.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import requests
+
+from benchmarks import datagen
+
+SCENARIOS = ("login", "initial_load", "pagination", "receipt_grid", "upload", "transaction", "report")
+DEFAULT_WEIGHTS = dict(login=1, initial_load=2, pagination=1, receipt_grid=6, upload=2, transaction=4, report=2)
+PAGE_LIMIT = 100
+REPORT_TIMEZONE = "America/Vancouver"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Stats:
+    """
+    Latencies and errors per endpoint. Endpoints are named by method and route, without ids or query strings.
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def results(self, elapsed: float) -> List[dict]:
+        results = []
+        for name in sorted(self.latencies.keys() | self.errors.keys()):
+            latencies = self.latencies[name]
+            result = dict(name=name, requests=len(latencies), errors=self.errors[name],
+                          requests_per_second=round(len(latencies) / elapsed, 1))
+            if latencies:
+                result.update(
+                    median_ms=round(percentile(latencies, 50) * 1000, 1),
+                    p95_ms=round(percentile(latencies, 95) * 1000, 1),
+                    p99_ms=round(percentile(latencies, 99) * 1000, 1),
+                    mean_ms=round(statistics.mean(latencies) * 1000, 1),
+                )
+            results.append(result)
+        return results
+
+
+class VirtualUser:
+    """
+    One signed-up user with its own session. Its requests are made one at a time, from a worker thread.
+    """
+
+    def __init__(self, base_url: str, stats: Stats, rng: random.Random):
+        self.base_url = base_url
+        self.stats = stats
+        self.rng = rng
+        self.session = requests.Session()
+        self.username = f"mix-{uuid.uuid4().hex[:12]}"
+        self.password = uuid.uuid4().hex
+        self.user_id = None
+        self.category_ids: List[int] = []
+        self.vendor_ids: List[int] = []
+        self.receipt_ids: List[int] = []
+        self.image = datagen.make_image(1200, 1600, seed=rng.randint(0, 1000))
+        self.uploads = 0
+
+    def request(self, method: str, name: str, path: str, record: bool = True, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, **kwargs)
+        except requests.RequestException:
+            if record:
+                self.stats.errors[name] += 1
+            raise
+        elapsed = time.perf_counter() - started
+
+        if record:
+            if response.ok:
+                self.stats.latencies[name].append(elapsed)
+            else:
+                self.stats.errors[name] += 1
+        response.raise_for_status()
+        return response
+
+    def set_token(self, token: str) -> None:
+        self.session.cookies.set("jwt", token)
+
+    def signup(self) -> None:
+        response = self.request("POST", "POST /signup", "/signup", record=False,
+                                json=dict(username=self.username, password=self.password))
+        self.set_token(response.json()["token"])
+        self.user_id = self.request("GET", "GET /me", "/me", record=False).json()["user_id"]
+
+    def seed(self, categories: int, vendors: int, receipts: int, transactions: int) -> None:
+        for i in range(categories):
+            category = self.request("POST", "POST /categories", "/categories", record=False, json=dict(
+                id=0, name=f"{datagen.CATEGORY_NAMES[i % len(datagen.CATEGORY_NAMES)]} {i}", description="",
+                user_id=str(self.user_id), with_autotax=True)).json()
+            self.category_ids.append(category["id"])
+        for i in range(vendors):
+            vendor = self.request("POST", "POST /vendors", "/vendors", record=False,
+                                  json=dict(name=f"Vendor {i} {self.rng.choice(datagen.VENDOR_WORDS)}")).json()
+            self.vendor_ids.append(vendor["id"])
+        for _ in range(receipts):
+            self.upload(record=False)
+        for _ in range(transactions):
+            self.create_transaction(record=False)
+
+    def upload(self, record: bool = True) -> None:
+        self.uploads += 1
+        # Receipts are deduplicated by content hash, so every upload of every run must differ.
+        payload = self.image + f"\n{self.username} {self.uploads}".encode()
+        receipt = self.request("POST", "POST /receipts", "/receipts", record=record,
+                               files=dict(file=("receipt.jpg", payload, "image/jpeg"))).json()
+        self.receipt_ids.append(receipt["id"])
+
+    def create_transaction(self, record: bool = True) -> None:
+        line_items = []
+        for i in range(self.rng.randint(1, 5)):
+            amount = round(self.rng.uniform(1, 150), 2)
+            line_items.append(dict(name=f"item {i}", amount_input=str(amount), amount=amount, notes=None,
+                                   category_id=self.rng.choice(self.category_ids)))
+        timestamp = datetime.now() - timedelta(seconds=self.rng.randint(0, 365 * 86400))
+        self.request("POST", "POST /transactions", "/transactions", record=record, json=dict(
+            line_items=line_items,
+            vendor_id=str(self.rng.choice(self.vendor_ids)),
+            receipt_id=str(self.rng.choice(self.receipt_ids)) if self.receipt_ids else None,
+            timestamp=timestamp.timestamp(),
+        ))
+
+    def login(self) -> None:
+        response = self.request("POST", "POST /login", "/login",
+                                json=dict(username=self.username, password=self.password))
+        self.set_token(response.json()["token"])
+
+    def initial_load(self) -> None:
+        self.request("GET", "GET /me", "/me")
+        self.request("GET", "GET /sync", "/sync")
+
+    def pagination(self) -> None:
+        for resource in ("receipts", "transactions", "vendors", "categories"):
+            offset = 0
+            while True:
+                page = self.request("GET", f"GET /{resource}/paginated", f"/{resource}/paginated",
+                                    params=dict(offset=offset, limit=PAGE_LIMIT)).json()
+                if not page["items"]:
+                    break
+                offset = page["next_offset"]
+
+    def receipt_grid(self, thumbnails: int) -> None:
+        page = self.request("GET", "GET /receipts/paginated", "/receipts/paginated",
+                            params=dict(offset=0, limit=PAGE_LIMIT)).json()
+        for _ in page["items"][:thumbnails]:
+            self.request("GET", "GET /jwt/check", "/jwt/check")
+
+    def report(self) -> None:
+        end = datetime.now()
+        params = dict(start=(end - timedelta(days=365)).timestamp(), end=end.timestamp(), timezone=REPORT_TIMEZONE)
+        self.request("GET", "GET /reports/annual-expense-report/columns", "/reports/annual-expense-report/columns",
+                     params=params)
+        self.request("GET", "GET /reports/monthly-expenses", "/reports/monthly-expenses", params=params)
+
+
+async def run_user(user: VirtualUser, scenarios: Dict[str, Callable[[], None]], weights: List[float],
+                   deadline: float) -> Dict[str, int]:
+    ran = defaultdict(int)
+    names = list(scenarios)
+    while time.perf_counter() < deadline:
+        name = user.rng.choices(names, weights=weights)[0]
+        try:
+            await asyncio.to_thread(scenarios[name])
+        except requests.RequestException:
+            # Already counted as an error of the failing endpoint.
+            pass
+        ran[name] += 1
+    return ran
+
+
+async def main(args) -> Dict:
+    # Every virtual user blocks a thread while its request is in flight.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.users))
+    stats = Stats()
+    users = [VirtualUser(args.base_url, stats, random.Random(args.seed + i)) for i in range(args.users)]
+
+    # The first signups on a fresh database create the admin and basic roles, so they must not race.
+    for user in users:
+        await asyncio.to_thread(user.signup)
+    started = time.perf_counter()
+    await asyncio.gather(*(asyncio.to_thread(
+        user.seed, args.categories, args.vendors, args.receipts, args.transactions) for user in users))
+    seed_seconds = time.perf_counter() - started
+
+    weights = dict(DEFAULT_WEIGHTS)
+    for override in args.weight or []:
+        name, _, weight = override.partition("=")
+        weights[name] = float(weight)
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    ran = await asyncio.gather(*(run_user(user, dict(
+        login=user.login,
+        initial_load=user.initial_load,
+        pagination=user.pagination,
+        receipt_grid=lambda user=user: user.receipt_grid(args.thumbnails),
+        upload=user.upload,
+        transaction=user.create_transaction,
+        report=user.report,
+    ), [weights[name] for name in SCENARIOS], deadline) for user in users))
+    elapsed = time.perf_counter() - started
+
+    scenario_counts = defaultdict(int)
+    for counts in ran:
+        for name, count in counts.items():
+            scenario_counts[name] += count
+    results = stats.results(elapsed)
+    return dict(
+        meta=dict(
+            created_at=datetime.now().isoformat(timespec="seconds"),
+            base_url=args.base_url,
+            users=args.users,
+            duration_seconds=round(elapsed, 3),
+            seed_seconds=round(seed_seconds, 3),
+            dataset=dict(categories=args.categories, vendors=args.vendors, receipts=args.receipts,
+                         transactions=args.transactions),
+            weights=weights,
+            scenarios=dict(scenario_counts),
+            requests=sum(result["requests"] for result in results),
+            requests_per_second=round(sum(result["requests"] for result in results) / elapsed, 1),
+            errors=sum(result["errors"] for result in results),
+        ),
+        results=results,
+    )
+
+
+def parse_weight(value: str) -> str:
+    name, sep, weight = value.partition("=")
+    if not sep or name not in SCENARIOS:
+        raise argparse.ArgumentTypeError(f"expected <scenario>=<weight> with one of {', '.join(SCENARIOS)}")
+    float(weight)
+    return value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000", help="API root, without the /api prefix")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of traffic, after seeding")
+    parser.add_argument("--categories", type=int, default=8, help="seeded per user")
+    parser.add_argument("--vendors", type=int, default=30, help="seeded per user")
+    parser.add_argument("--receipts", type=int, default=20, help="seeded per user")
+    parser.add_argument("--transactions", type=int, default=200, help="seeded per user")
+    parser.add_argument("--thumbnails", type=int, default=50, help="/jwt/check calls per receipt grid at most")
+    parser.add_argument("--weight", type=parse_weight, action="append",
+                        help="override a scenario's weight, ex. --weight upload=0 (repeatable)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,132 @@
+"""
+Measures how long change notifications take to reach connected websocket clients.
+
+Signs up --users users, opens --clients-per-user websockets for each, then runs --rounds rounds in which every
+user creates a vendor at the same time. Latency is measured from the start of the write request to the arrival of
+the notification on each of the user's sockets.
+
+Run it against a running API with SIGNUP=OPEN, ideally with several workers so that notifications cross processes:
+
+    python -m loadtest.ws_latency --base-url http://localhost:8000 --users 50 --clients-per-user 4
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from typing import Dict, List
+
+import requests
+import websockets
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def signup(base_url: str) -> str:
+    username = f"load-{uuid.uuid4().hex[:12]}"
+    response = requests.post(f"{base_url}/signup", json=dict(username=username, password=uuid.uuid4().hex))
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+def create_vendor(base_url: str, token: str) -> None:
+    response = requests.post(f"{base_url}/vendors", json=dict(name=uuid.uuid4().hex[:32]), cookies=dict(jwt=token))
+    response.raise_for_status()
+
+
+class Client:
+    def __init__(self, socket):
+        self.socket = socket
+        self.arrivals: asyncio.Queue = asyncio.Queue()
+
+    async def read_forever(self) -> None:
+        async for message in self.socket:
+            if json.loads(message)["topic"] == "changes":
+                self.arrivals.put_nowait(time.perf_counter())
+
+
+async def run_round(base_url: str, token: str, clients: List[Client], timeout: float) -> List[float]:
+    started = time.perf_counter()
+    await asyncio.to_thread(create_vendor, base_url, token)
+
+    latencies = []
+    for client in clients:
+        try:
+            arrived = await asyncio.wait_for(client.arrivals.get(), timeout)
+        except asyncio.TimeoutError:
+            continue
+        latencies.append(arrived - started)
+    return latencies
+
+
+async def main(args) -> Dict:
+    ws_url = args.base_url.replace("http", "ws", 1) + "/ws"
+    # The first signup on a fresh database creates the roles, so it must not race with the others.
+    tokens = [await asyncio.to_thread(signup, args.base_url)]
+    tokens += await asyncio.gather(*(asyncio.to_thread(signup, args.base_url) for _ in range(args.users - 1)))
+
+    clients: Dict[str, List[Client]] = dict()
+    for token in tokens:
+        sockets = await asyncio.gather(*(
+            websockets.connect(f"{ws_url}?token={token}", max_queue=None) for _ in range(args.clients_per_user)))
+        clients[token] = [Client(socket) for socket in sockets]
+
+    readers = [asyncio.create_task(c.read_forever()) for user_clients in clients.values() for c in user_clients]
+
+    latencies: List[float] = []
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        results = await asyncio.gather(*(
+            run_round(args.base_url, token, clients[token], args.timeout) for token in tokens))
+        for result in results:
+            latencies.extend(result)
+        # Let the batch window pass so that rounds are not coalesced into each other.
+        await asyncio.sleep(args.pause)
+    elapsed = time.perf_counter() - started
+
+    for reader in readers:
+        reader.cancel()
+    for user_clients in clients.values():
+        for client in user_clients:
+            await client.socket.close()
+
+    expected = args.users * args.clients_per_user * args.rounds
+    result = dict(
+        users=args.users,
+        clients=args.users * args.clients_per_user,
+        rounds=args.rounds,
+        expected=expected,
+        delivered=len(latencies),
+        elapsed_seconds=round(elapsed, 3),
+    )
+    if latencies:
+        result.update(
+            p50_ms=round(percentile(latencies, 50) * 1000, 1),
+            p95_ms=round(percentile(latencies, 95) * 1000, 1),
+            p99_ms=round(percentile(latencies, 99) * 1000, 1),
+            max_ms=round(max(latencies) * 1000, 1),
+            mean_ms=round(statistics.mean(latencies) * 1000, 1),
+        )
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000", help="API root, without the /api prefix")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--clients-per-user", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=5, help="seconds to wait for each notification")
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds between rounds")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -1,10 +1,25 @@
 import os
-from typing import Callable, Tuple
+import time
+from typing import Callable, List, Tuple
 
 from pdf2image import convert_from_path
 from PIL import Image, ImageOps
 
+from utils.metrics import Counter, Gauge, Histogram
+
 DEFAULT_THUMBNAIL_SIZE = (200, 200)  # Set the thumbnail size (width, height)
+# Content types that get their own metric labels. The others are counted as "other".
+METRIC_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif", "image/heic", "application/pdf"}
+
+THUMBNAIL_SECONDS = Histogram("receep_thumbnail_duration_seconds", "Time to generate a thumbnail.",
+                              ["content_type"])
+THUMBNAIL_FAILURES = Counter("receep_thumbnail_failures_total", "Thumbnails that could not be generated.",
+                             ["content_type"])
+THUMBNAILS_IN_PROGRESS = Gauge("receep_thumbnails_in_progress", "Thumbnails being generated right now.")
+
+
+def content_type_label(content_type: str) -> str:
+    return content_type if content_type in METRIC_CONTENT_TYPES else "other"
 
 
 def _get_thumb_path(path):
@@ -20,24 +35,50 @@ def _normalize_jpeg_mode(img: Image.Image) -> Image.Image:
     return img.convert("RGB")
 
 
-def _process_image(source_path, output_path, thumb_size):
+def load_image(source_path: str) -> Image.Image:
+    """
+    The image, turned upright according to its EXIF orientation.
+    """
     with Image.open(source_path) as source_img:
-        img = ImageOps.exif_transpose(source_img)
-        img.thumbnail(thumb_size)
-        save_kwargs = {"quality": 70}
-        exif = img.getexif()
-        if exif:
-            save_kwargs["exif"] = exif.tobytes()
-        _normalize_jpeg_mode(img).save(output_path, "JPEG", **save_kwargs)
+        return ImageOps.exif_transpose(source_img)
 
 
-def _process_pdf(source_path, output_path: str, thumb_size: Tuple[int, int]):
-    images = convert_from_path(source_path, dpi=150, first_page=1, last_page=1)
+def render_pdf(source_path: str, dpi: int, last_page: int = 1) -> List[Image.Image]:
+    """
+    Renders the pages of a PDF up to last_page.
+    """
+    images = convert_from_path(source_path, dpi=dpi, first_page=1, last_page=last_page)
     if not images:
         raise RuntimeError("Conversion failed")
+    return images
 
-    images[0].thumbnail(thumb_size)
-    images[0].convert("RGB").save(output_path, "JPEG", quality=70)
+
+def render_pages(content_type: str, source_path: str, dpi: int, max_pages: int) -> List[Image.Image]:
+    """
+    Renderings of a receipt for further processing: the upright image, or the first max_pages pages of a PDF.
+    dpi only applies to PDFs.
+    """
+    if content_type.startswith("image/"):
+        return [load_image(source_path)]
+    if content_type == "application/pdf":
+        return render_pdf(source_path, dpi, last_page=max_pages)
+    raise RuntimeError(f"Cannot render the given content type. {content_type=}")
+
+
+def _process_image(source_path, output_path, thumb_size):
+    img = load_image(source_path)
+    img.thumbnail(thumb_size)
+    save_kwargs = {"quality": 70}
+    exif = img.getexif()
+    if exif:
+        save_kwargs["exif"] = exif.tobytes()
+    _normalize_jpeg_mode(img).save(output_path, "JPEG", **save_kwargs)
+
+
+def _process_pdf(source_path, output_path: str, thumb_size: Tuple[int, int]):
+    image = render_pdf(source_path, dpi=150)[0]
+    image.thumbnail(thumb_size)
+    image.convert("RGB").save(output_path, "JPEG", quality=70)
 
 
 PROCESSOR_MAPPING: Tuple[Callable[[str], Callable[[str, str, Tuple[int, int]], None]]] = [
@@ -57,7 +98,17 @@ def generate_thumbnail(content_type: str, source_path: str, thumb_size: Tuple[in
     output_path = _get_thumb_path(source_path)
     for match, func in PROCESSOR_MAPPING:
         if match(content_type):
-            func(source_path, output_path, thumb_size)
+            label = content_type_label(content_type)
+            started = time.perf_counter()
+            THUMBNAILS_IN_PROGRESS.inc()
+            try:
+                func(source_path, output_path, thumb_size)
+            except Exception:
+                THUMBNAIL_FAILURES.inc(content_type=label)
+                raise
+            finally:
+                THUMBNAILS_IN_PROGRESS.dec()
+            THUMBNAIL_SECONDS.observe(time.perf_counter() - started, content_type=label)
             return
 
     raise RuntimeError(
@@ -0,0 +1,415 @@
+"""
+Recognizes the text of receipts after upload and guesses their total, date and vendor.
+
+PDFs with embedded text are read with pdftotext. Images and scanned PDFs are rendered by logic.img and recognized
+by Tesseract. Both are command line tools (poppler-utils and tesseract-ocr), run as subprocesses on a small
+thread pool per API worker, so uploads do not wait for them.
+
+The summary goes to Receipt.ocr_metadata, and the text with the box of every line to ReceiptText:
+
+    {"status": "done", "version": 1, "engine": "tesseract", "rotation": 90,
+     "total": {"value": 12.5, "page": 0, "box": [0.1, 0.8, 0.9, 0.83]},
+     "date": {"value": "2024-03-01", ...}, "vendor": {"value": "Corner Store", ...}}
+
+Boxes are [x0, y0, x1, y1] as fractions of the page, in the orientation given by "rotation". A guess that could
+not be made is null. Receipts that failed have {"status": "failed"}; those never processed have no status.
+
+Receipts uploaded before OCR, or while it was off or not installed, are processed by the backfill:
+
+    python -m logic.ocr [--workers N] [--limit N] [--retry-failed]
+"""
+import argparse
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from collections import Counter as CounterDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import List, Optional, Sequence, Tuple
+from xml.etree import ElementTree
+
+from PIL import Image
+
+from logic import receep
+from logic.img import render_pages
+from persistence.database import Database
+from persistence.database import instance as db_instance
+from persistence.exceptions import NotFound
+from utils.metrics import Counter, Histogram
+
+logger = logging.getLogger("receep")
+
+# Receipts recognized at the same time by each API worker. 0 turns off OCR after upload; the backfill still works.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "1"))
+# Receipts waiting for a worker beyond this are left to the backfill instead of piling up in memory.
+OCR_QUEUE_LIMIT = int(os.getenv("OCR_QUEUE_LIMIT", "100"))
+# Pages of a PDF that are read.
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "3"))
+# Tesseract language packs. Ex. "eng+deu"
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "eng")
+# How numeric dates such as 03/04/2024 are read when both orders are valid: "MDY" or "DMY".
+OCR_DATE_ORDER = os.getenv("OCR_DATE_ORDER", "MDY")
+
+VERSION = 1
+OCR_DPI = 300
+# Embedded PDF text shorter than this (ex. a scan with a stamped page number) is recognized from the rendering.
+MIN_PDF_TEXT_CHARS = 20
+SUBPROCESS_TIMEOUT_SECONDS = 120
+# Receipts read per query by the backfill.
+BACKFILL_BATCH_SIZE = 100
+
+OCR_SECONDS = Histogram("receep_ocr_duration_seconds", "Time to recognize a receipt.", ["engine"],
+                        buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+# result is "done", "failed", "discarded" (deleted or rotated meanwhile) or "unavailable" (engine not installed).
+OCR_RESULTS = Counter("receep_ocr_total", "Receipts processed by OCR, by result.", ["result"])
+
+
+class OcrUnavailable(Exception):
+    """
+    The command line tool that a receipt needs is not installed. The receipt is left for a later backfill.
+    """
+
+
+def _box(x0: float, y0: float, x1: float, y1: float, width: float, height: float) -> List[float]:
+    return [round(x0 / width, 4), round(y0 / height, 4), round(x1 / width, 4), round(y1 / height, 4)]
+
+
+def parse_tesseract_tsv(tsv: str, width: int, height: int, page: int = 0) -> List[dict]:
+    """
+    Groups the words of Tesseract's TSV output into lines, in reading order.
+    """
+    lines = dict()
+    for row in tsv.splitlines()[1:]:
+        fields = row.split("\t")
+        # Level 5 rows are words. Empty words and those with a negative confidence are layout placeholders.
+        if len(fields) < 12 or fields[0] != "5" or not fields[11].strip() or float(fields[10]) < 0:
+            continue
+        left, top, word_width, word_height = (int(value) for value in fields[6:10])
+        line = lines.setdefault(tuple(fields[2:5]), dict(words=[], confidences=[], box=[left, top, left, top]))
+        line["words"].append(fields[11].strip())
+        line["confidences"].append(float(fields[10]))
+        box = line["box"]
+        box[0], box[1] = min(box[0], left), min(box[1], top)
+        box[2], box[3] = max(box[2], left + word_width), max(box[3], top + word_height)
+
+    return [
+        dict(page=page, text=" ".join(line["words"]), box=_box(*line["box"], width, height),
+             confidence=round(sum(line["confidences"]) / len(line["confidences"]), 1))
+        for line in lines.values()
+    ]
+
+
+def parse_pdftotext_bbox(xhtml: str) -> List[dict]:
+    """
+    Reads the lines of `pdftotext -bbox-layout` output. Embedded text has no confidence.
+    """
+    namespace = "{http://www.w3.org/1999/xhtml}"
+    lines = []
+    for page_index, page in enumerate(ElementTree.fromstring(xhtml).iter(f"{namespace}page")):
+        width, height = float(page.get("width")), float(page.get("height"))
+        for line in page.iter(f"{namespace}line"):
+            words = [word.text.strip() for word in line.iter(f"{namespace}word") if word.text and word.text.strip()]
+            if not words:
+                continue
+            box = _box(*(float(line.get(key)) for key in ("xMin", "yMin", "xMax", "yMax")), width, height)
+            lines.append(dict(page=page_index, text=" ".join(words), box=box, confidence=None))
+    return lines
+
+
+def _run(args: List[str], input: Optional[bytes] = None) -> str:
+    if not shutil.which(args[0]):
+        raise OcrUnavailable(args[0])
+    # One thread per Tesseract process: the pool size is what sets the parallelism.
+    result = subprocess.run(args, input=input, capture_output=True, check=True, timeout=SUBPROCESS_TIMEOUT_SECONDS,
+                            env=dict(os.environ, OMP_THREAD_LIMIT="1"))
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+def extract_pdf_text(source_path: str, max_pages: int = OCR_MAX_PAGES) -> List[dict]:
+    return parse_pdftotext_bbox(_run(["pdftotext", "-bbox-layout", "-l", str(max_pages), source_path, "-"]))
+
+
+def recognize_image(image: Image.Image, page: int = 0) -> List[dict]:
+    buffer = io.BytesIO()
+    image.convert("L").save(buffer, "PNG")
+    # --psm 4: a single column of text of variable sizes, which is how most receipts are laid out.
+    tsv = _run(["tesseract", "stdin", "stdout", "-l", OCR_LANGUAGES, "--psm", "4", "tsv"], input=buffer.getvalue())
+    return parse_tesseract_tsv(tsv, image.width, image.height, page)
+
+
+def read_lines(content_type: str, source_path: str, rotation: int) -> Tuple[str, int, List[dict]]:
+    """
+    Returns the engine used, the rotation that the boxes are relative to, and the lines.
+    """
+    if content_type == "application/pdf":
+        lines = extract_pdf_text(source_path)
+        if sum(len(line["text"].replace(" ", "")) for line in lines) >= MIN_PDF_TEXT_CHARS:
+            return "pdftotext", 0, lines
+
+    lines = []
+    for page, image in enumerate(render_pages(content_type, source_path, OCR_DPI, OCR_MAX_PAGES)):
+        if rotation:
+            # The UI rotates clockwise, PIL counterclockwise.
+            image = image.rotate(-rotation, expand=True)
+        lines += recognize_image(image, page)
+    return "tesseract", rotation, lines
+
+
+# Amounts with two decimals, with optional thousands separators. Ex. 12.50, 1,234.56, 1.234,56
+MONEY = re.compile(r"(?<![\d.,])(\d{1,3}(?:[.,]\d{3})+|\d+)[.,](\d{2})(?![.,]?\d)")
+TOTAL = re.compile(r"\b(total|amount|balance|to\s*pay|summe|montant|totale)\b", re.IGNORECASE)
+STRONG_TOTAL = re.compile(r"\b(grand\s*total|total\s*due|amount\s*due|balance\s*due|to\s*pay)\b", re.IGNORECASE)
+NOT_TOTAL = re.compile(r"sub\s*-?\s*total|total\s*(tax|vat|savings|discount|items?|qty)|tax\s*total|\btip\b",
+                       re.IGNORECASE)
+
+MONTHS = dict(jan=1, feb=2, mar=3, apr=4, may=5, jun=6, jul=7, aug=8, sep=9, oct=10, nov=11, dec=12)
+ISO_DATE = re.compile(r"\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b")
+NUMERIC_DATE = re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{4}|\d{2})\b")
+DAY_MONTH_DATE = re.compile(r"\b(\d{1,2})\.?\s+([a-z]{3})[a-z]*\.?,?\s+(\d{4})\b", re.IGNORECASE)
+MONTH_DAY_DATE = re.compile(r"\b([a-z]{3})[a-z]*\.?\s+(\d{1,2}),?\s+(\d{4})\b", re.IGNORECASE)
+
+# Lines at the top of the first page that may hold the vendor's name.
+VENDOR_HEADING_LINES = 5
+
+
+def _guess(line: dict, value) -> dict:
+    return dict(value=value, page=line["page"], box=line["box"])
+
+
+def parse_amounts(text: str) -> List[float]:
+    return [float(re.sub(r"[.,]", "", whole) + "." + cents) for whole, cents in MONEY.findall(text)]
+
+
+def guess_total(lines: Sequence[dict]) -> Optional[dict]:
+    """
+    The amount on the last "total" line, preferring explicit ones such as "amount due" over a plain "total".
+    Without such a line, the largest amount on the receipt.
+    """
+    candidates, strong = [], []
+    for line in lines:
+        amounts = parse_amounts(line["text"])
+        if amounts and TOTAL.search(line["text"]) and not NOT_TOTAL.search(line["text"]):
+            candidates.append(_guess(line, amounts[-1]))
+            if STRONG_TOTAL.search(line["text"]):
+                strong.append(candidates[-1])
+    if strong or candidates:
+        return (strong or candidates)[-1]
+
+    amounts = [(amount, line) for line in lines for amount in parse_amounts(line["text"])]
+    if not amounts:
+        return None
+    amount, line = max(amounts, key=lambda item: item[0])
+    return _guess(line, amount)
+
+
+def _to_date(year: int, month: int, day: int, today: date) -> Optional[date]:
+    if year < 100:
+        year += 2000
+    try:
+        value = date(year, month, day)
+    except ValueError:
+        return None
+    # Receipts are neither from the future nor from before the app existed, give or take.
+    return value if date(2000, 1, 1) <= value <= today + timedelta(days=1) else None
+
+
+def _dates_in(text: str, today: date) -> List[date]:
+    found = []
+    for year, month, day in ISO_DATE.findall(text):
+        found.append(_to_date(int(year), int(month), int(day), today))
+    for first, second, year in NUMERIC_DATE.findall(text):
+        first, second, year = int(first), int(second), int(year)
+        month_first = _to_date(year, first, second, today)
+        day_first = _to_date(year, second, first, today)
+        found.append(month_first if OCR_DATE_ORDER == "MDY" and month_first else day_first or month_first)
+    for day, month, year in DAY_MONTH_DATE.findall(text):
+        if month.lower() in MONTHS:
+            found.append(_to_date(int(year), MONTHS[month.lower()], int(day), today))
+    for month, day, year in MONTH_DAY_DATE.findall(text):
+        if month.lower() in MONTHS:
+            found.append(_to_date(int(year), MONTHS[month.lower()], int(day), today))
+    return [value for value in found if value]
+
+
+def guess_date(lines: Sequence[dict], today: Optional[date] = None) -> Optional[dict]:
+    """
+    The first plausible date on the receipt, as YYYY-MM-DD.
+    """
+    today = today or date.today()
+    for line in lines:
+        dates = _dates_in(line["text"], today)
+        if dates:
+            return _guess(line, dates[0].isoformat())
+    return None
+
+
+def guess_vendor(lines: Sequence[dict], known_vendors: Sequence[str] = ()) -> Optional[dict]:
+    """
+    The first of the user's vendors named on the receipt, the longest name on a line winning.
+    Otherwise the first line at the top of the first page that reads like a name rather than an address or a date.
+    """
+    patterns = [(name, re.compile(rf"(?<!\w){re.escape(name)}(?!\w)", re.IGNORECASE))
+                for name in sorted(known_vendors, key=len, reverse=True) if len(name) >= 3]
+    for line in lines:
+        for name, pattern in patterns:
+            if pattern.search(line["text"]):
+                return dict(_guess(line, name), known=True)
+
+    for line in [line for line in lines if line["page"] == 0][:VENDOR_HEADING_LINES]:
+        text = line["text"].strip(" *-=#:|.")
+        characters = text.replace(" ", "")
+        letters = sum(c.isalpha() for c in characters)
+        if letters >= 3 and letters >= 0.6 * len(characters) and not MONEY.search(text) \
+                and not _dates_in(text, date.today()):
+            return dict(_guess(line, text), known=False)
+    return None
+
+
+def recognize_receipt(db: Database, receipt_id: int) -> str:
+    """
+    Recognizes one receipt and stores the result. Returns the result label of OCR_RESULTS.
+    """
+    try:
+        receipt = db.get_receipt(receipt_id)
+    except NotFound:
+        OCR_RESULTS.inc(result="discarded")
+        return "discarded"
+
+    source_path = os.path.join(receep.RECEIPT_DIR, f"{receipt.id}.dr")
+    started = time.perf_counter()
+    try:
+        engine, rotation, lines = read_lines(receipt.content_type, source_path, receipt.rotation)
+    except OcrUnavailable as e:
+        logger.warning(f"OCR is not installed; the receipt is left for the backfill. missing={e} {receipt_id=}")
+        OCR_RESULTS.inc(result="unavailable")
+        return "unavailable"
+    except Exception as e:
+        logger.exception(f"OCR failed. {receipt_id=}")
+        metadata = dict(status="failed", version=VERSION, error=e.__class__.__name__)
+        result = "failed" if db.save_receipt_ocr(receipt.id, receipt.rotation, metadata) else "discarded"
+        OCR_RESULTS.inc(result=result)
+        return result
+
+    known_vendors = [row.name for row in db.get_vendors_with_usage(receipt.user_id)]
+    metadata = dict(
+        status="done",
+        version=VERSION,
+        engine=engine,
+        rotation=rotation,
+        total=guess_total(lines),
+        date=guess_date(lines),
+        vendor=guess_vendor(lines, known_vendors),
+    )
+    text = "\n".join(line["text"] for line in lines)
+    saved = db.save_receipt_ocr(receipt.id, receipt.rotation, metadata, text, lines)
+    OCR_SECONDS.observe(time.perf_counter() - started, engine=engine)
+
+    result = "done" if saved else "discarded"
+    OCR_RESULTS.inc(result=result)
+    return result
+
+
+class OcrPool:
+    """
+    Recognizes receipts on a few background threads, in upload order. Receipts beyond the queue limit, and those
+    still queued on shutdown, keep an empty ocr_metadata and are picked up by the backfill.
+    """
+
+    def __init__(self, db: Database, workers: int = OCR_WORKERS, queue_limit: int = OCR_QUEUE_LIMIT):
+        self.db = db
+        self.workers = workers
+        self.queue_limit = queue_limit
+
+        # Created on the first submit, so that no thread exists before gunicorn forks the workers.
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+        # Metrics
+        self.skipped = 0
+
+    @property
+    def active(self) -> int:
+        return min(self._in_flight, self.workers)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self._in_flight - self.workers, 0)
+
+    def submit(self, receipt_id: int) -> bool:
+        if not self.workers:
+            return False
+
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_limit:
+                self.skipped += 1
+                logger.warning(f"OCR queue is full; the receipt is left for the backfill. {receipt_id=}")
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+            self._in_flight += 1
+            # Also called when shutdown cancels the receipt before it runs.
+            self._executor.submit(self._recognize, receipt_id).add_done_callback(self._done)
+        return True
+
+    def _recognize(self, receipt_id: int) -> None:
+        try:
+            recognize_receipt(self.db, receipt_id)
+        except Exception:
+            logger.exception(f"Could not store the OCR result. {receipt_id=}")
+
+    def _done(self, _: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def shutdown(self) -> None:
+        """
+        Lets the receipts being recognized finish, and drops the queued ones.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def backfill(db: Database, workers: int, limit: Optional[int] = None, retry_failed: bool = False) -> CounterDict:
+    """
+    Recognizes the receipts that never went through OCR, in ascending id order. Returns the count per result.
+    """
+    results = CounterDict()
+    after_id = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr") as executor:
+        while limit is None or sum(results.values()) < limit:
+            remaining = BACKFILL_BATCH_SIZE if limit is None else limit - sum(results.values())
+            receipt_ids = db.get_receipt_ids_for_ocr(after_id, min(BACKFILL_BATCH_SIZE, remaining), retry_failed)
+            if not receipt_ids:
+                break
+            after_id = receipt_ids[-1]
+
+            batch = CounterDict(executor.map(lambda receipt_id: recognize_receipt(db, receipt_id), receipt_ids))
+            results.update(batch)
+            logger.info(f"OCR backfill progress. {after_id=} {dict(results)}")
+            if batch["unavailable"] == len(receipt_ids):
+                logger.error("OCR backfill stopped: install tesseract-ocr and poppler-utils first.")
+                break
+    return results
+
+
+instance = OcrPool(db_instance)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognizes the receipts that have not been through OCR yet.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="receipts recognized at the same time (default: the number of cores)")
+    parser.add_argument("--limit", type=int, help="stop after this many receipts")
+    parser.add_argument("--retry-failed", action="store_true", help="also retry receipts whose OCR failed")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(dict(backfill(db_instance, args.workers, args.limit, args.retry_failed)))
@@ -2,18 +2,28 @@ import hashlib
 import logging
 import os
 import shutil
+import time
 from io import BufferedReader
 from typing import List
 
-from logic.img import generate_thumbnail
+from logic.img import content_type_label, generate_thumbnail
 from persistence.database import instance as db_instance
 from persistence.database import Database
+from persistence.exceptions import DuplicateReceipt
 from persistence.schema import Receipt
+from utils.metrics import Counter, Histogram
+from utils.timing import span
 
 RECEIPT_DIR = "/data/receipts"
 
 logger = logging.getLogger("receep")
 
+# result is "created", "duplicate" (the same file was uploaded before) or "failed".
+UPLOADS = Counter("receep_uploads_total", "Receipt uploads, by result.", ["content_type", "result"])
+UPLOAD_BYTES = Counter("receep_upload_bytes_total", "Bytes of uploaded receipt files.", ["content_type"])
+UPLOAD_SECONDS = Histogram("receep_upload_duration_seconds",
+                           "Time to hash, store and thumbnail an upload, for created receipts.", ["content_type"])
+
 
 def get_reader_info(reader: BufferedReader, chunk_size=8192):
     """
@@ -36,23 +46,45 @@ def get_reader_info(reader: BufferedReader, chunk_size=8192):
 class Receep:
     def __init__(self, db: Database):
         self.db = db
+
+    def ensure_dirs(self) -> None:
+        """
+        Called by the app on startup rather than on import, so that importing this module touches no files.
+        """
         for dir in (RECEIPT_DIR,):
-            if not os.path.exists(dir):
-                os.makedirs(dir, exist_ok=True)
+            os.makedirs(dir, exist_ok=True)
 
     def upload(self, user_id: int, content_type: str, buffered_reader: BufferedReader) -> Receipt:
-        content_length, hash = get_reader_info(buffered_reader)
+        started = time.perf_counter()
+        label = content_type_label(content_type)
+        try:
+            receipt = self._upload(user_id, content_type, buffered_reader, label)
+        except DuplicateReceipt:
+            UPLOADS.inc(content_type=label, result="duplicate")
+            raise
+        except Exception:
+            UPLOADS.inc(content_type=label, result="failed")
+            raise
+        UPLOADS.inc(content_type=label, result="created")
+        UPLOAD_SECONDS.observe(time.perf_counter() - started, content_type=label)
+        return receipt
+
+    def _upload(self, user_id: int, content_type: str, buffered_reader: BufferedReader, label: str) -> Receipt:
+        with span("hash"):
+            content_length, hash = get_reader_info(buffered_reader)
         logger.info(f"{content_type=}, {content_length=}, {hash=}")
+        UPLOAD_BYTES.inc(content_length, content_type=label)
         receipt = self.db.create_receipt(
             user_id, content_type, content_length, hash)
 
         # ".dr" stands for "Receep Receipt"
         save_path = os.path.join(RECEIPT_DIR, f"{receipt.id}.dr")
         try:
-            with open(save_path, "wb") as fp:
+            with span("file_write"), open(save_path, "wb") as fp:
                 shutil.copyfileobj(buffered_reader, fp)
-            generate_thumbnail(source_path=save_path,
-                               content_type=content_type)
+            with span("thumbnail"):
+                generate_thumbnail(source_path=save_path,
+                                   content_type=content_type)
         except Exception as e:
             self.db.delete_receipt(receipt.id, user_id)
             raise
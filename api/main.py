@@ -1,18 +1,21 @@
-import asyncio
-import json
-from logging import StreamHandler, FileHandler, getLogger, INFO, ERROR
-from typing import Callable, List
-
-from fastapi import Depends, FastAPI, HTTPException, Query, WebSocket, status
-from fastapi.responses import FileResponse
-from fastapi_jwt_auth import AuthJWT
-from fastapi_jwt_auth.exceptions import AuthJWTException
-from logic import receep
-from persistence import database
-from starlette.websockets import WebSocketDisconnect
-
+import os
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import Dict, Optional
+
+import anyio
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Response, WebSocket, status
+from fastapi.responses import FileResponse, JSONResponse
+from logic import ocr, receep
+from persistence import database, events
+
+from api import hub
+from api.broker import create_broker
 from api.access import authenticator
 from api.access.authenticator import AuthMetadata
+from api.access.executor import instance as auth_executor
+from api.access.jwt_check import JwtCheckMiddleware, TokenCache
+from api.compression import CompressionMiddleware
 from api.access.exceptions import InvalidCredsException
 from api.exceptions import register_exception_handlers
 from api.routers.receipts import router as receipt_router
@@ -22,86 +25,107 @@ from api.routers.vendors import router as vendor_router
 from api.routers.users import router as user_router
 from api.routers.reports import router as report_router
 from api.routers.data import router as data_router
-from api.shared import LoginRequest, Token, get_app_info, get_auth_metadata
-from utils.logging import set_format
+from api.routers.sync import router as sync_router
+from api.routers.metrics import register_app_metrics, router as metrics_router
+from api.routers.health import router as health_router
+from api.timing import TimingMiddleware
+from api.shared import (LoginRequest, Token, clear_refresh_cookie, get_app_info, get_app_info_cache_control,
+                        get_auth_metadata, get_refresh_cookie, get_websocket_auth_metadata, set_refresh_cookie)
+from utils.logging import configure_logging, shutdown_logging
+from utils.metrics import REGISTRY as metrics_registry
+from utils.timing import instrument_engine
 
 logger = getLogger("receep")
-logger.setLevel(INFO)
-logger.addHandler(set_format(StreamHandler()))
-logger.addHandler(set_format(FileHandler("/var/log/receep/api/app.log")))
-
-uvicorn_logger = getLogger("uvicorn.error")
-uvicorn_logger.setLevel(ERROR)
-uvicorn_logger.addHandler(set_format(StreamHandler()))
-uvicorn_logger.addHandler(set_format(
-    FileHandler("/var/log/receep/api/uvicorn.log")))
-
-fastapi_app = FastAPI(redirect_slashes=False)
-sockets: List[WebSocket] = []
 
-
-db = database.instance
 auth = authenticator.instance
-app = receep.instance
-
-fastapi_app.include_router(transaction_router)
-fastapi_app.include_router(receipt_router)
-fastapi_app.include_router(vendor_router)
-fastapi_app.include_router(category_router)
-fastapi_app.include_router(user_router)
-fastapi_app.include_router(report_router)
-fastapi_app.include_router(data_router)
 
-register_exception_handlers(fastapi_app)
+router = APIRouter()
 
 
-def get_broadcast_function(topic: str) -> Callable[[dict], None]:
-    def broadcast(payload: dict) -> None:
-        async def broadcast_async():
-            for socket in sockets:
-                await socket.send_text(json.dumps(dict(
-                    topic=topic,
-                    payload=payload
-                )))
-        asyncio.run(broadcast_async())
-    return broadcast
+def deliver_changes(batch: Dict[int, int]) -> None:
+    for user_id, version in batch.items():
+        hub.instance.publish(user_id, dict(topic="changes", payload=dict(version=version)))
 
 
-# TODO: fix auth issues
-# @fastapi_app.websocket("/ws")
+@asynccontextmanager
+async def lifespan(fastapi_app: FastAPI):
+    configure_logging()
+    receep.instance.ensure_dirs()
 
+    engine = database.get_engine()
+    instrument_engine(engine, slow_query_seconds=int(os.getenv("SLOW_QUERY_MS", "200")) / 1000)
+    register_app_metrics(engine, auth_executor, hub.instance, fastapi_app.state.jwt_check_tokens, ocr.instance)
+    metrics_registry.start_writer()
 
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(...), Authorize: AuthJWT = Depends()):
-    await websocket.accept()
-    logger.info("Socket open")
-
+    # "postgres" reaches the websockets held by every worker. "memory" is enough for a single worker.
+    broker = create_broker(os.getenv("EVENT_BROKER", "postgres"), engine)
+    events.subscribe(broker.publish)
+    await broker.start(deliver_changes)
     try:
-        Authorize.jwt_required("websocket", token=token)
-    except AuthJWTException as err:
-        logger.error(err)
-        await websocket.close()
+        yield
+    finally:
+        await broker.stop()
+        events.unsubscribe(broker.publish)
+        # Waits for the receipts being recognized; the queued ones are left to the backfill.
+        await anyio.to_thread.run_sync(ocr.instance.shutdown)
+        metrics_registry.stop_writer()
+        database.dispose_engine()
+        shutdown_logging()
+
+
+def create_app() -> FastAPI:
+    """
+    Builds the app without any I/O; the lifespan connects and starts the background work.
+    The schema must be up to date first: see `python -m persistence.migrations`.
+    """
+    fastapi_app = FastAPI(redirect_slashes=False, lifespan=lifespan)
+
+    fastapi_app.include_router(transaction_router)
+    fastapi_app.include_router(receipt_router)
+    fastapi_app.include_router(vendor_router)
+    fastapi_app.include_router(category_router)
+    fastapi_app.include_router(user_router)
+    fastapi_app.include_router(report_router)
+    fastapi_app.include_router(data_router)
+    fastapi_app.include_router(sync_router)
+    fastapi_app.include_router(metrics_router)
+    fastapi_app.include_router(health_router)
+    fastapi_app.include_router(router)
+
+    register_exception_handlers(fastapi_app)
+    # Innermost, so that the timings and the logged size include compression.
+    fastapi_app.add_middleware(CompressionMiddleware)
+    # Server-Timing header and one log line per request. Added first, so that /jwt/check stays outside of it.
+    fastapi_app.add_middleware(TimingMiddleware)
+    # Answers /jwt/check without going through routing and dependencies.
+    fastapi_app.state.jwt_check_tokens = TokenCache(authenticator.JWT_KEY, authenticator.JWT_ALG)
+    fastapi_app.add_middleware(JwtCheckMiddleware, tokens=fastapi_app.state.jwt_check_tokens)
+    return fastapi_app
+
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, metadata: AuthMetadata = Depends(get_websocket_auth_metadata)):
+    if not metadata.authenticated:
+        # Closing before accepting rejects the handshake with 403.
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    sockets.append(websocket)
-
-    try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        sockets.remove(websocket)
-        logger.info("Socket closed")
+    await websocket.accept()
+    logger.info(f"Socket open. user_id={metadata.user_id}")
+    await hub.instance.serve(websocket, metadata.user_id)
+    logger.info(f"Socket closed. user_id={metadata.user_id}")
 
 
-@fastapi_app.get("/file", response_class=FileResponse)
+@router.get("/file", response_class=FileResponse)
 def get_file(_: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))):
     local_path = "/data/some_file.pdf"
     return local_path
 
 
-@fastapi_app.post("/login", response_model=Token)
-async def login(payload: LoginRequest, _: AuthMetadata = Depends(get_auth_metadata())):
+@router.post("/login", response_model=Token)
+async def login(payload: LoginRequest, response: Response, _: AuthMetadata = Depends(get_auth_metadata())):
     try:
-        result = auth.create_jwt(payload)
+        result = await auth_executor.run(auth.create_jwt, payload)
         if not result:
             return dict(
                 message="TOTP required",
@@ -116,14 +140,43 @@ async def login(payload: LoginRequest, _: AuthMetadata = Depends(get_auth_metada
     result.update(dict(
         message="success"
     ))
-    return result
+    return set_refresh_cookie(response, result)
 
 
-@fastapi_app.get("/jwt/check")
-async def check_jwt(_: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))):
+@router.post("/token/refresh", response_model=Token)
+def refresh_token(response: Response, refresh_token: Optional[str] = Depends(get_refresh_cookie)):
+    try:
+        if not refresh_token:
+            raise InvalidCredsException
+        result = auth.refresh(refresh_token)
+    except InvalidCredsException:
+        # A refresh token that failed once never works again; drop it from the browser.
+        unauthorized = JSONResponse(dict(detail="Unauthorized"), status_code=status.HTTP_401_UNAUTHORIZED)
+        clear_refresh_cookie(unauthorized)
+        return unauthorized
+
+    result.update(dict(
+        message="success"
+    ))
+    return set_refresh_cookie(response, result)
+
+
+@router.post("/logout")
+def logout(response: Response, refresh_token: Optional[str] = Depends(get_refresh_cookie)):
+    if refresh_token:
+        auth.revoke(refresh_token)
+    clear_refresh_cookie(response)
     return dict(message="success")
 
 
-@fastapi_app.get("/app/info")
-async def get_app_info_endpoint():
-    return get_app_info().__dict__
+@router.get("/jwt/check", status_code=status.HTTP_204_NO_CONTENT)
+def check_jwt(metadata: AuthMetadata = Depends(get_auth_metadata(assert_jwt=True))):
+    # Only reached by tokens without the uid claim; JwtCheckMiddleware answers the others.
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers={"X-User-Id": str(metadata.user_id)})
+
+
+@router.get("/app/info")
+def get_app_info_endpoint(response: Response):
+    app_info = get_app_info()
+    response.headers["Cache-Control"] = get_app_info_cache_control(app_info)
+    return app_info.__dict__
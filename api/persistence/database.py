@@ -1,25 +1,119 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import os
+import threading
 import types
 from functools import wraps
-from typing import List, Optional
+from typing import Dict, List, Optional
 
+from persistence import events
 from persistence.exceptions import DuplicateReceipt, NotFound
-from persistence.schema import Base, Category, LineItem, Receipt, Role, Transaction, User, Vendor
-from sqlalchemy import create_engine, desc, func, select, update
+from persistence.schema import (OCR_SEARCH_CONFIG, Category, DataVersion, LineItem, Receipt, ReceiptText,
+                                RefreshToken, Role, Tombstone, Transaction, User, Vendor)
+from sqlalchemy import (BigInteger, Engine, Integer, Row, and_, cast, create_engine, delete, desc, event, exists,
+                        func, or_, select, text, update)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlalchemy.orm import joinedload, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
 
-password = os.getenv("POSTGRES_PASSWORD")
 logger = logging.getLogger("receep")
 
 SESSION_DECORATORS = dict()
 
-# Note the following commands should be placed after the ORM class definitions
-engine = create_engine(f"postgresql://postgres:{password}@db/postgres")
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
+# See Database.use_refresh_token
+REFRESH_TOKEN_REUSE_GRACE = timedelta(seconds=30)
+# Rows committed by transactions that started before get_changes or get_line_item_categories read the changes can
+# carry an updated_at older than the returned synced_at. Callers go back this much further on their next read;
+# reading the rows of this window again is harmless because they replace their previous versions.
+CHANGES_OVERLAP = timedelta(seconds=30)
+
+# Columns selected by the list read paths, which skip ORM entity hydration.
+RECEIPT_COLUMNS = tuple(Receipt.__table__.columns)
+TRANSACTION_COLUMNS = tuple(Transaction.__table__.columns)
+LINE_ITEM_COLUMNS = tuple(LineItem.__table__.columns)
+VENDOR_COLUMNS = tuple(Vendor.__table__.columns)
+CATEGORY_COLUMNS = tuple(Category.__table__.columns)
+
+
+def local_timestamp(timestamp, tz_name: str):
+    """
+    Converts a stored timestamp, naive UTC, to the wall-clock time of an IANA zone, DST included.
+    """
+    return func.timezone(tz_name, func.timezone("UTC", timestamp))
+
+
+def report_line_item_columns(tz_name: str = "UTC") -> tuple:
+    """
+    The timestamp is the local time in tz_name.
+    """
+    return (
+        LineItem.amount,
+        LineItem.category_id,
+        Transaction.id.label("tx_id"),
+        Transaction.vendor_id,
+        local_timestamp(Transaction.timestamp, tz_name).label("timestamp"),
+    )
+
+
+def report_line_item_array_columns(tz_name: str = "UTC") -> tuple:
+    """
+    Same as report_line_item_columns, with the local time as Unix seconds, which NumPy converts without a loop.
+    """
+    local = local_timestamp(Transaction.timestamp, tz_name)
+    return (
+        LineItem.amount,
+        LineItem.category_id,
+        Transaction.id.label("tx_id"),
+        Transaction.vendor_id,
+        # floor: casting rounds, which would move 23:59:59.6 to the next day.
+        cast(func.floor(func.extract("epoch", local)), BigInteger).label("epoch"),
+    )
+
+
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_database_url() -> str:
+    return os.getenv("DATABASE_URL") or f"postgresql://postgres:{os.getenv('POSTGRES_PASSWORD')}@db/postgres"
+
+
+def get_engine() -> Engine:
+    """
+    The engine is created on first use, so importing this module neither connects nor reads DATABASE_URL,
+    and a forked worker builds its own pool. The schema is managed by `python -m persistence.migrations`.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(get_database_url())
+    return _engine
+
+
+def dispose_engine(close: bool = True) -> None:
+    """
+    Drops the pooled connections, if the engine was created. close=False leaves them open for the process
+    that created them; call it that way right after a fork.
+    """
+    if _engine is not None:
+        _engine.dispose(close=close)
+
+
+# Objects keep their state after commit so the write paths can return them without re-selecting.
+Session = sessionmaker(expire_on_commit=False)
+
+
+@event.listens_for(Session, "after_commit")
+def publish_data_versions(session):
+    for user_id, version in session.info.pop("data_versions", dict()).items():
+        events.publish(user_id, version)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_data_versions(session):
+    session.info.pop("data_versions", None)
 
 
 def session_decorator(func):
@@ -50,6 +144,94 @@ def get_user_count(self):
     return self.query(func.count(User.id)).scalar()
 
 
+@session_decorator
+def bump_data_version(self, user_id: int) -> None:
+    """
+    Must be called by every mutating Database method before it commits.
+    The new version is published to persistence.events once the session commits.
+    """
+    stmt = insert(DataVersion) \
+        .values(user_id=user_id, version=1) \
+        .on_conflict_do_update(
+            index_elements=[DataVersion.user_id],
+            set_=dict(version=DataVersion.version + 1)) \
+        .returning(DataVersion.version)
+    self.info.setdefault("data_versions", dict())[user_id] = self.execute(stmt).scalar_one()
+
+
+@session_decorator
+def add_tombstones(self, user_id: int, resource: str, resource_ids: List[int]) -> None:
+    """
+    Must be called by every Database method that deletes rows of a resource served by delta sync.
+    """
+    if resource_ids:
+        self.execute(insert(Tombstone), [
+            dict(user_id=user_id, resource=resource, resource_id=resource_id)
+            for resource_id in resource_ids
+        ])
+
+
+@session_decorator
+def touch_receipts(self, receipt_ids: List[int] = (), transaction_id: Optional[int] = None) -> None:
+    """
+    Bumps updated_at of receipts whose embedded transactions are about to change, so delta sync resends them.
+    With transaction_id, also touches the receipt currently linked to that transaction.
+    """
+    conditions = []
+
+    receipt_ids = [receipt_id for receipt_id in receipt_ids if receipt_id is not None]
+    if receipt_ids:
+        conditions.append(Receipt.id.in_(receipt_ids))
+
+    if transaction_id is not None:
+        linked_receipt_id = select(Transaction.receipt_id).where(Transaction.id == transaction_id)
+        conditions.append(Receipt.id.in_(linked_receipt_id.scalar_subquery()))
+
+    if conditions:
+        self.execute(update(Receipt).where(or_(*conditions)).values(updated_at=func.now()))
+
+
+@session_decorator
+def with_transactions(self, receipt_rows: List[Row]) -> List[types.SimpleNamespace]:
+    """
+    Turns receipt rows into records with the same attributes as Receipt, including 'transactions'.
+    """
+    transactions_by_receipt_id = {row.id: [] for row in receipt_rows}
+    if transactions_by_receipt_id:
+        transaction_rows = self.execute(
+            select(*TRANSACTION_COLUMNS)
+            .where(Transaction.receipt_id.in_(transactions_by_receipt_id.keys()))
+        ).all()
+        for row in transaction_rows:
+            transactions_by_receipt_id[row.receipt_id].append(row)
+
+    return [
+        types.SimpleNamespace(**row._mapping, transactions=transactions_by_receipt_id[row.id])
+        for row in receipt_rows
+    ]
+
+
+@session_decorator
+def with_line_items(self, transaction_rows: List[Row]) -> List[types.SimpleNamespace]:
+    """
+    Turns transaction rows into records with the same attributes as Transaction, including 'line_items'.
+    """
+    line_items_by_transaction_id = {row.id: [] for row in transaction_rows}
+    if line_items_by_transaction_id:
+        line_item_rows = self.execute(
+            select(*LINE_ITEM_COLUMNS)
+            .where(LineItem.transaction_id.in_(line_items_by_transaction_id.keys()))
+            .order_by(LineItem.id)
+        ).all()
+        for row in line_item_rows:
+            line_items_by_transaction_id[row.transaction_id].append(row)
+
+    return [
+        types.SimpleNamespace(**row._mapping, line_items=line_items_by_transaction_id[row.id])
+        for row in transaction_rows
+    ]
+
+
 @session_decorator
 def get_user_by_username(self, username: str):
     return self.query(User).options(joinedload(User.roles)).filter(User.username == username).first()
@@ -77,7 +259,7 @@ def get_receipt(self, receipt_id: int) -> Optional[Receipt]:
 
 
 def get_session():
-    session = Session()
+    session = Session(bind=get_engine())
 
     for func_name, func in SESSION_DECORATORS.items():
         bind = types.MethodType(func, session)
@@ -87,6 +269,12 @@ def get_session():
 
 
 class Database:
+    def __init__(self):
+        # Cached by get_user_count(). Only positive counts are cached; create_user() clears it.
+        self._user_count: Optional[int] = None
+        # See get_timezone_names()
+        self._timezone_names: Optional[frozenset] = None
+
     def create_user(self, username: str) -> bool:
         """
         Returns a boolean indicating whether the user creation was successful
@@ -102,10 +290,13 @@ class Database:
             )]
             try:
                 session.add(user)
+                session.flush()
             except IntegrityError:
                 session.rollback()
                 return False
+            session.bump_data_version(user.id)
             session.commit()
+            self._user_count = None
             return True
 
     def get_user_by_username(self, username) -> Optional[User]:
@@ -116,12 +307,72 @@ class Database:
                 return None
             return user
 
-    def update_user_config(self, user_id: int, config: dict):
+    def get_user_by_id(self, user_id: int) -> Optional[User]:
+        with get_session() as session:
+            return session.get_user_by_id(user_id)
+
+    def create_refresh_token(self, user_id: int, token_hash: str, ttl: timedelta) -> None:
+        with get_session() as session:
+            session.add(RefreshToken(user_id=user_id, token_hash=token_hash, expires_at=func.now() + ttl))
+            session.commit()
+
+    def use_refresh_token(self, token_hash: str, new_token_hash: str, ttl: timedelta) -> Optional[User]:
+        """
+        Revokes the presented refresh token and stores its replacement in one transaction.
+        Returns the owner, or None if the token is unknown, expired or already used.
+
+        A token used again after REFRESH_TOKEN_REUSE_GRACE has most likely been stolen, so all of the owner's
+        tokens are revoked. Within the grace period, reuse is treated as a benign race (ex. two tabs refreshing).
+        """
         with get_session() as session:
+            user_id = session.execute(
+                update(RefreshToken)
+                .where(RefreshToken.token_hash == token_hash,
+                       RefreshToken.revoked_at.is_(None),
+                       RefreshToken.expires_at > func.now())
+                .values(revoked_at=func.now())
+                .returning(RefreshToken.user_id)
+            ).scalar()
+
+            if user_id is None:
+                reused_by = session.execute(
+                    select(RefreshToken.user_id)
+                    .where(RefreshToken.token_hash == token_hash,
+                           RefreshToken.revoked_at < func.now() - REFRESH_TOKEN_REUSE_GRACE)
+                ).scalar()
+                if reused_by is not None:
+                    logger.warning(f"A used refresh token was presented again. Revoking all. user_id={reused_by}")
+                    session.execute(
+                        update(RefreshToken)
+                        .where(RefreshToken.user_id == reused_by, RefreshToken.revoked_at.is_(None))
+                        .values(revoked_at=func.now()))
+                    session.commit()
+                return None
+
+            session.add(RefreshToken(user_id=user_id, token_hash=new_token_hash, expires_at=func.now() + ttl))
             user = session.get_user_by_id(user_id)
-            if not user:
+            session.commit()
+            return user
+
+    def revoke_refresh_token(self, token_hash: str) -> None:
+        with get_session() as session:
+            session.execute(
+                update(RefreshToken)
+                .where(RefreshToken.token_hash == token_hash, RefreshToken.revoked_at.is_(None))
+                .values(revoked_at=func.now()))
+            session.commit()
+
+    def update_user_config(self, user_id: int, config: dict):
+        with get_session() as session:
+            updated_id = session.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(config=config)
+                .returning(User.id)
+            ).scalar()
+            if updated_id is None:
                 raise NotFound
-            user.config = config
+            session.bump_data_version(user_id)
             session.commit()
 
     # TODO more explicit args
@@ -134,6 +385,7 @@ class Database:
                 raise
             existing_user.hashed_password = user.hashed_password
             existing_user.totp_private_key = user.totp_private_key
+            session.bump_data_version(existing_user.id)
             session.commit()
 
     def update_user_roles(self, username: str, role_names: List[str]) -> None:
@@ -147,11 +399,34 @@ class Database:
                     user.roles.append(role)
             else:
                 user.roles = []
+            session.bump_data_version(user.id)
             session.commit()
 
     def get_user_count(self) -> int:
+        """
+        Cached until this process creates a user. Other processes may serve a lower count until then,
+        which only matters for display: users are never deleted, so a positive count never becomes zero.
+        Zero is never served from the cache because it lets anyone sign up as the admin.
+        """
+        user_count = self._user_count
+        if user_count:
+            return user_count
+
+        with get_session() as session:
+            user_count = session.get_user_count()
+
+        if user_count:
+            self._user_count = user_count
+        return user_count
+
+    def get_data_version(self, user_id: int) -> int:
+        """
+        Returns the data version of the given user.
+        """
         with get_session() as session:
-            return session.get_user_count()
+            return session.query(DataVersion.version) \
+                .filter(DataVersion.user_id == user_id) \
+                .scalar() or 0
 
     def create_receipt(self, user_id: int, content_type: str, content_length: int, content_hash: str) -> Receipt:
         with get_session() as session:
@@ -165,11 +440,12 @@ class Database:
             )
             try:
                 session.add(receipt)
+                session.flush()
+                session.bump_data_version(user_id)
                 session.commit()
 
-                receipt.id  # trigger lazy-loading of the id field.
-                # initialize a blank list before the session ends.
-                receipt.transactions = []
+                # A new receipt has no transactions; mark the collection as loaded without querying.
+                set_committed_value(receipt, "transactions", [])
             except IntegrityError:
                 # Most likely caused by the unique constraint on the hash field.
                 # TODO: make sure this is indeed the cause of IntegrityError.
@@ -181,18 +457,34 @@ class Database:
 
         return receipt
 
-    def rotate_receipt(self, receipt_id: int, user_id: int, delta: int) -> Receipt:
+    def rotate_receipt(self, receipt_id: int, user_id: int, delta: int) -> Optional[types.SimpleNamespace]:
+        """
+        Returns the same kind of record as get_receipts, or None if the user does not own the receipt.
+        The UPDATE and the read of the linked transactions happen in one statement.
+        """
         with get_session() as session:
-            stmt = update(Receipt) \
+            updated = update(Receipt) \
                 .where(Receipt.id == receipt_id, Receipt.user_id == user_id) \
-                .values(rotation=(Receipt.rotation + delta) % 360)
-            session.execute(stmt)
+                .values(rotation=(Receipt.rotation + delta) % 360) \
+                .returning(*RECEIPT_COLUMNS) \
+                .cte("updated_receipt")
+            transaction_columns = [c.label(f"transaction_{c.key}") for c in TRANSACTION_COLUMNS]
+            stmt = select(updated, *transaction_columns) \
+                .outerjoin(Transaction, Transaction.receipt_id == updated.c.id)
+            rows = session.execute(stmt).all()
+
+            if not rows:
+                return None
+
+            session.bump_data_version(user_id)
             session.commit()
 
-            return session.query(Receipt) \
-                .filter_by(id=receipt_id) \
-                .options(joinedload(Receipt.transactions)) \
-                .first()
+        transactions = [
+            types.SimpleNamespace(**{c.key: getattr(row, f"transaction_{c.key}") for c in TRANSACTION_COLUMNS})
+            for row in rows if row.transaction_id is not None
+        ]
+        receipt = {c.key: getattr(rows[0], c.key) for c in RECEIPT_COLUMNS}
+        return types.SimpleNamespace(**receipt, transactions=transactions)
 
     def delete_receipt(self, receipt_id: int, user_id: int) -> None:
         with get_session() as session:
@@ -206,54 +498,192 @@ class Database:
 
             for transaction in r.transactions:
                 session.delete(transaction)
+                session.add_tombstones(transaction.user_id, "transactions", [transaction.id])
 
             session.delete(r)
+            session.add_tombstones(user_id, "receipts", [receipt_id])
+            session.bump_data_version(user_id)
             session.commit()
 
-    def get_receipts(self, offset=0, limit=100) -> List[Receipt]:
+    def get_receipts(
+        self,
+        offset=0,
+        limit=100,
+        user_id: Optional[int] = None,
+        has_transactions: Optional[bool] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        content_type: Optional[str] = None
+    ) -> List[types.SimpleNamespace]:
+        """
+        Returns lightweight receipt records with the same attributes as Receipt, including 'transactions'.
+        Every filter is optional:
+            * user_id: the owner of the receipts.
+            * has_transactions: whether the receipts have been vetted, i.e. linked to a transaction.
+            * start, end: inclusive range of 'created_at'.
+            * content_type: prefix of the content type. Ex. "image/"
+        """
+        stmt = select(*RECEIPT_COLUMNS)
+
+        if user_id is not None:
+            stmt = stmt.where(Receipt.user_id == user_id)
+        if has_transactions is not None:
+            has_transaction = exists().where(Transaction.receipt_id == Receipt.id)
+            stmt = stmt.where(has_transaction if has_transactions else ~has_transaction)
+        if start is not None:
+            stmt = stmt.where(Receipt.created_at >= start)
+        if end is not None:
+            stmt = stmt.where(Receipt.created_at <= end)
+        if content_type:
+            stmt = stmt.where(Receipt.content_type.startswith(content_type, autoescape=True))
+
         # In descending order of id -- i.e. latest first.
         with get_session() as session:
-            receipts = session.query(Receipt) \
-                .options(joinedload(Receipt.transactions)) \
-                .order_by(desc(Receipt.id)) \
-                .offset(offset) \
-                .limit(limit) \
-                .all()
-            return receipts
+            receipt_rows = session.execute(
+                stmt
+                .order_by(desc(Receipt.id))
+                .offset(offset)
+                .limit(limit)
+            ).all()
+            return session.with_transactions(receipt_rows)
+
+    def search_receipts(self, user_id: int, query: str, offset=0, limit=100) -> List[types.SimpleNamespace]:
+        """
+        The user's receipts whose recognized text contains every word of the query, latest first.
+        Same records as get_receipts.
+        """
+        stmt = select(*RECEIPT_COLUMNS) \
+            .join(ReceiptText, ReceiptText.receipt_id == Receipt.id) \
+            .where(Receipt.user_id == user_id) \
+            .where(func.to_tsvector(OCR_SEARCH_CONFIG, ReceiptText.text)
+                   .bool_op("@@")(func.plainto_tsquery(OCR_SEARCH_CONFIG, query)))
+
+        with get_session() as session:
+            receipt_rows = session.execute(stmt.order_by(desc(Receipt.id)).offset(offset).limit(limit)).all()
+            return session.with_transactions(receipt_rows)
+
+    def get_receipt_text(self, receipt_id: int, user_id: int) -> ReceiptText:
+        with get_session() as session:
+            receipt_text = session.scalar(
+                select(ReceiptText)
+                .join(Receipt, Receipt.id == ReceiptText.receipt_id)
+                .where(ReceiptText.receipt_id == receipt_id, Receipt.user_id == user_id))
+            if not receipt_text:
+                raise NotFound
+            return receipt_text
+
+    def get_receipt_ids_for_ocr(self, after_id: int = 0, limit: int = 100, retry_failed: bool = False) -> List[int]:
+        """
+        Ids of receipts that were never recognized, in ascending order, for the OCR backfill.
+        """
+        status = Receipt.ocr_metadata["status"].astext
+        pending = or_(status.is_(None), status == "failed") if retry_failed else status.is_(None)
+        with get_session() as session:
+            return session.scalars(
+                select(Receipt.id).where(Receipt.id > after_id, pending).order_by(Receipt.id).limit(limit)
+            ).all()
+
+    def save_receipt_ocr(self, receipt_id: int, rotation: int, ocr_metadata: dict, text: Optional[str] = None,
+                         lines: Optional[List[dict]] = None) -> bool:
+        """
+        Stores the OCR result of a receipt: the summary in ocr_metadata and, if given, the text and its lines.
+        Returns False, storing nothing, if the receipt was deleted or rotated since it was read: the result
+        no longer applies, and rotating queues the receipt again.
+        """
+        with get_session() as session:
+            user_id = session.scalar(
+                update(Receipt)
+                .where(Receipt.id == receipt_id, Receipt.rotation == rotation)
+                .values(ocr_metadata=ocr_metadata)
+                .returning(Receipt.user_id)
+            )
+            if user_id is None:
+                return False
+
+            if text is not None:
+                stmt = insert(ReceiptText).values(receipt_id=receipt_id, text=text, lines=lines or [])
+                session.execute(stmt.on_conflict_do_update(
+                    index_elements=[ReceiptText.receipt_id],
+                    set_=dict(text=stmt.excluded.text, lines=stmt.excluded.lines),
+                ))
+            session.bump_data_version(user_id)
+            session.commit()
+        return True
 
-    def get_receipt(self, receipt_id: int) -> Receipt:
+    def get_changes(self, user_id: int, since: Optional[datetime] = None) -> types.SimpleNamespace:
+        """
+        Returns the rows served by delta sync that were created, updated or deleted at or after 'since':
+            * receipts of the user, with 'transactions'
+            * transactions of the user, with 'line_items'
+            * vendors and categories of the user
+            * deleted: {resource: [ids]}
+            * synced_at: the database time right before the changes were read. Pass it back as 'since', minus
+              CHANGES_OVERLAP.
+        Without 'since', returns every row and no deletions.
+        """
+        with get_session() as session:
+            synced_at = session.scalar(select(func.localtimestamp()))
+
+            def changed_rows(model, *conditions):
+                stmt = select(*model.__table__.columns).where(*conditions).order_by(model.id)
+                if since is not None:
+                    stmt = stmt.where(model.updated_at >= since)
+                return session.execute(stmt).all()
+
+            deleted = dict()
+            if since is not None:
+                tombstones = session.execute(
+                    select(Tombstone.resource, Tombstone.resource_id)
+                    .where(Tombstone.user_id == user_id, Tombstone.deleted_at >= since)
+                ).all()
+                for resource, resource_id in tombstones:
+                    deleted.setdefault(resource, []).append(resource_id)
+
+            return types.SimpleNamespace(
+                synced_at=synced_at,
+                receipts=session.with_transactions(changed_rows(Receipt, Receipt.user_id == user_id)),
+                transactions=session.with_line_items(changed_rows(Transaction, Transaction.user_id == user_id)),
+                vendors=changed_rows(Vendor, Vendor.user_id == user_id),
+                categories=changed_rows(Category, Category.user_id == user_id),
+                deleted=deleted,
+            )
+
+    def get_receipt(self, receipt_id: int, user_id: Optional[int] = None) -> Receipt:
+        """
+        With a user_id, receipts of other users are not found.
+        """
         with get_session() as session:
             r = session.get_receipt(receipt_id=receipt_id)
-            if not r:
+            if not r or (user_id is not None and r.user_id != user_id):
                 raise NotFound
             return r
 
-    def get_transactions(self, user_id: int, offset=0, limit=100) -> List[Transaction]:
+    def get_transactions(self, user_id: int, offset=0, limit=100) -> List[Row]:
         with get_session() as session:
-            stmt = select(Transaction) \
+            stmt = select(*TRANSACTION_COLUMNS) \
                 .where(Transaction.user_id == user_id) \
                 .order_by(desc(Transaction.id)) \
                 .offset(offset) \
                 .limit(limit)
-            return session.scalars(stmt).all()
+            return session.execute(stmt).all()
 
-    def search_transactions_by_vendor(self, user_id: int, vendor_name: str) -> List[Transaction]:
+    def search_transactions_by_vendor(self, user_id: int, vendor_name: str) -> List[Row]:
         # TODO: replace this ILIKE-based search with a better approach as data grows:
         #   A) Short term: use Postgres built-in full-text search (tsvector/tsquery).
         #   B) Long term: integrate a proper search engine (e.g. Elasticsearch) for 100k+ rows.
         vendor_pattern = f"%{vendor_name}%"
         with get_session() as session:
-            stmt = select(Transaction) \
+            stmt = select(*TRANSACTION_COLUMNS) \
                 .join(Vendor, Transaction.vendor_id == Vendor.id) \
                 .where(Transaction.user_id == user_id) \
                 .where(Vendor.name.ilike(vendor_pattern)) \
                 .order_by(desc(Transaction.id))
-            return session.scalars(stmt).all()
+            return session.execute(stmt).all()
 
-    def get_transaction(self, transaction_id: int) -> Transaction:
+    def get_transaction(self, transaction_id: int, user_id: int) -> Transaction:
         with get_session() as session:
             t = session.get_transaction(transaction_id=transaction_id)
-            if not t:
+            if not t or t.user_id != user_id:
                 raise NotFound
             return t
 
@@ -268,6 +698,7 @@ class Database:
 
         with get_session() as session:
             session.add(transaction)
+            session.touch_receipts([receipt_id])
             transaction.line_items = [
                 LineItem(
                     name=li_dict.get("name"),
@@ -278,39 +709,50 @@ class Database:
                     category_id=li_dict.get("category_id")
                 ) for li_dict in line_items
             ]
+            session.bump_data_version(user_id)
             session.commit()
 
-            return session.get_transaction(transaction_id=transaction.id)
+        return transaction
 
     def update_transaction(self, user_id: int, transaction_id: int, line_items: List[dict], timestamp=datetime, vendor_id: int = None, receipt_id: int = None) -> Transaction:
-        transaction: Transaction = None
         with get_session() as session:
-            transaction = session \
-                .query(Transaction) \
-                .filter(Transaction.user_id == user_id, Transaction.id == transaction_id) \
-                .first()
+            session.touch_receipts([receipt_id], transaction_id=transaction_id)
+            transaction = session.scalars(
+                update(Transaction)
+                .where(Transaction.user_id == user_id, Transaction.id == transaction_id)
+                .values(
+                    amount=sum([li_dict.get("amount") for li_dict in line_items]),
+                    receipt_id=receipt_id,
+                    vendor_id=vendor_id,
+                    timestamp=timestamp)
+                .returning(Transaction)
+            ).first()
 
             if not transaction:
                 raise NotFound
 
-            transaction.amount = sum([li_dict.get("amount")
-                                     for li_dict in line_items])
-            transaction.receipt_id = receipt_id
-            transaction.vendor_id = vendor_id
-            transaction.timestamp = timestamp
-            transaction.line_items = [
-                LineItem(
-                    name=li_dict.get("name"),
-                    transaction_id=transaction.id,
-                    amount_input=li_dict.get("amount_input"),
-                    amount=li_dict.get("amount"),
-                    notes=li_dict.get("notes"),
-                    category_id=li_dict.get("category_id")
-                ) for li_dict in line_items
-            ]
+            # Replace the line items in bulk instead of loading the old collection for delete-orphan.
+            session.execute(
+                delete(LineItem).where(LineItem.transaction_id == transaction_id))
+            new_line_items = session.scalars(
+                insert(LineItem).returning(LineItem),
+                [
+                    dict(
+                        name=li_dict.get("name"),
+                        transaction_id=transaction_id,
+                        amount_input=li_dict.get("amount_input"),
+                        amount=li_dict.get("amount"),
+                        notes=li_dict.get("notes"),
+                        category_id=li_dict.get("category_id")
+                    ) for li_dict in line_items
+                ]
+            ).all() if line_items else []
+            set_committed_value(transaction, "line_items", new_line_items)
+
+            session.bump_data_version(user_id)
             session.commit()
 
-            return session.get_transaction(transaction_id=transaction.id)
+        return transaction
 
     def delete_transaction(self, user_id: int, transaction_id: int) -> None:
         with get_session() as session:
@@ -322,24 +764,126 @@ class Database:
             if not transaction:
                 raise NotFound
 
+            session.touch_receipts([transaction.receipt_id])
             session.delete(transaction)
+            session.add_tombstones(user_id, "transactions", [transaction_id])
+            session.bump_data_version(user_id)
             session.commit()
 
-    def get_vendor_by_id(self, id: int) -> Vendor:
+    def get_vendor_by_id(self, id: int, user_id: int) -> Vendor:
+        with get_session() as session:
+            return session.query(Vendor).filter(Vendor.id == id, Vendor.user_id == user_id).first()
+
+    def get_vendors_by_user_id(self, user_id: int, offset=0, limit=100) -> List[Row]:
+        with get_session() as session:
+            stmt = select(*VENDOR_COLUMNS) \
+                .where(Vendor.user_id == user_id) \
+                .order_by(Vendor.id) \
+                .offset(offset) \
+                .limit(limit)
+            return session.execute(stmt).all()
+
+    def get_category_by_id(self, id: int, user_id: int) -> Category:
         with get_session() as session:
-            return session.query(Vendor).filter(Vendor.id == id).first()
+            return session.query(Category).filter(Category.id == id, Category.user_id == user_id).first()
 
-    def get_vendors_by_user_id(self, user_id: int, offset=0, limit=100) -> List[Vendor]:
+    def get_categories_by_user_id(self, user_id: int, offset=0, limit=100) -> List[Row]:
         with get_session() as session:
-            return session.query(Vendor).filter(Vendor.user_id == user_id).offset(offset).limit(limit).all()
+            stmt = select(*CATEGORY_COLUMNS) \
+                .where(Category.user_id == user_id) \
+                .order_by(Category.id) \
+                .offset(offset) \
+                .limit(limit)
+            return session.execute(stmt).all()
 
-    def get_category_by_id(self, id: int) -> Category:
+    def get_vendors_with_usage(self, user_id: int, prefix: Optional[str] = None,
+                               limit: Optional[int] = None) -> List[Row]:
+        """
+        Returns the user's vendors with a `usage` column counting the transactions that reference them.
+        With a prefix, only vendors whose name starts with it (case-insensitive) are returned, most used first.
+        """
         with get_session() as session:
-            return session.query(Category).filter(Category.id == id).first()
+            usage = select(Transaction.vendor_id, func.count().label("usage")) \
+                .where(Transaction.user_id == user_id) \
+                .group_by(Transaction.vendor_id) \
+                .subquery()
+            stmt = select(*VENDOR_COLUMNS, func.coalesce(usage.c.usage, 0).label("usage")) \
+                .outerjoin(usage, usage.c.vendor_id == Vendor.id) \
+                .where(Vendor.user_id == user_id)
+
+            if prefix is not None:
+                stmt = stmt.where(func.lower(Vendor.name).startswith(prefix.lower(), autoescape=True)) \
+                    .order_by(desc("usage"), func.lower(Vendor.name))
+            else:
+                stmt = stmt.order_by(func.lower(Vendor.name))
+
+            return session.execute(stmt.limit(limit)).all()
 
-    def get_categories_by_user_id(self, user_id: int, offset=0, limit=100) -> List[Category]:
+    def get_categories_with_usage(self, user_id: int, prefix: Optional[str] = None,
+                                  limit: Optional[int] = None) -> List[Row]:
+        """
+        Returns the user's categories with a `usage` column counting the line items that reference them.
+        With a prefix, only categories whose name starts with it (case-insensitive) are returned, most used first.
+        """
         with get_session() as session:
-            return session.query(Category).filter(Category.user_id == user_id).offset(offset).limit(limit).all()
+            usage = select(LineItem.category_id, func.count().label("usage")) \
+                .join(Transaction, Transaction.id == LineItem.transaction_id) \
+                .where(Transaction.user_id == user_id) \
+                .group_by(LineItem.category_id) \
+                .subquery()
+            stmt = select(*CATEGORY_COLUMNS, func.coalesce(usage.c.usage, 0).label("usage")) \
+                .outerjoin(usage, usage.c.category_id == Category.id) \
+                .where(Category.user_id == user_id)
+
+            if prefix is not None:
+                stmt = stmt.where(func.lower(Category.name).startswith(prefix.lower(), autoescape=True)) \
+                    .order_by(desc("usage"), func.lower(Category.name))
+            else:
+                stmt = stmt.order_by(func.lower(Category.name))
+
+            return session.execute(stmt.limit(limit)).all()
+
+    def get_line_item_categories(self, user_id: int, since: Optional[datetime] = None) -> types.SimpleNamespace:
+        """
+        Returns the categories that the user gave to line items, for the suggestion index. Like get_changes:
+            * rows: transaction_id, vendor_id, name and category_id of each line item of the transactions
+              created or updated at or after 'since'. A transaction without line items has one row with a null name.
+            * deleted: ids of the transactions deleted at or after 'since'
+            * synced_at: the database time right before the rows were read. Pass it back as 'since', minus
+              CHANGES_OVERLAP.
+        """
+        with get_session() as session:
+            synced_at = session.scalar(select(func.localtimestamp()))
+
+            stmt = select(Transaction.id.label("transaction_id"), Transaction.vendor_id, LineItem.name,
+                          LineItem.category_id) \
+                .outerjoin(LineItem, LineItem.transaction_id == Transaction.id) \
+                .where(Transaction.user_id == user_id)
+            deleted = []
+            if since is not None:
+                stmt = stmt.where(Transaction.updated_at >= since)
+                deleted = session.scalars(
+                    select(Tombstone.resource_id)
+                    .where(Tombstone.user_id == user_id, Tombstone.resource == "transactions",
+                           Tombstone.deleted_at >= since)
+                ).all()
+
+            return types.SimpleNamespace(synced_at=synced_at, rows=session.execute(stmt).all(), deleted=deleted)
+
+    def get_receipt_ocr(self, receipt_id: int, user_id: int) -> Optional[Row]:
+        """
+        Returns the receipt's ocr_metadata, its recognized text, and the id of the user's vendor named by the OCR
+        vendor guess, or None if the user does not own the receipt.
+        """
+        with get_session() as session:
+            stmt = select(Receipt.ocr_metadata, ReceiptText.text, Vendor.id.label("vendor_id")) \
+                .outerjoin(ReceiptText, ReceiptText.receipt_id == Receipt.id) \
+                .outerjoin(Vendor, and_(
+                    Vendor.user_id == Receipt.user_id,
+                    func.lower(Vendor.name) == func.lower(Receipt.ocr_metadata["vendor"]["value"].astext))) \
+                .where(Receipt.id == receipt_id, Receipt.user_id == user_id) \
+                .limit(1)
+            return session.execute(stmt).first()
 
     def create_vendor(self, user_id: int, name: str) -> Vendor:
         v = Vendor(
@@ -349,25 +893,27 @@ class Database:
 
         with get_session() as session:
             session.add(v)
+            session.bump_data_version(user_id)
             session.commit()
-            v = session.query(Vendor).filter(
-                Vendor.user_id == user_id, Vendor.name == name).first()
 
         return v
 
     def update_vendor(self, id: int, user_id: int, name: str) -> Vendor:
         with get_session() as session:
-            v = session.query(Vendor) \
-                .filter(Vendor.id == id, Vendor.user_id == user_id) \
-                .first()
+            v = session.scalars(
+                update(Vendor)
+                .where(Vendor.id == id, Vendor.user_id == user_id)
+                .values(name=name)
+                .returning(Vendor)
+            ).first()
 
-            v.name = name
+            if not v:
+                raise NotFound
 
+            session.bump_data_version(user_id)
             session.commit()
 
-            return session.query(Vendor) \
-                .filter(Vendor.id == id) \
-                .first()
+        return v
 
     def delete_vendor(self, id: int, user_id: int) -> None:
         with get_session() as session:
@@ -389,6 +935,8 @@ class Database:
                 raise ValueError(f"Vendor {id} has associated transactions and cannot be deleted. First 10 Transaction IDs: {associated_ids}")
 
             session.delete(v)
+            session.add_tombstones(user_id, "vendors", [id])
+            session.bump_data_version(user_id)
             session.commit()
 
     def merge_vendors(self, user_id: int, source_ids: List[int], target_id: int) -> None:
@@ -397,16 +945,23 @@ class Database:
             if not target:
                 raise NotFound
 
-            session.query(Transaction).filter(
+            moved_transactions = session.query(Transaction).filter(
                 Transaction.user_id == user_id,
                 Transaction.vendor_id.in_(source_ids)
-            ).update({Transaction.vendor_id: target_id}, synchronize_session=False)
-
-            session.query(Vendor).filter(
-                Vendor.id.in_(source_ids),
-                Vendor.user_id == user_id
-            ).delete(synchronize_session=False)
-
+            )
+            session.touch_receipts([
+                receipt_id for receipt_id, in moved_transactions.with_entities(Transaction.receipt_id).distinct()
+            ])
+            moved_transactions.update({Transaction.vendor_id: target_id}, synchronize_session=False)
+
+            deleted_ids = session.execute(
+                delete(Vendor)
+                .where(Vendor.id.in_(source_ids), Vendor.user_id == user_id)
+                .returning(Vendor.id)
+            ).scalars().all()
+            session.add_tombstones(user_id, "vendors", deleted_ids)
+
+            session.bump_data_version(user_id)
             session.commit()
 
     def create_category(self, user_id: int,  name: str, description: str, with_autotax) -> Category:
@@ -419,26 +974,27 @@ class Database:
 
         with get_session() as session:
             session.add(c)
+            session.bump_data_version(user_id)
             session.commit()
-            # lazy load the auto-gen ID
-            c.id
+
         return c
 
     def update_category(self, id: int, user_id: int, name: str, description: str, with_autotax) -> Category:
         with get_session() as session:
-            c = session.query(Category) \
-                .filter(Category.id == id, Category.user_id == user_id) \
-                .first()
+            c = session.scalars(
+                update(Category)
+                .where(Category.id == id, Category.user_id == user_id)
+                .values(name=name, description=description, with_autotax=with_autotax)
+                .returning(Category)
+            ).first()
 
-            c.name = name
-            c.description = description
-            c.with_autotax = with_autotax
+            if not c:
+                raise NotFound
 
+            session.bump_data_version(user_id)
             session.commit()
 
-            return session.query(Category) \
-                .filter(Category.id == id) \
-                .first()
+        return c
 
     def delete_category(self, id: int, user_id: int) -> None:
         with get_session() as session:
@@ -450,46 +1006,105 @@ class Database:
                 raise NotFound
 
             session.delete(c)
+            session.add_tombstones(user_id, "categories", [id])
+            session.bump_data_version(user_id)
             session.commit()
 
-    def get_line_items(self, user_id: int, start: datetime, end: datetime, offset: int, limit: int) -> List[LineItem]:
+    def get_timezone_names(self) -> frozenset:
+        """
+        The IANA zone names Postgres can convert to. Read once per process.
+        """
+        if self._timezone_names is None:
+            with get_session() as session:
+                self._timezone_names = frozenset(
+                    session.execute(text("SELECT name FROM pg_timezone_names")).scalars())
+        return self._timezone_names
+
+    def get_line_items(self, user_id: int, start: datetime, end: datetime, offset: int, limit: int,
+                       tz_name: str = "UTC") -> List[Row]:
+        """
+        Returns rows with the attributes listed in report_line_item_columns.
+        start and end are naive UTC, like the stored timestamps, so the range uses ix_transactions_user_id_timestamp.
+        """
         with get_session() as session:
-            return session.query(LineItem) \
+            stmt = select(*report_line_item_columns(tz_name)) \
                 .join(Transaction, LineItem.transaction_id == Transaction.id) \
-                .filter(
+                .where(
                     Transaction.user_id == user_id,
                     Transaction.timestamp >= start,
                     Transaction.timestamp <= end) \
-                .options(joinedload(LineItem.transaction)) \
+                .order_by(LineItem.id) \
                 .offset(offset) \
-                .limit(limit) \
-                .all()
+                .limit(limit)
+            return session.execute(stmt).all()
+
+    def get_line_item_columns(self, user_id: int, start: datetime, end: datetime,
+                              tz_name: str = "UTC") -> Dict[str, tuple]:
+        """
+        Like get_line_items, without pagination, transposed to {column name: values}.
+        The columns are the ones listed in report_line_item_array_columns.
+        """
+        columns = report_line_item_array_columns(tz_name)
+        with get_session() as session:
+            stmt = select(*columns) \
+                .join(Transaction, LineItem.transaction_id == Transaction.id) \
+                .where(
+                    Transaction.user_id == user_id,
+                    Transaction.timestamp >= start,
+                    Transaction.timestamp <= end) \
+                .order_by(LineItem.id)
+            rows = session.execute(stmt).all()
+
+        names = [column.key for column in columns]
+        values = list(zip(*rows)) if rows else [()] * len(names)
+        return dict(zip(names, values))
 
-    def get_line_items_by_vendor(self, user_id: int, vendor_id: int, offset=0, limit=500) -> List[LineItem]:
+    def get_monthly_expenses(self, user_id: int, start: datetime, end: datetime, tz_name: str = "UTC") -> List[Row]:
+        """
+        Sums line item amounts per local calendar month and category. Rows have year, month, category_id and amount.
+        """
+        month = func.date_trunc("month", local_timestamp(Transaction.timestamp, tz_name))
+        with get_session() as session:
+            stmt = select(
+                cast(func.extract("year", month), Integer).label("year"),
+                cast(func.extract("month", month), Integer).label("month"),
+                LineItem.category_id,
+                func.sum(LineItem.amount).label("amount"),
+            ) \
+                .join(Transaction, LineItem.transaction_id == Transaction.id) \
+                .where(
+                    Transaction.user_id == user_id,
+                    Transaction.timestamp >= start,
+                    Transaction.timestamp <= end) \
+                .group_by(month, LineItem.category_id) \
+                .order_by(month, LineItem.category_id)
+            return session.execute(stmt).all()
+
+    def get_line_items_by_vendor(self, user_id: int, vendor_id: int, offset=0, limit=500,
+                                 tz_name: str = "UTC") -> List[Row]:
         with get_session() as session:
-            return session.query(LineItem) \
+            stmt = select(*report_line_item_columns(tz_name)) \
                 .join(Transaction, LineItem.transaction_id == Transaction.id) \
-                .filter(
+                .where(
                     Transaction.user_id == user_id,
-                    Transaction.vendor_id == vendor_id
-                ) \
-                .options(joinedload(LineItem.transaction)) \
+                    Transaction.vendor_id == vendor_id) \
+                .order_by(LineItem.id) \
                 .offset(offset) \
-                .limit(limit) \
-                .all()
+                .limit(limit)
+            return session.execute(stmt).all()
 
-    def get_line_items_by_category(self, user_id: int, category_id: int, offset=0, limit=500) -> List[LineItem]:
+    def get_line_items_by_category(self, user_id: int, category_id: int, offset=0, limit=500,
+                                   tz_name: str = "UTC") -> List[Row]:
         with get_session() as session:
-            return session.query(LineItem) \
+            stmt = select(*report_line_item_columns(tz_name)) \
                 .join(Transaction, LineItem.transaction_id == Transaction.id) \
-                .filter(
+                .where(
                     Transaction.user_id == user_id,
-                    LineItem.category_id == category_id
-                ) \
-                .options(joinedload(LineItem.transaction)) \
+                    LineItem.category_id == category_id) \
+                .order_by(LineItem.id) \
                 .offset(offset) \
-                .limit(limit) \
-                .all()
+                .limit(limit)
+            return session.execute(stmt).all()
 
 
 instance = Database()
@@ -0,0 +1,26 @@
+import logging
+from typing import Callable, List
+
+logger = logging.getLogger("receep")
+
+# Called as listener(user_id, version) after a DB transaction that changed the user's data commits.
+# Listeners run on the committing thread, so they must return quickly and must not raise.
+Listener = Callable[[int, int], None]
+
+_listeners: List[Listener] = []
+
+
+def subscribe(listener: Listener) -> None:
+    _listeners.append(listener)
+
+
+def unsubscribe(listener: Listener) -> None:
+    _listeners.remove(listener)
+
+
+def publish(user_id: int, version: int) -> None:
+    for listener in list(_listeners):
+        try:
+            listener(user_id, version)
+        except Exception:
+            logger.exception(f"Change listener failed. {user_id=} {version=}")
@@ -0,0 +1,47 @@
+"""
+Creates and upgrades the schema. Run once per deploy, before the API starts:
+
+    python -m persistence.migrations
+
+Every step is idempotent. `Base.metadata.create_all` only creates missing tables, so anything added to an existing
+table goes in the lists below.
+"""
+import logging
+
+from sqlalchemy import Engine
+
+from persistence.schema import Base
+
+logger = logging.getLogger("receep")
+
+COLUMN_MIGRATIONS = [
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now()",
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now()",
+    "ALTER TABLE vendors ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now()",
+    "ALTER TABLE categories ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now()",
+]
+
+
+def run_migrations(engine: Engine) -> None:
+    with engine.begin() as conn:
+        for statement in COLUMN_MIGRATIONS:
+            conn.exec_driver_sql(statement)
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+    logger.info("Schema migrations applied.")
+
+
+def migrate(engine: Engine) -> None:
+    Base.metadata.create_all(engine)
+    run_migrations(engine)
+
+
+if __name__ == "__main__":
+    from persistence.database import dispose_engine, get_engine
+
+    logging.basicConfig(level=logging.INFO)
+    migrate(get_engine())
+    dispose_engine()
@@ -1,6 +1,6 @@
 from typing import List
-from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Integer, Float, String, Table,
-                        Text, UniqueConstraint, func)
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer, Float, String, Table,
+                        Text, UniqueConstraint, func, literal_column)
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -8,6 +8,13 @@ from sqlalchemy.orm import relationship
 Base = declarative_base()
 
 
+def updated_at_column():
+    """
+    Bumped on every INSERT and UPDATE, including bulk UPDATE statements. Used by delta sync.
+    """
+    return Column(DateTime, nullable=False, default=func.now(), onupdate=func.now(), server_default=func.now())
+
+
 user_roles = Table(
     'user_roles',
     Base.metadata,
@@ -49,9 +56,37 @@ class Receipt(Base):
     content_hash = Column(String(64), nullable=False, unique=True)
     rotation = Column(Integer, nullable=False)
     ocr_metadata = Column(JSONB, nullable=False)
+    updated_at = updated_at_column()
 
     transactions = relationship("Transaction", back_populates="receipt")
 
+    __table_args__ = (
+        Index('ix_receipts_user_id_id', 'user_id', 'id'),
+        Index('ix_receipts_user_id_updated_at', 'user_id', 'updated_at'),
+    )
+
+
+# Text search configuration of the OCR index. "simple" neither stems nor drops stop words, so it works for any
+# language and for vendor names.
+OCR_SEARCH_CONFIG = literal_column("'simple'")
+
+
+class ReceiptText(Base):
+    """
+    The text recognized in a receipt. Kept apart from Receipt.ocr_metadata, which only holds the summary,
+    so that receipt lists and delta sync do not carry it.
+    """
+    __tablename__ = 'receipt_texts'
+
+    receipt_id = Column(Integer, ForeignKey('receipts.id', ondelete='CASCADE'), primary_key=True)
+    text = Column(Text, nullable=False)
+    # [{"page": 0, "text": "TOTAL 12.50", "box": [x0, y0, x1, y1], "confidence": 91.5}], boxes relative to the page
+    lines = Column(JSONB, nullable=False)
+
+    __table_args__ = (
+        Index('ix_receipt_texts_search', func.to_tsvector(OCR_SEARCH_CONFIG, text), postgresql_using='gin'),
+    )
+
 
 class Vendor(Base):
     __tablename__ = 'vendors'
@@ -59,9 +94,15 @@ class Vendor(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     name = Column(String(64), nullable=False)
+    updated_at = updated_at_column()
 
-    __table_args__ = (UniqueConstraint(
-        'user_id', 'name', name='uq_user_vendor_name'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'name', name='uq_user_vendor_name'),
+        Index('ix_vendors_user_id_updated_at', 'user_id', 'updated_at'),
+        # Case-insensitive prefix lookups for typeahead.
+        Index('ix_vendors_user_id_lower_name', 'user_id', func.lower(name).label('lower_name'),
+              postgresql_ops={'lower_name': 'text_pattern_ops'}),
+    )
 
 
 class Category(Base):
@@ -73,9 +114,14 @@ class Category(Base):
     with_autotax = Column(Boolean, nullable=False, server_default='true')
 
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    updated_at = updated_at_column()
 
     __table_args__ = (
         UniqueConstraint('user_id', 'name', name='uq_user_category_name'),
+        Index('ix_categories_user_id_updated_at', 'user_id', 'updated_at'),
+        # Case-insensitive prefix lookups for typeahead.
+        Index('ix_categories_user_id_lower_name', 'user_id', func.lower(name).label('lower_name'),
+              postgresql_ops={'lower_name': 'text_pattern_ops'}),
     )
 
 
@@ -100,6 +146,11 @@ class LineItem(Base):
 
     transaction = relationship("Transaction")
 
+    __table_args__ = (
+        # Reading and replacing the line items of given transactions
+        Index('ix_line_items_transaction_id', 'transaction_id'),
+    )
+
 
 class Transaction(Base):
     __tablename__ = 'transactions'
@@ -110,6 +161,7 @@ class Transaction(Base):
     vendor_id = Column(Integer, ForeignKey('vendors.id'))
     receipt_id = Column(Integer, ForeignKey('receipts.id'))
     amount = Column(Float, nullable=False)
+    updated_at = updated_at_column()
 
     receipt = relationship(
         "Receipt",
@@ -120,3 +172,58 @@ class Transaction(Base):
         "LineItem",
         cascade="all, delete-orphan",
     )
+
+    __table_args__ = (
+        Index('ix_transactions_user_id_updated_at', 'user_id', 'updated_at'),
+        Index('ix_transactions_receipt_id', 'receipt_id'),
+        # Report date ranges
+        Index('ix_transactions_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+
+class RefreshToken(Base):
+    """
+    Only the SHA-256 of the token is stored. Tokens are single use: refreshing revokes the presented token.
+    """
+    __tablename__ = 'refresh_tokens'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    token_hash = Column(String(64), nullable=False, unique=True)
+    created_at = Column(DateTime, nullable=False, default=func.now(), server_default=func.now())
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_refresh_tokens_user_id', 'user_id'),
+    )
+
+
+class DataVersion(Base):
+    """
+    Per-user counter that every mutating Database method bumps.
+    Read paths use it to build ETags without touching the main tables.
+    """
+    __tablename__ = 'data_versions'
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class Tombstone(Base):
+    """
+    Records deleted rows so that delta sync can tell clients what to remove.
+    """
+    __tablename__ = 'tombstones'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # The owner of the deleted row.
+    user_id = Column(Integer, nullable=False)
+    # Table name of the deleted row. Ex. "transactions"
+    resource = Column(String(32), nullable=False)
+    resource_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=func.now(), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_tombstones_user_id_deleted_at', 'user_id', 'deleted_at'),
+    )
@@ -23,4 +23,13 @@ while true; do
     sleep 2
 done
 
-uvicorn main:fastapi_app --reload --host 0.0.0.0 --port 80
+# Creates and upgrades the schema once, before any worker starts.
+python -m persistence.migrations || exit 1
+
+if [ "$RELOAD" = "1" ]; then
+    # Development: a single process that restarts on code changes.
+    exec uvicorn main:create_app --factory --reload --host 0.0.0.0 --port 80
+fi
+
+# exec, so that gunicorn receives the container's SIGTERM and shuts the workers down gracefully.
+exec gunicorn "main:create_app()" -c gunicorn.conf.py
@@ -0,0 +1,56 @@
+"""
+Shared setup for the tests that need a disposable PostgreSQL database: set RECEEP_TEST_DATABASE_URL to run them.
+The schema is dropped and recreated for each test class.
+"""
+import os
+import unittest
+from contextlib import contextmanager
+from typing import Optional
+from unittest import mock
+
+from sqlalchemy import event
+
+TEST_DATABASE_URL = os.getenv("RECEEP_TEST_DATABASE_URL")
+
+requires_database = unittest.skipUnless(TEST_DATABASE_URL, "RECEEP_TEST_DATABASE_URL is not set")
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@requires_database
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Points DATABASE_URL and the engine at the test database with an empty schema, and creates the user named
+    `username`, if any, as cls.user. DATABASE_URL and the previous engine are restored once the class is done.
+    """
+    username: Optional[str] = None
+
+    @classmethod
+    def setUpClass(cls):
+        from persistence import database
+        from persistence.schema import Base
+
+        cls.enterClassContext(mock.patch.dict(os.environ, DATABASE_URL=TEST_DATABASE_URL))
+        cls.enterClassContext(mock.patch.object(database, "_engine", None))
+        cls.addClassCleanup(database.dispose_engine)
+
+        cls.engine = database.get_engine()
+        Base.metadata.drop_all(cls.engine)
+        Base.metadata.create_all(cls.engine)
+
+        cls.db = database.Database()
+        if cls.username is not None:
+            cls.db.create_user(cls.username)
+            cls.user = cls.db.get_user_by_username(cls.username)
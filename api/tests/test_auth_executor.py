@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from api.access.exceptions import AuthBusy
+from api.access.executor import AuthExecutor
+
+
+class AuthExecutorTests(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrency_is_limited_to_the_workers(self):
+        executor = AuthExecutor(workers=2, queue_limit=10)
+        lock = threading.Lock()
+        running, peak = 0, 0
+
+        def work():
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            return "done"
+
+        results = await asyncio.gather(*(executor.run(work) for _ in range(6)))
+
+        self.assertEqual(results, ["done"] * 6)
+        self.assertEqual(peak, 2)
+        self.assertEqual(executor.max_queue_depth, 4)
+        self.assertEqual(executor.queue_depth, 0)
+
+    async def test_calls_beyond_the_queue_limit_are_rejected(self):
+        executor = AuthExecutor(workers=1, queue_limit=1)
+        release = threading.Event()
+
+        blocked = [asyncio.create_task(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        self.assertEqual((executor.active, executor.queue_depth), (1, 1))
+
+        with self.assertRaises(AuthBusy):
+            await executor.run(release.wait)
+        self.assertEqual(executor.rejected, 1)
+
+        release.set()
+        await asyncio.gather(*blocked)
+        self.assertEqual((executor.active, executor.queue_depth), (0, 0))
+
+    async def test_event_loop_stays_responsive(self):
+        executor = AuthExecutor(workers=1, queue_limit=1)
+        work = asyncio.create_task(executor.run(time.sleep, 0.2))
+
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        self.assertLess(time.perf_counter() - started, 0.1)
+        await work
+
+
+if __name__ == "__main__":
+    unittest.main()
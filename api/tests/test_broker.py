@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import unittest
+
+from sqlalchemy import create_engine
+
+from api import broker
+from api.broker import InMemoryBroker, PostgresBroker, decode_notify_payload, encode_notify_payloads
+from tests.db import TEST_DATABASE_URL, requires_database
+
+
+class Recorder:
+    def __init__(self):
+        self.batches = []
+        self.received = asyncio.Event()
+
+    def __call__(self, batch):
+        self.batches.append(batch)
+        self.received.set()
+
+    async def wait(self, timeout=5):
+        await asyncio.wait_for(self.received.wait(), timeout)
+        self.received.clear()
+
+
+class InMemoryBrokerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.recorder = Recorder()
+        self.broker = InMemoryBroker(batch_interval=0.01)
+        await self.broker.start(self.recorder)
+
+    async def asyncTearDown(self):
+        await self.broker.stop()
+
+    async def test_events_are_coalesced_per_user(self):
+        for version in (3, 5, 4):
+            self.broker.publish(1, version)
+        self.broker.publish(2, 7)
+
+        await self.recorder.wait()
+        self.assertEqual(self.recorder.batches, [{1: 5, 2: 7}])
+
+    async def test_publish_from_other_threads(self):
+        threads = [threading.Thread(target=self.broker.publish, args=(user_id, 1)) for user_id in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        await self.recorder.wait()
+        self.assertEqual(self.recorder.batches, [{user_id: 1 for user_id in range(10)}])
+
+    async def test_publish_before_start_is_ignored(self):
+        stopped = InMemoryBroker()
+        stopped.publish(1, 1)
+        self.assertEqual(stopped._pending, dict())
+
+
+class NotifyPayloadTests(unittest.TestCase):
+    def test_large_batches_are_split(self):
+        batch = {user_id: 2 ** 31 - 1 for user_id in range(10 ** 8, 10 ** 8 + 2 * broker.NOTIFY_BATCH_SIZE + 1)}
+        payloads = list(encode_notify_payloads(batch))
+
+        self.assertEqual(len(payloads), 3)
+        self.assertTrue(all(len(payload.encode()) < 8000 for payload in payloads))
+
+        decoded = dict()
+        for payload in payloads:
+            decoded.update(decode_notify_payload(payload))
+        self.assertEqual(decoded, batch)
+
+
+@requires_database
+class PostgresBrokerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_engine(TEST_DATABASE_URL)
+        # Two brokers stand in for two API workers.
+        self.recorders = [Recorder(), Recorder()]
+        self.brokers = [PostgresBroker(self.engine, batch_interval=0.01) for _ in self.recorders]
+        for b, recorder in zip(self.brokers, self.recorders):
+            await b.start(recorder)
+
+    async def asyncTearDown(self):
+        for b in self.brokers:
+            await b.stop()
+        self.engine.dispose()
+
+    async def test_events_reach_every_worker(self):
+        self.brokers[0].publish(1, 2)
+        self.brokers[0].publish(1, 3)
+
+        for recorder in self.recorders:
+            await recorder.wait()
+            self.assertEqual(recorder.batches, [{1: 3}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+"""
+Asserts which rows delta sync resends after a write.
+"""
+import unittest
+from datetime import datetime
+
+from tests.db import DatabaseTestCase
+
+
+class ChangesTests(DatabaseTestCase):
+    username = "changes"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user_id = cls.user.id
+
+    def test_merge_vendors_resends_receipts_of_moved_transactions(self):
+        source = self.db.create_vendor(self.user_id, "Grocer")
+        target = self.db.create_vendor(self.user_id, "The Grocer")
+        receipt = self.db.create_receipt(self.user_id, "image/png", 10, "merge-hash")
+        transaction = self.db.create_transaction(
+            self.user_id, [], timestamp=datetime(2024, 1, 1), vendor_id=source.id, receipt_id=receipt.id)
+        synced_at = self.db.get_changes(self.user_id).synced_at
+
+        self.db.merge_vendors(self.user_id, [source.id], target.id)
+
+        changes = self.db.get_changes(self.user_id, since=synced_at)
+        self.assertEqual([r.id for r in changes.receipts], [receipt.id])
+        self.assertEqual([(t.id, t.vendor_id) for t in changes.receipts[0].transactions], [(transaction.id, target.id)])
+        self.assertEqual([(t.id, t.vendor_id) for t in changes.transactions], [(transaction.id, target.id)])
+        self.assertEqual(changes.deleted, {"vendors": [source.id]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import gzip
+import unittest
+
+import brotli
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from api.compression import CompressionMiddleware, choose_encoding
+
+ITEMS = dict(items=[dict(id=i, vendor="Corner Store", total=1250, line_items=[]) for i in range(500)])
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+
+    @app.get("/items")
+    def items():
+        return ORJSONResponse(ITEMS, headers={"ETag": '"v1"'})
+
+    @app.get("/small")
+    def small():
+        return dict(message="success")
+
+    @app.get("/image")
+    def image():
+        return Response(b"\xff\xd8" * 4096, media_type="image/jpeg")
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse((f"line {i}\n" for i in range(2000)), media_type="text/plain")
+
+    @app.get("/encoded")
+    def encoded():
+        return PlainTextResponse(gzip.compress(b"x" * 4096), headers={"Content-Encoding": "gzip"})
+
+    return app
+
+
+class ChooseEncodingTests(unittest.TestCase):
+    def test_negotiation(self):
+        cases = [
+            (None, None),
+            ("identity", None),
+            ("gzip, deflate", "gzip"),
+            ("gzip, deflate, br", "br"),
+            ("br;q=0.5, gzip", "gzip"),
+            ("br;q=0, gzip;q=0", None),
+            ("*", "br"),
+            ("*;q=0.5, gzip;q=0.8", "gzip"),
+            ("gzip;q=bad, br", "br"),
+        ]
+        for accept_encoding, expected in cases:
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertEqual(choose_encoding(accept_encoding), expected)
+
+
+class CompressionMiddlewareTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(make_app())
+
+    def get(self, path: str, accept_encoding: str):
+        # stream=True keeps the body as sent, without the client's own decoding.
+        with self.client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+            return response, b"".join(response.iter_raw())
+
+    def test_brotli_and_gzip(self):
+        plain, plain_body = self.get("/items", "identity")
+        self.assertNotIn("content-encoding", plain.headers)
+
+        for encoding, decompress in (("br", brotli.decompress), ("gzip", gzip.decompress)):
+            with self.subTest(encoding=encoding):
+                response, body = self.get("/items", encoding)
+                self.assertEqual(response.headers["content-encoding"], encoding)
+                self.assertEqual(response.headers["content-length"], str(len(body)))
+                self.assertEqual(response.headers["vary"], "Accept-Encoding")
+                self.assertEqual(response.headers["etag"], 'W/"v1"')
+                self.assertEqual(decompress(body), plain_body)
+                self.assertLess(len(body), len(plain_body) / 5)
+
+    def test_small_and_binary_responses_are_not_compressed(self):
+        for path in ("/small", "/image", "/encoded"):
+            with self.subTest(path=path):
+                response, _ = self.get(path, "br, gzip")
+                self.assertNotEqual(response.headers.get("content-encoding"), "br")
+
+    def test_streamed_body(self):
+        response, body = self.get("/stream", "gzip")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertNotIn("content-length", response.headers)
+        self.assertEqual(gzip.decompress(body), "".join(f"line {i}\n" for i in range(2000)).encode())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Asserts how many SQL statements each write path issues.
+"""
+import unittest
+from datetime import datetime
+
+from tests.db import DatabaseTestCase, count_statements
+
+
+class WritePathStatementTests(DatabaseTestCase):
+    username = "statements"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user_id = cls.user.id
+        cls.category_id = cls.db.create_category(cls.user_id, "Groceries", "", True).id
+
+    def _line_items(self, count=3):
+        return [
+            dict(name=f"item {i}", amount_input="1", amount=1.0, notes=None, category_id=self.category_id)
+            for i in range(count)
+        ]
+
+    def test_create_vendor(self):
+        with count_statements(self.engine) as statements:
+            vendor = self.db.create_vendor(self.user_id, "Grocer")
+
+        self.assertEqual(vendor.name, "Grocer")
+        self.assertIsNotNone(vendor.id)
+        # INSERT vendor, bump data version
+        self.assertEqual(len(statements), 2, statements)
+
+    def test_update_vendor(self):
+        vendor = self.db.create_vendor(self.user_id, "Old name")
+
+        with count_statements(self.engine) as statements:
+            updated = self.db.update_vendor(vendor.id, self.user_id, "New name")
+
+        self.assertEqual(updated.name, "New name")
+        # UPDATE ... RETURNING, bump data version
+        self.assertEqual(len(statements), 2, statements)
+
+    def test_update_category(self):
+        category = self.db.create_category(self.user_id, "Old", "", True)
+
+        with count_statements(self.engine) as statements:
+            updated = self.db.update_category(category.id, self.user_id, "New", "desc", False)
+
+        self.assertEqual((updated.name, updated.description, updated.with_autotax), ("New", "desc", False))
+        self.assertEqual(len(statements), 2, statements)
+
+    def test_create_transaction(self):
+        with count_statements(self.engine) as statements:
+            transaction = self.db.create_transaction(
+                self.user_id, self._line_items(), timestamp=datetime(2024, 1, 1))
+
+        self.assertEqual(len(transaction.line_items), 3)
+        self.assertEqual(transaction.amount, 3.0)
+        # INSERT transaction, INSERT line items (batched), bump data version
+        self.assertEqual(len(statements), 3, statements)
+
+    def test_update_transaction(self):
+        transaction = self.db.create_transaction(
+            self.user_id, self._line_items(), timestamp=datetime(2024, 1, 1))
+
+        with count_statements(self.engine) as statements:
+            updated = self.db.update_transaction(
+                self.user_id, transaction.id, self._line_items(2), timestamp=datetime(2024, 1, 2))
+
+        self.assertEqual(len(updated.line_items), 2)
+        self.assertEqual(updated.amount, 2.0)
+        self.assertEqual(updated.timestamp, datetime(2024, 1, 2))
+        # touch linked receipts, UPDATE ... RETURNING, DELETE line items, INSERT line items (batched),
+        # bump data version
+        self.assertEqual(len(statements), 5, statements)
+
+    def test_rotate_receipt(self):
+        receipt = self.db.create_receipt(self.user_id, "image/png", 10, "rotate-hash")
+        self.db.create_transaction(
+            self.user_id, self._line_items(1), timestamp=datetime(2024, 1, 1), receipt_id=receipt.id)
+
+        with count_statements(self.engine) as statements:
+            rotated = self.db.rotate_receipt(receipt.id, self.user_id, 90)
+
+        self.assertEqual(rotated.rotation, 90)
+        self.assertEqual(len(rotated.transactions), 1)
+        # UPDATE ... RETURNING joined with the transactions, bump data version
+        self.assertEqual(len(statements), 2, statements)
+
+    def test_user_count_is_cached_until_a_user_is_created(self):
+        count = self.db.get_user_count()
+
+        with count_statements(self.engine) as statements:
+            self.assertEqual(self.db.get_user_count(), count)
+        self.assertEqual(len(statements), 0, statements)
+
+        self.db.create_user("another")
+        self.assertEqual(self.db.get_user_count(), count + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
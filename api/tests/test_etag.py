@@ -0,0 +1,29 @@
+import unittest
+
+from api.etag import etag_matches, make_etag
+
+
+class EtagTests(unittest.TestCase):
+    def test_etag_changes_with_user_and_version(self):
+        etag = make_etag(1, 5)
+
+        self.assertNotEqual(etag, make_etag(2, 5))
+        self.assertNotEqual(etag, make_etag(1, 6))
+
+    def test_missing_header_does_not_match(self):
+        self.assertFalse(etag_matches(None, make_etag(1, 5)))
+        self.assertFalse(etag_matches("", make_etag(1, 5)))
+
+    def test_matches_any_candidate_using_weak_comparison(self):
+        etag = make_etag(1, 5)
+        strong = etag[2:]
+
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(strong, etag))
+        self.assertTrue(etag_matches(f'"other", {etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches(make_etag(1, 4), etag))
+
+
+if __name__ == "__main__":
+    unittest.main()
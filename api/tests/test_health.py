@@ -0,0 +1,45 @@
+"""
+Covers the liveness and readiness routes.
+"""
+import unittest
+from unittest import mock
+
+from tests.db import DatabaseTestCase
+
+
+class HealthTests(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from sqlalchemy.exc import OperationalError
+
+        from api.routers import health
+
+        app = FastAPI()
+        app.include_router(health.router)
+        cls.health = health
+        cls.client = TestClient(app)
+        cls.OperationalError = OperationalError
+
+    def test_live(self):
+        response = self.client.get("/health/live")
+        self.assertEqual((response.status_code, response.json()), (200, dict(status="ok")))
+
+    def test_ready_when_the_database_answers(self):
+        response = self.client.get("/health/ready")
+        self.assertEqual((response.status_code, response.json()), (200, dict(status="ok")))
+
+    def test_not_ready_when_the_database_is_unreachable(self):
+        error = self.OperationalError("SELECT 1", dict(), Exception("connection refused"))
+        with mock.patch.object(self.health.get_engine(), "connect", side_effect=error), \
+                self.assertLogs("receep", "WARNING"):
+            response = self.client.get("/health/ready")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), dict(status="unavailable", reason="database"))
+
+
+if __name__ == "__main__":
+    unittest.main()
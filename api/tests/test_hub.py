@@ -0,0 +1,95 @@
+import asyncio
+import json
+import threading
+import unittest
+
+from starlette.websockets import WebSocketDisconnect
+
+from api import hub
+from api.hub import CLOSE_TRY_AGAIN_LATER, Hub
+
+
+class FakeWebSocket:
+    def __init__(self, stalled: bool = False):
+        self.sent = []
+        self.close_code = None
+        self.disconnected = asyncio.Event()
+        self.stalled = stalled
+
+    async def send_text(self, text: str) -> None:
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.sent.append(json.loads(text))
+
+    async def receive_text(self) -> str:
+        await self.disconnected.wait()
+        raise WebSocketDisconnect()
+
+    async def close(self, code: int) -> None:
+        self.close_code = code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class HubTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.hub = Hub()
+
+    def connect(self, websocket: FakeWebSocket, user_id: int) -> asyncio.Task:
+        return asyncio.create_task(self.hub.serve(websocket, user_id))
+
+    async def test_messages_reach_only_the_users_connections(self):
+        phone, laptop, other = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        tasks = [self.connect(phone, 1), self.connect(laptop, 1), self.connect(other, 2)]
+        await settle()
+
+        self.hub.publish(1, dict(topic="changes", payload=dict(version=3)))
+        await settle()
+
+        self.assertEqual(phone.sent, [dict(topic="changes", payload=dict(version=3))])
+        self.assertEqual(laptop.sent, phone.sent)
+        self.assertEqual(other.sent, [])
+
+        for websocket in (phone, laptop, other):
+            websocket.disconnected.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(self.hub._channels, dict())
+
+    async def test_publish_is_thread_safe(self):
+        websocket = FakeWebSocket()
+        task = self.connect(websocket, 1)
+        await settle()
+
+        thread = threading.Thread(target=self.hub.publish, args=(1, dict(topic="changes")))
+        thread.start()
+        thread.join()
+        await settle()
+
+        self.assertEqual(websocket.sent, [dict(topic="changes")])
+        websocket.disconnected.set()
+        await task
+
+    async def test_slow_consumers_are_dropped(self):
+        slow, fast = FakeWebSocket(stalled=True), FakeWebSocket()
+        slow_task, fast_task = self.connect(slow, 1), self.connect(fast, 1)
+        await settle()
+
+        # The first message is stuck in send_text, the rest fill the queue.
+        for version in range(hub.SEND_QUEUE_SIZE + 2):
+            self.hub.publish(1, dict(topic="changes", payload=dict(version=version)))
+            await settle()
+
+        await slow_task
+        self.assertEqual(slow.close_code, CLOSE_TRY_AGAIN_LATER)
+        self.assertEqual(len(fast.sent), hub.SEND_QUEUE_SIZE + 2)
+        self.assertEqual(list(self.hub._channels[1])[0].websocket, fast)
+
+        fast.disconnected.set()
+        await fast_task
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from api.access.jwt_check import JwtCheckMiddleware, TokenCache
+
+KEY = "test"
+ALG = "HS256"
+
+
+def make_token(expires_in: timedelta = timedelta(minutes=15), **claims) -> str:
+    claims.update(exp=datetime.now(timezone.utc) + expires_in)
+    token = jwt.encode(claims, KEY, algorithm=ALG)
+    # PyJWT < 2 returns bytes.
+    return token.decode() if isinstance(token, bytes) else token
+
+
+def cookie(token: str) -> dict:
+    return dict(cookie=f"jwt={token}")
+
+
+class TokenCacheTests(unittest.TestCase):
+    def test_claims_are_decoded_once(self):
+        tokens = TokenCache(KEY, ALG)
+        token = make_token(sub="a", uid=1)
+
+        self.assertEqual(tokens.get(token)["uid"], 1)
+        with mock.patch("jwt.decode") as decode:
+            self.assertEqual(tokens.get(token)["uid"], 1)
+        decode.assert_not_called()
+        self.assertEqual((tokens.hits, tokens.misses), (1, 1))
+
+    def test_invalid_and_expired_tokens_are_rejected(self):
+        tokens = TokenCache(KEY, ALG)
+        self.assertIsNone(tokens.get("not a token"))
+        self.assertIsNone(tokens.get(jwt.encode(dict(uid=1, exp=time.time() + 60), "other key", algorithm=ALG)))
+        self.assertIsNone(tokens.get(make_token(timedelta(seconds=-1), uid=1)))
+        self.assertIsNone(tokens.get(jwt.encode(dict(uid=1), KEY, algorithm=ALG)))
+
+    def test_cached_tokens_expire(self):
+        tokens = TokenCache(KEY, ALG)
+        token = make_token(timedelta(seconds=-1), uid=1)
+        tokens._claims[token] = dict(uid=1, exp=time.time() - 1)
+
+        self.assertIsNone(tokens.get(token))
+        self.assertNotIn(token, tokens._claims)
+
+    def test_least_recently_used_tokens_are_evicted(self):
+        tokens = TokenCache(KEY, ALG, maxsize=2)
+        first, second, third = (make_token(uid=uid) for uid in range(3))
+        for token in (first, second, first, third):
+            tokens.get(token)
+
+        self.assertEqual(list(tokens._claims), [first, third])
+
+
+class JwtCheckMiddlewareTests(unittest.TestCase):
+    def setUp(self):
+        def fallback(request):
+            return PlainTextResponse("route", status_code=204, headers={"X-User-Id": "legacy"})
+
+        app = Starlette(routes=[Route("/jwt/check", fallback), Route("/other", lambda r: PlainTextResponse("other"))])
+        app.add_middleware(JwtCheckMiddleware, tokens=TokenCache(KEY, ALG))
+        self.client = TestClient(app)
+
+    def test_valid_token(self):
+        response = self.client.get("/jwt/check", headers=cookie(make_token(sub="a", uid=7)))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.headers["x-user-id"], "7")
+        self.assertEqual(response.headers["x-accel-expires"], "30")
+        self.assertEqual(response.headers["cache-control"], "private, no-store")
+
+    def test_nginx_cache_does_not_outlive_the_token(self):
+        response = self.client.get("/jwt/check", headers=cookie(make_token(timedelta(seconds=10), uid=7)))
+        self.assertLessEqual(int(response.headers["x-accel-expires"]), 10)
+
+    def test_missing_or_invalid_token(self):
+        self.assertEqual(self.client.get("/jwt/check").status_code, 401)
+        response = self.client.get("/jwt/check", headers=cookie("nope"))
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn("x-accel-expires", response.headers)
+
+    def test_tokens_without_uid_use_the_route(self):
+        response = self.client.get("/jwt/check", headers=cookie(make_token(sub="a")))
+        self.assertEqual(response.headers["x-user-id"], "legacy")
+
+    def test_other_paths_pass_through(self):
+        self.assertEqual(self.client.get("/other").text, "other")
+
+
+if __name__ == "__main__":
+    unittest.main()
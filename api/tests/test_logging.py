@@ -0,0 +1,110 @@
+import io
+import json
+import logging
+import os
+import queue
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import logging as receep_logging
+
+
+def make_record(msg, *args, level=logging.INFO, exc_info=None, **extra):
+    record = logging.LogRecord("receep", level, "upload.py", 12, msg, args, exc_info, func="upload")
+    record.__dict__.update(extra)
+    return record
+
+
+class FormatterTests(unittest.TestCase):
+    def test_json_includes_extra_fields_and_the_traceback(self):
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            exc_info = sys.exc_info()
+
+        line = receep_logging.JsonFormatter().format(
+            make_record("Upload failed. %s", "a.jpg", level=logging.ERROR, exc_info=exc_info, status=500))
+        entry = json.loads(line)
+
+        self.assertEqual(entry["message"], "Upload failed. a.jpg")
+        self.assertEqual((entry["level"], entry["logger"], entry["location"]), ("ERROR", "receep", "upload.py:12"))
+        self.assertEqual(entry["status"], 500)
+        self.assertIn("ValueError: bad", entry["exception"])
+        self.assertNotIn("args", entry)
+
+    def test_sampling_keeps_warnings(self):
+        sample = receep_logging.SampleFilter(0)
+        self.assertFalse(sample.filter(make_record("request")))
+        self.assertTrue(sample.filter(make_record("slow", level=logging.WARNING)))
+
+
+class QueueHandlerTests(unittest.TestCase):
+    def test_message_is_resolved_when_queued(self):
+        records = queue.Queue()
+        values = ["before"]
+        receep_logging.DroppingQueueHandler(records).handle(make_record("%s", values))
+        values.append("after")
+
+        record = records.get_nowait()
+        self.assertEqual((record.msg, record.args), ("['before']", None))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = receep_logging.DroppingQueueHandler(queue.Queue(1))
+        dropped = receep_logging.LOG_RECORDS_DROPPED.value()
+
+        handler.handle(make_record("first"))
+        handler.handle(make_record("second"))
+
+        self.assertEqual(receep_logging.LOG_RECORDS_DROPPED.value(), dropped + 1)
+
+
+class SharedRotatingFileHandlerTests(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "app.log")
+
+    def make_handler(self):
+        handler = receep_logging.SharedRotatingFileHandler(self.path, maxBytes=100, backupCount=2)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_other_processes_follow_a_rollover(self):
+        first, second = self.make_handler(), self.make_handler()
+
+        for i in range(5):
+            first.handle(make_record(f"first {i} " + "x" * 30))
+        second.handle(make_record("second"))
+
+        with open(self.path) as current:
+            self.assertIn("second", current.read())
+        with open(f"{self.path}.1") as rotated:
+            self.assertNotIn("second", rotated.read())
+
+
+class ConfigureLoggingTests(unittest.TestCase):
+    def test_records_are_written_by_the_listener(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        with mock.patch.object(receep_logging, "LOG_DIR", temp_dir.name), \
+                mock.patch("sys.stderr", io.StringIO()):
+            receep_logging.configure_logging()
+            receep_logging.configure_logging()
+            logging.getLogger("receep.requests").info("route=/me status=200")
+            logging.getLogger("uvicorn.error").error("Exception in ASGI application")
+            receep_logging.shutdown_logging()
+
+        with open(os.path.join(temp_dir.name, "app.log")) as app_log:
+            self.assertEqual(app_log.read().count("route=/me status=200"), 1)
+        with open(os.path.join(temp_dir.name, "uvicorn.log")) as uvicorn_log:
+            self.assertIn("Exception in ASGI application", uvicorn_log.read())
+        self.assertFalse(any(isinstance(handler, receep_logging.DroppingQueueHandler)
+                             for handler in logging.getLogger("receep").handlers))
+
+
+if __name__ == "__main__":
+    unittest.main()
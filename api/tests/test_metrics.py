@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import metrics
+from utils.metrics import Counter, Gauge, Histogram, Registry
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_with_labels(self):
+        counter = Counter("uploads_total", "Uploads.", ["content_type"], registry=self.registry)
+        counter.inc(content_type="image/png")
+        counter.inc(2, content_type="image/png")
+        counter.inc(content_type="application/pdf")
+
+        self.assertEqual(counter.value(content_type="image/png"), 3)
+        self.assertEqual(self.registry.expose(), "\n".join([
+            "# HELP uploads_total Uploads.",
+            "# TYPE uploads_total counter",
+            'uploads_total{content_type="image/png"} 3',
+            'uploads_total{content_type="application/pdf"} 1',
+        ]) + "\n")
+
+    def test_labels_must_match(self):
+        counter = Counter("uploads_total", "Uploads.", ["content_type"], registry=self.registry)
+        with self.assertRaises(ValueError):
+            counter.inc()
+        with self.assertRaises(ValueError):
+            counter.inc(content_type="image/png", status="200")
+
+    def test_names_are_unique(self):
+        Gauge("in_progress", "In progress.", registry=self.registry)
+        with self.assertRaises(ValueError):
+            Counter("in_progress", "In progress.", registry=self.registry)
+
+        # The same metric again, as when a module is loaded twice.
+        replacement = Gauge("in_progress", "In progress.", registry=self.registry)
+        replacement.set(3)
+        self.assertIn("in_progress 3\n", self.registry.expose())
+
+    def test_gauge_function_is_read_on_every_scrape(self):
+        values = [1]
+        Gauge("queue_depth", "Queue depth.", function=lambda: values[-1], registry=self.registry)
+
+        self.assertIn("queue_depth 1\n", self.registry.expose())
+        values.append(2.5)
+        self.assertIn("queue_depth 2.5\n", self.registry.expose())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("duration_seconds", "Duration.", ["route"], buckets=(0.1, 1),
+                              registry=self.registry)
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value, route="/items")
+
+        lines = self.registry.expose().splitlines()
+        self.assertEqual(lines[2:], [
+            'duration_seconds_bucket{route="/items",le="0.1"} 1',
+            'duration_seconds_bucket{route="/items",le="1"} 3',
+            'duration_seconds_bucket{route="/items",le="+Inf"} 4',
+            'duration_seconds_sum{route="/items"} 4.05',
+            'duration_seconds_count{route="/items"} 4',
+        ])
+
+    def test_label_values_are_escaped(self):
+        counter = Counter("requests_total", 'Requests with "quotes".', ["route"], registry=self.registry)
+        counter.inc(route='a"b\\c\nd')
+
+        exposed = self.registry.expose()
+        self.assertIn('# HELP requests_total Requests with "quotes".', exposed)
+        self.assertIn('requests_total{route="a\\"b\\\\c\\nd"} 1', exposed)
+
+
+class SharedDirectoryTests(unittest.TestCase):
+    """
+    Two registries on one directory stand in for two gunicorn workers.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # pid -> registry
+        self.workers = dict()
+        self.start_worker(101, uploads=2, in_progress=1)
+        self.start_worker(102, uploads=3, in_progress=4)
+
+    def start_worker(self, pid: int, uploads: int, in_progress: int) -> None:
+        registry = self.workers[pid] = Registry(self.directory)
+        Counter("uploads_total", "Uploads.", ["content_type"], registry=registry).inc(uploads, content_type="image/png")
+        Gauge("in_progress", "In progress.", registry=registry).set(in_progress)
+        histogram = Histogram("duration_seconds", "Duration.", buckets=(1,), registry=registry)
+        for _ in range(uploads):
+            histogram.observe(0.5)
+
+    def write(self, pid: int) -> None:
+        with mock.patch.object(metrics.os, "getpid", return_value=pid):
+            self.workers[pid].write()
+
+    def expose(self, pid: int) -> str:
+        with mock.patch.object(metrics.os, "getpid", return_value=pid):
+            return self.workers[pid].expose()
+
+    def test_any_worker_answers_with_the_sum(self):
+        self.write(101)
+
+        exposed = self.expose(102)
+
+        self.assertIn('uploads_total{content_type="image/png"} 5\n', exposed)
+        self.assertIn("in_progress 5\n", exposed)
+        self.assertIn('duration_seconds_bucket{le="1"} 5\n', exposed)
+        self.assertIn("duration_seconds_sum 2.5\n", exposed)
+        self.assertEqual(exposed.count("# TYPE uploads_total counter"), 1)
+
+    def test_exited_worker_keeps_its_counters_but_not_its_gauges(self):
+        self.write(101)
+        self.workers[102].archive_process(101)
+
+        exposed = self.expose(102)
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "101.json")))
+        self.assertIn('uploads_total{content_type="image/png"} 5\n', exposed)
+        self.assertIn("duration_seconds_count 5\n", exposed)
+        self.assertIn("in_progress 4\n", exposed)
+
+        # A recycled worker adds to the archive.
+        self.start_worker(103, uploads=1, in_progress=0)
+        self.write(103)
+        self.workers[102].archive_process(103)
+        self.assertIn('uploads_total{content_type="image/png"} 6\n', self.expose(102))
+
+
+if __name__ == "__main__":
+    unittest.main()
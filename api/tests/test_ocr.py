@@ -0,0 +1,268 @@
+import os
+import threading
+import time
+import types
+import unittest
+from datetime import date
+from unittest import mock
+
+from logic import ocr
+from tests.db import DatabaseTestCase
+
+TSV_HEADER = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+TSV = "\n".join([
+    TSV_HEADER,
+    "1\t1\t0\t0\t0\t0\t0\t0\t1000\t2000\t-1\t",
+    "5\t1\t1\t1\t1\t1\t100\t50\t200\t40\t96.5\tCorner",
+    "5\t1\t1\t1\t1\t2\t320\t52\t180\t40\t93.5\tStore",
+    "5\t1\t1\t1\t2\t1\t100\t400\t150\t30\t-1\t ",
+    "5\t1\t2\t1\t1\t1\t100\t1500\t120\t30\t91\tTOTAL",
+    "5\t1\t2\t1\t1\t2\t700\t1500\t100\t30\t89\t12.50",
+])
+
+XHTML = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title></title></head><body><doc>
+  <page width="612.000000" height="792.000000">
+    <flow><block xMin="61.2" yMin="79.2" xMax="306" yMax="118.8">
+      <line xMin="61.2" yMin="79.2" xMax="306" yMax="99">
+        <word xMin="61.2" yMin="79.2" xMax="150" yMax="99">Invoice</word>
+        <word xMin="160" yMin="79.2" xMax="306" yMax="99">2024-03-01</word>
+      </line>
+      <line xMin="61.2" yMin="700" xMax="306" yMax="720">
+        <word xMin="61.2" yMin="700" xMax="306" yMax="720"> </word>
+      </line>
+    </block></flow>
+  </page>
+</doc></body></html>"""
+
+
+def line(text: str, page: int = 0) -> dict:
+    return dict(page=page, text=text, box=[0.1, 0.1, 0.9, 0.12], confidence=90.0)
+
+
+class ParserTests(unittest.TestCase):
+    def test_tesseract_words_are_grouped_into_lines(self):
+        lines = ocr.parse_tesseract_tsv(TSV, width=1000, height=2000)
+
+        self.assertEqual([entry["text"] for entry in lines], ["Corner Store", "TOTAL 12.50"])
+        self.assertEqual(lines[0]["box"], [0.1, 0.025, 0.5, 0.046])
+        self.assertEqual(lines[0]["confidence"], 95.0)
+
+    def test_pdftotext_lines_have_relative_boxes(self):
+        lines = ocr.parse_pdftotext_bbox(XHTML)
+
+        self.assertEqual(lines, [dict(page=0, text="Invoice 2024-03-01", box=[0.1, 0.1, 0.5, 0.125],
+                                      confidence=None)])
+
+
+class GuessTests(unittest.TestCase):
+    def test_amounts(self):
+        cases = [
+            ("TOTAL 12.50", [12.5]),
+            ("1,234.56 and 1.234,56", [1234.56, 1234.56]),
+            ("Qty 2 x 3.99 = 7.98", [3.99, 7.98]),
+            ("Card ****1234 ref 20240301", []),
+            ("12.345", []),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(ocr.parse_amounts(text), expected)
+
+    def test_total(self):
+        cases = [
+            (["Milk 2.50", "Subtotal 10.00", "Tax 0.80", "TOTAL 10.80", "Cash 20.00", "Change 9.20"], 10.8),
+            (["Total 10.80", "Tip 2.00", "Amount due 12.80"], 12.8),
+            (["Bread 3.20", "Cheese 7.10"], 7.1),
+            (["Thank you"], None),
+        ]
+        for texts, expected in cases:
+            with self.subTest(texts=texts):
+                guess = ocr.guess_total([line(text) for text in texts])
+                self.assertEqual(guess and guess["value"], expected)
+
+    def test_date(self):
+        today = date(2024, 6, 1)
+        cases = [
+            ("2024-03-01 14:02", "2024-03-01"),
+            ("03/04/2024", "2024-03-04"),
+            ("25/03/24", "2024-03-25"),
+            ("Mar 5, 2024", "2024-03-05"),
+            ("5 March 2024", "2024-03-05"),
+            ("12/31/2030", None),
+            ("Tel 555-12-1234", None),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                guess = ocr.guess_date([line(text)], today)
+                self.assertEqual(guess and guess["value"], expected)
+
+        with mock.patch.object(ocr, "OCR_DATE_ORDER", "DMY"):
+            self.assertEqual(ocr.guess_date([line("03/04/2024")], today)["value"], "2024-04-03")
+
+    def test_vendor(self):
+        lines = [line("** 03/01/2024 **"), line("Corner Store #42"), line("12 Main St."), line("Coffee 3.50")]
+
+        self.assertEqual(ocr.guess_vendor(lines, ["Store", "CORNER STORE", "Bakery"]),
+                         dict(value="CORNER STORE", page=0, box=lines[1]["box"], known=True))
+        self.assertEqual(ocr.guess_vendor(lines),
+                         dict(value="Corner Store #42", page=0, box=lines[1]["box"], known=False))
+        self.assertIsNone(ocr.guess_vendor([line("03/01/2024"), line("12.50")]))
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.receipt = types.SimpleNamespace(id=7, user_id=1, content_type="image/jpeg", rotation=90)
+        self.saved = []
+
+    def get_receipt(self, receipt_id):
+        return self.receipt
+
+    def get_vendors_with_usage(self, user_id):
+        return [types.SimpleNamespace(name="Corner Store")]
+
+    def save_receipt_ocr(self, receipt_id, rotation, ocr_metadata, text=None, lines=None):
+        self.saved.append((receipt_id, rotation, ocr_metadata, text, lines))
+        return True
+
+
+class RecognizeReceiptTests(unittest.TestCase):
+    def test_result_is_stored(self):
+        db = FakeDatabase()
+        lines = [line("Corner Store"), line("2024-03-01"), line("TOTAL 12.50")]
+
+        with mock.patch.object(ocr, "read_lines", return_value=("tesseract", 90, lines)) as read_lines:
+            self.assertEqual(ocr.recognize_receipt(db, 7), "done")
+
+        read_lines.assert_called_once_with("image/jpeg", os.path.join(ocr.receep.RECEIPT_DIR, "7.dr"), 90)
+        [(receipt_id, rotation, metadata, text, saved_lines)] = db.saved
+        self.assertEqual((receipt_id, rotation, saved_lines), (7, 90, lines))
+        self.assertEqual(text, "Corner Store\n2024-03-01\nTOTAL 12.50")
+        self.assertEqual((metadata["status"], metadata["engine"], metadata["rotation"]), ("done", "tesseract", 90))
+        self.assertEqual(metadata["total"]["value"], 12.5)
+        self.assertEqual(metadata["date"]["value"], "2024-03-01")
+        self.assertEqual((metadata["vendor"]["value"], metadata["vendor"]["known"]), ("Corner Store", True))
+
+    def test_missing_engine_leaves_the_receipt_untouched(self):
+        db = FakeDatabase()
+
+        with mock.patch.object(ocr.shutil, "which", return_value=None), \
+                mock.patch.object(ocr, "render_pages", return_value=[ocr.Image.new("RGB", (10, 10))]), \
+                self.assertLogs("receep", "WARNING"):
+            self.assertEqual(ocr.recognize_receipt(db, 7), "unavailable")
+
+        self.assertEqual(db.saved, [])
+
+    def test_failure_is_recorded(self):
+        db = FakeDatabase()
+
+        with mock.patch.object(ocr, "read_lines", side_effect=OSError("truncated")), self.assertLogs("receep"):
+            self.assertEqual(ocr.recognize_receipt(db, 7), "failed")
+
+        self.assertEqual(db.saved, [(7, 90, dict(status="failed", version=ocr.VERSION, error="OSError"), None, None)])
+
+
+class OcrPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.recognized = []
+
+        def recognize(db, receipt_id):
+            self.release.wait(5)
+            self.recognized.append(receipt_id)
+
+        patcher = mock.patch.object(ocr, "recognize_receipt", recognize)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_receipts_beyond_the_queue_limit_are_skipped(self):
+        pool = ocr.OcrPool(db=None, workers=1, queue_limit=2)
+        with self.assertLogs("receep", "WARNING"):
+            accepted = [pool.submit(receipt_id) for receipt_id in range(4)]
+        self.assertEqual((pool.active, pool.queue_depth, pool.skipped), (1, 2, 1))
+
+        self.release.set()
+        while pool.active:
+            time.sleep(0.01)
+        pool.shutdown()
+
+        self.assertEqual(accepted, [True, True, True, False])
+        self.assertEqual(self.recognized, [0, 1, 2])
+
+    def test_shutdown_drops_the_queued_receipts(self):
+        pool = ocr.OcrPool(db=None, workers=1, queue_limit=2)
+        for receipt_id in range(3):
+            pool.submit(receipt_id)
+        while not pool.active:
+            time.sleep(0.01)
+
+        threading.Timer(0.05, self.release.set).start()
+        pool.shutdown()
+
+        self.assertEqual(self.recognized, [0])
+        self.assertEqual((pool.active, pool.queue_depth), (0, 0))
+
+    def test_disabled_pool_accepts_nothing(self):
+        self.assertFalse(ocr.OcrPool(db=None, workers=0).submit(1))
+
+
+class OcrStorageTests(DatabaseTestCase):
+    username = "ocr"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from persistence.exceptions import NotFound
+
+        cls.NotFound = NotFound
+
+    def create_receipt(self, content_hash: str):
+        return self.db.create_receipt(self.user.id, "image/jpeg", 1024, content_hash)
+
+    def test_results_are_stored_and_searchable(self):
+        receipt = self.create_receipt("stored")
+        other = self.create_receipt("other")
+        lines = [line("Corner Store"), line("Espresso 3.50")]
+        self.assertIn(receipt.id, self.db.get_receipt_ids_for_ocr())
+
+        self.assertTrue(self.db.save_receipt_ocr(receipt.id, 0, dict(status="done"), "Corner Store\nEspresso 3.50",
+                                                 lines))
+
+        self.assertEqual([r.id for r in self.db.search_receipts(self.user.id, "espresso store")], [receipt.id])
+        self.assertEqual(self.db.search_receipts(self.user.id, "latte"), [])
+        self.assertEqual(self.db.get_receipt_text(receipt.id, self.user.id).lines, lines)
+        self.assertEqual(self.db.get_receipt(receipt.id).ocr_metadata, dict(status="done"))
+        self.assertNotIn(receipt.id, self.db.get_receipt_ids_for_ocr())
+        self.assertIn(other.id, self.db.get_receipt_ids_for_ocr())
+        with self.assertRaises(self.NotFound):
+            self.db.get_receipt_text(other.id, self.user.id)
+
+    def test_other_users_cannot_read_or_find_the_text(self):
+        receipt = self.create_receipt("private")
+        self.db.save_receipt_ocr(receipt.id, 0, dict(status="done"), "Pharmacy\nPrescription 20.00", [])
+        self.db.create_user("ocr-other")
+        other_user = self.db.get_user_by_username("ocr-other")
+
+        self.assertEqual(self.db.search_receipts(other_user.id, "prescription"), [])
+        with self.assertRaises(self.NotFound):
+            self.db.get_receipt_text(receipt.id, other_user.id)
+
+    def test_result_for_a_rotated_receipt_is_discarded(self):
+        receipt = self.create_receipt("rotated")
+        self.db.rotate_receipt(receipt.id, self.user.id, delta=90)
+
+        self.assertFalse(self.db.save_receipt_ocr(receipt.id, 0, dict(status="done"), "text", []))
+
+        self.assertFalse(self.db.get_receipt(receipt.id).ocr_metadata)
+        with self.assertRaises(self.NotFound):
+            self.db.get_receipt_text(receipt.id, self.user.id)
+
+    def test_failed_receipts_are_retried_on_request(self):
+        receipt = self.create_receipt("failed")
+        self.db.save_receipt_ocr(receipt.id, 0, dict(status="failed"))
+
+        self.assertNotIn(receipt.id, self.db.get_receipt_ids_for_ocr())
+        self.assertIn(receipt.id, self.db.get_receipt_ids_for_ocr(retry_failed=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
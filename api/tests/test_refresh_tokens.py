@@ -0,0 +1,94 @@
+"""
+Covers access/refresh token issuing, rotation and reuse detection.
+"""
+import os
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from sqlalchemy import text
+
+from tests.db import DatabaseTestCase, count_statements
+
+
+class RefreshTokenTests(DatabaseTestCase):
+    username = "tokens"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.enterClassContext(mock.patch.dict(os.environ, JWT_KEY=os.getenv("JWT_KEY", "test")))
+        super().setUpClass()
+        from api.access import authenticator
+        from api.access.exceptions import InvalidCredsException
+
+        cls.auth = authenticator.Authenticator(cls.db)
+        cls.InvalidCredsException = InvalidCredsException
+
+    def test_access_token_is_checked_without_the_database(self):
+        token = self.auth.issue_tokens(self.user)["token"]
+
+        with count_statements(self.engine) as statements:
+            metadata = self.auth.get_auth_metadata(token)
+
+        self.assertEqual(statements, [])
+        self.assertTrue(metadata.authenticated)
+        self.assertEqual(metadata.user_id, self.user.id)
+        self.assertEqual(metadata.username, "tokens")
+        self.assertEqual(metadata.roles, ["admin"])
+
+    def test_refresh_rotates_the_token(self):
+        issued = self.auth.issue_tokens(self.user)
+        refreshed = self.auth.refresh(issued["refresh_token"])
+
+        self.assertNotEqual(refreshed["refresh_token"], issued["refresh_token"])
+        self.assertEqual(self.auth.get_auth_metadata(refreshed["token"]).user_id, self.user.id)
+        # The new token works once more.
+        self.auth.refresh(refreshed["refresh_token"])
+
+    def test_unknown_token_is_rejected(self):
+        with self.assertRaises(self.InvalidCredsException):
+            self.auth.refresh("unknown")
+
+    def test_reuse_within_the_grace_period_only_fails(self):
+        issued = self.auth.issue_tokens(self.user)
+        refreshed = self.auth.refresh(issued["refresh_token"])
+
+        with self.assertRaises(self.InvalidCredsException):
+            self.auth.refresh(issued["refresh_token"])
+        self.auth.refresh(refreshed["refresh_token"])
+
+    def test_reuse_after_the_grace_period_revokes_every_token(self):
+        issued = self.auth.issue_tokens(self.user)
+        refreshed = self.auth.refresh(issued["refresh_token"])
+        other_session = self.auth.issue_tokens(self.user)
+
+        # Pretend the first token was used a while ago.
+        with self.engine.begin() as conn:
+            conn.execute(text("UPDATE refresh_tokens SET revoked_at = revoked_at - interval '1 hour' "
+                              "WHERE revoked_at IS NOT NULL"))
+
+        with self.assertRaises(self.InvalidCredsException):
+            self.auth.refresh(issued["refresh_token"])
+        for token in (refreshed, other_session):
+            with self.assertRaises(self.InvalidCredsException):
+                self.auth.refresh(token["refresh_token"])
+
+    def test_expired_token_is_rejected(self):
+        issued = self.auth.issue_tokens(self.user)
+        with self.engine.begin() as conn:
+            conn.execute(text("UPDATE refresh_tokens SET expires_at = now() - :delta"),
+                         dict(delta=timedelta(minutes=1)))
+
+        with self.assertRaises(self.InvalidCredsException):
+            self.auth.refresh(issued["refresh_token"])
+
+    def test_revoked_token_is_rejected(self):
+        issued = self.auth.issue_tokens(self.user)
+        self.auth.revoke(issued["refresh_token"])
+
+        with self.assertRaises(self.InvalidCredsException):
+            self.auth.refresh(issued["refresh_token"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import orjson
+
+from api.report_arrays import line_item_arrays
+
+
+def expected_row(timestamp: datetime, tz: float) -> dict:
+    local = timestamp + timedelta(hours=tz)
+    return dict(year=local.year, month=local.month, day=local.day, day_of_week=local.strftime("%A"))
+
+
+class LineItemArraysTests(unittest.TestCase):
+    TIMESTAMPS = [
+        datetime(2024, 2, 29, 23, 30),
+        datetime(2024, 3, 1, 0, 15),
+        datetime(2023, 12, 31, 22, 0),
+        datetime(2025, 1, 1, 3, 0),
+        datetime(1969, 12, 31, 23, 59, 59),
+        datetime(2024, 7, 14, 12, 0),
+    ]
+
+    def columns(self) -> dict:
+        count = len(self.TIMESTAMPS)
+        return dict(
+            amount=tuple(float(i) + 0.25 for i in range(count)),
+            category_id=tuple(range(count)),
+            tx_id=tuple(range(100, 100 + count)),
+            vendor_id=tuple(i if i % 2 else None for i in range(count)),
+            epoch=tuple(int(t.replace(tzinfo=timezone.utc).timestamp()) for t in self.TIMESTAMPS),
+        )
+
+    def test_dates_match_the_row_by_row_computation(self):
+        for tz in (0, -7, 5.5, 9, -12, 14):
+            with self.subTest(tz=tz):
+                arrays = line_item_arrays(self.columns(), tz)
+                for i, timestamp in enumerate(self.TIMESTAMPS):
+                    actual = {key: arrays[key][i] for key in ("year", "month", "day", "day_of_week")}
+                    self.assertEqual(actual, expected_row(timestamp, tz))
+
+    def test_serializes_in_one_shot(self):
+        serialized = orjson.loads(orjson.dumps(line_item_arrays(self.columns()), option=orjson.OPT_SERIALIZE_NUMPY))
+
+        self.assertEqual(serialized["amount"], [0.25, 1.25, 2.25, 3.25, 4.25, 5.25])
+        self.assertEqual(serialized["vendor_id"], [None, 1, None, 3, None, 5])
+        self.assertEqual(serialized["tx_id"], list(range(100, 106)))
+        self.assertEqual(serialized["year"][0], 2024)
+
+    def test_no_rows(self):
+        columns = dict(amount=(), category_id=(), tx_id=(), vendor_id=(), epoch=())
+        arrays = line_item_arrays(columns, -7)
+        self.assertTrue(all(len(values) == 0 for values in arrays.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
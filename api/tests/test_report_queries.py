@@ -0,0 +1,81 @@
+"""
+Covers the timezone conversion and date bucketing done by the report queries.
+"""
+import unittest
+from datetime import datetime
+
+from sqlalchemy import text
+
+from tests.db import DatabaseTestCase
+
+# Stored timestamps are naive UTC. Vancouver is UTC-8 in winter and UTC-7 from 2024-03-10.
+TIMESTAMPS = [
+    datetime(2024, 2, 1, 7, 30),    # 2024-01-31 23:30 local, a Wednesday
+    datetime(2024, 3, 10, 10, 0),   # 2024-03-10 03:00 local, right after the DST switch
+    datetime(2024, 4, 1, 6, 59, 59, 600000),  # 2024-03-31 23:59:59.6 local
+    datetime(2025, 1, 1, 7, 0),     # 2024-12-31 23:00 local, outside of 2025 UTC ranges below
+]
+TZ_NAME = "America/Vancouver"
+
+
+class ReportQueryTests(DatabaseTestCase):
+    username = "reports"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from api.report_arrays import line_item_arrays
+
+        cls.line_item_arrays = staticmethod(line_item_arrays)
+        cls.user_id = cls.user.id
+        category_id = cls.db.create_category(cls.user_id, "Groceries", "", True).id
+        for i, timestamp in enumerate(TIMESTAMPS):
+            cls.db.create_transaction(cls.user_id, [
+                dict(name="item", amount_input=str(i + 1), amount=float(i + 1), notes=None, category_id=category_id)
+            ], timestamp=timestamp)
+
+        cls.start, cls.end = datetime(2024, 1, 1), datetime(2024, 12, 31, 23, 59, 59)
+
+    def test_line_items_carry_local_timestamps(self):
+        rows = self.db.get_line_items(self.user_id, self.start, self.end, offset=0, limit=10, tz_name=TZ_NAME)
+
+        self.assertEqual([row.timestamp for row in rows], [
+            datetime(2024, 1, 31, 23, 30),
+            datetime(2024, 3, 10, 3, 0),
+            datetime(2024, 3, 31, 23, 59, 59, 600000),
+        ])
+
+    def test_line_item_columns_bucket_by_local_date(self):
+        columns = self.db.get_line_item_columns(self.user_id, self.start, self.end, tz_name=TZ_NAME)
+        arrays = self.line_item_arrays(columns)
+
+        self.assertEqual(arrays["month"].tolist(), [1, 3, 3])
+        self.assertEqual(arrays["day"].tolist(), [31, 10, 31])
+        self.assertEqual(arrays["day_of_week"], ["Wednesday", "Sunday", "Sunday"])
+
+    def test_monthly_expenses(self):
+        rows = self.db.get_monthly_expenses(self.user_id, self.start, self.end, tz_name=TZ_NAME)
+
+        self.assertEqual([(row.year, row.month, row.amount) for row in rows], [(2024, 1, 1.0), (2024, 3, 5.0)])
+
+    def test_utc_is_the_default(self):
+        rows = self.db.get_monthly_expenses(self.user_id, self.start, self.end)
+        self.assertEqual([(row.month, row.amount) for row in rows], [(2, 1.0), (3, 2.0), (4, 3.0)])
+
+    def test_timezone_names(self):
+        names = self.db.get_timezone_names()
+        self.assertIn(TZ_NAME, names)
+        self.assertNotIn("Mars/Olympus_Mons", names)
+
+    def test_date_ranges_use_the_index(self):
+        with self.engine.begin() as conn:
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            plan = "\n".join(conn.execute(text(
+                "EXPLAIN SELECT id FROM transactions WHERE user_id = :user_id AND timestamp >= :start "
+                "AND timestamp <= :end"), dict(user_id=self.user_id, start=self.start, end=self.end)).scalars())
+
+        self.assertIn("ix_transactions_user_id_timestamp", plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
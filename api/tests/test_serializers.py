@@ -0,0 +1,45 @@
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from api.serializers import RECEIPT, TRANSACTION, TRANSACTION_WITH_LINE_ITEMS, VENDOR
+from persistence.schema import LineItem, Receipt, Transaction, Vendor
+
+
+class ModelSerializerTests(unittest.TestCase):
+    def test_only_columns_are_emitted(self):
+        vendor = Vendor(id=3, user_id=1, name="Grocer", updated_at=None)
+
+        self.assertEqual(VENDOR.to_dict(vendor), dict(id=3, user_id=1, name="Grocer", updated_at=None))
+
+    def test_datetimes_are_converted_to_timestamps(self):
+        # Stored as naive UTC, whatever the server's timezone.
+        timestamp = datetime(2024, 1, 2, 3, 4, 5)
+        transaction = Transaction(id=1, user_id=1, vendor_id=None, receipt_id=None, amount=1.5, timestamp=timestamp)
+
+        self.assertEqual(TRANSACTION.to_dict(transaction)["timestamp"],
+                         timestamp.replace(tzinfo=timezone.utc).timestamp())
+        self.assertNotIn("line_items", TRANSACTION.to_dict(transaction))
+
+    def test_nested_collections_are_serialized(self):
+        transaction = Transaction(id=1, user_id=1, amount=2.0, timestamp=None)
+        transaction.line_items = [
+            LineItem(id=5, name="Milk", transaction_id=1, amount_input="2", amount=2.0, notes=None, category_id=7)
+        ]
+        receipt = Receipt(id=9, user_id=1, content_type="image/png", content_length=10,
+                          content_hash="abc", rotation=0, ocr_metadata={}, created_at=None)
+        receipt.transactions = [transaction]
+
+        serialized = TRANSACTION_WITH_LINE_ITEMS.to_dict(transaction)
+        self.assertEqual(serialized["line_items"][0]["name"], "Milk")
+        self.assertEqual(RECEIPT.to_dict(receipt)["transactions"], [TRANSACTION.to_dict(transaction)])
+
+    def test_rows_with_matching_attributes_are_supported(self):
+        row = SimpleNamespace(id=3, user_id=1, name="Grocer", updated_at=None)
+
+        self.assertEqual(VENDOR.many([row]), [dict(id=3, user_id=1, name="Grocer", updated_at=None)])
+        self.assertIsNone(VENDOR.one(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
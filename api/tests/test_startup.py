@@ -0,0 +1,52 @@
+"""
+Covers building the app without I/O, and the one-shot migrations.
+"""
+import os
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+from tests.db import TEST_DATABASE_URL, requires_database
+
+API_ROOT = Path(__file__).resolve().parents[1]
+
+
+class CreateAppTests(unittest.TestCase):
+    def test_building_the_app_does_no_io(self):
+        # A fresh interpreter, since other tests may have created the engine already.
+        script = "\n".join([
+            "import main",
+            "from persistence import database",
+            "app = main.create_app()",
+            "assert database._engine is None, 'engine created'",
+            "assert any(route.path == '/login' for route in app.routes)",
+        ])
+        env = dict(os.environ, SIGNUP="CLOSED", DATABASE_URL="postgresql://postgres@unreachable.invalid/postgres",
+                   LOG_DIR="/nonexistent/receep")
+        result = subprocess.run([sys.executable, "-c", script], cwd=API_ROOT, env=env, capture_output=True,
+                                text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertFalse(os.path.exists("/nonexistent/receep"))
+
+
+@requires_database
+class MigrationTests(unittest.TestCase):
+    def test_migrations_create_the_schema_and_are_idempotent(self):
+        from sqlalchemy import create_engine, inspect
+
+        from persistence.migrations import migrate
+        from persistence.schema import Base
+
+        engine = create_engine(TEST_DATABASE_URL)
+        self.addCleanup(engine.dispose)
+        Base.metadata.drop_all(engine)
+
+        migrate(engine)
+        migrate(engine)
+
+        self.assertTrue(set(Base.metadata.tables) <= set(inspect(engine).get_table_names()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from api.suggestions import SuggestionIndex, name_key
+from tests.db import DatabaseTestCase
+
+Row = namedtuple("Row", "transaction_id vendor_id name category_id")
+
+GROCERIES, COFFEE, TAX, FUEL = 1, 2, 3, 4
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.version = 1
+        self.now = datetime(2024, 3, 1)
+        # transaction_id -> (updated_at, vendor_id, [(name, category_id)])
+        self.transactions = dict()
+        self.deleted = dict()
+        self.receipts = dict()
+        self.loads = []
+
+    def write(self, transaction_id, vendor_id, items):
+        self.now += timedelta(minutes=1)
+        self.transactions[transaction_id] = (self.now, vendor_id, items)
+        self.version += 1
+
+    def delete(self, transaction_id):
+        self.now += timedelta(minutes=1)
+        del self.transactions[transaction_id]
+        self.deleted[transaction_id] = self.now
+        self.version += 1
+
+    def load_changes(self, user_id, since=None):
+        self.loads.append(since)
+        rows = []
+        for transaction_id, (updated_at, vendor_id, items) in self.transactions.items():
+            if since is None or updated_at >= since:
+                rows += [Row(transaction_id, vendor_id, name, category_id) for name, category_id in items] \
+                    or [Row(transaction_id, vendor_id, None, None)]
+        deleted = [t for t, deleted_at in self.deleted.items() if since is not None and deleted_at >= since]
+        return SimpleNamespace(synced_at=self.now, rows=rows, deleted=deleted)
+
+    def get_version(self, user_id):
+        return self.version
+
+    def get_receipt_ocr(self, receipt_id, user_id):
+        return self.receipts.get(receipt_id)
+
+
+def category_ids(suggestions):
+    return [category["id"] for category in suggestions["categories"]]
+
+
+class NameKeyTests(unittest.TestCase):
+    def test_normalization(self):
+        self.assertEqual(name_key("Latte 2x (large)"), "latte large")
+        self.assertEqual(name_key("  CAFÉ-crème "), "café crème")
+        self.assertEqual(name_key("12.50"), "")
+        self.assertEqual(name_key(None), "")
+
+
+class SuggestionIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.db.write(1, 10, [("Milk", GROCERIES), ("Bread", GROCERIES), ("Tax", TAX)])
+        self.db.write(2, 10, [("Latte", COFFEE), ("Tax", TAX)])
+        self.db.write(3, 10, [("Apples", GROCERIES)])
+        self.db.write(4, 20, [("Latte", COFFEE)])
+        self.index = SuggestionIndex(self.db.load_changes, self.db.get_version, self.db.get_receipt_ocr)
+
+    def test_line_item_name_outweighs_the_vendor(self):
+        suggestions = self.index.suggest(user_id=1, vendor_id=10, name="latte")
+
+        self.assertEqual(category_ids(suggestions), [COFFEE, GROCERIES, TAX])
+        self.assertEqual(suggestions["categories"][0]["source"], "line_item")
+        self.assertEqual(suggestions["categories"][1]["source"], "vendor")
+        self.assertEqual(suggestions["categories"][1]["count"], 3)
+        self.assertIsNone(suggestions["vendor"])
+
+    def test_most_used_categories_without_evidence(self):
+        suggestions = self.index.suggest(user_id=1, vendor_id=99, name="unknown", limit=2)
+
+        self.assertEqual(category_ids(suggestions), [GROCERIES, COFFEE])
+        self.assertEqual({category["source"] for category in suggestions["categories"]}, {"overall"})
+
+    def test_writes_are_applied_incrementally(self):
+        self.index.suggest(user_id=1, vendor_id=20)
+
+        self.db.write(4, 20, [("Diesel", FUEL)])
+        self.db.write(5, 20, [("Diesel", FUEL), ("Latte", COFFEE)])
+        self.db.delete(2)
+        suggestions = self.index.suggest(user_id=1, vendor_id=20)
+
+        self.assertEqual(category_ids(suggestions), [FUEL, COFFEE])
+        self.assertEqual(suggestions["categories"][0]["count"], 2)
+        self.assertEqual(category_ids(self.index.suggest(user_id=1, name="tax")), [TAX])
+        self.assertEqual(self.index.suggest(user_id=1, name="tax")["categories"][0]["count"], 1)
+        # One full load, then only what changed since it, with the overlap.
+        self.assertIsNone(self.db.loads[0])
+        self.assertEqual(len(self.db.loads), 2)
+        self.assertIsNotNone(self.db.loads[1])
+
+    def test_removed_line_items_leave_no_counts(self):
+        self.db.write(4, 20, [])
+        self.db.delete(2)
+        stats = self.index._get_stats(1)
+
+        self.assertNotIn("latte", stats.by_name)
+        self.assertNotIn(20, stats.by_vendor)
+        self.assertNotIn(COFFEE, stats.overall)
+
+    def test_unchanged_version_does_not_reload(self):
+        self.index.suggest(user_id=1, vendor_id=10)
+        self.index.suggest(user_id=1, vendor_id=20)
+
+        self.assertEqual(self.db.loads, [None])
+
+    def test_receipt_ocr_names_the_vendor_and_matches_lines(self):
+        self.db.receipts[7] = SimpleNamespace(ocr_metadata=dict(status="done"), vendor_id=20,
+                                              text="CORNER CAFE\nLATTE 4.50\nTOTAL 4.50")
+
+        suggestions = self.index.suggest(user_id=1, receipt_id=7)
+
+        self.assertEqual(suggestions["vendor"], dict(id=20, source="ocr"))
+        self.assertEqual(category_ids(suggestions), [COFFEE])
+        self.assertEqual(suggestions["categories"][0]["source"], "ocr")
+
+        # A vendor picked by the user wins over the OCR guess.
+        suggestions = self.index.suggest(user_id=1, vendor_id=10, receipt_id=7)
+        self.assertIsNone(suggestions["vendor"])
+        self.assertEqual(category_ids(suggestions)[0], COFFEE)
+
+
+class SuggestionQueryTests(DatabaseTestCase):
+    username = "suggestions"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.vendor = cls.db.create_vendor(cls.user.id, "Corner Cafe")
+        cls.category = cls.db.create_category(cls.user.id, "Coffee", "", True)
+
+    def line_items(self, *names):
+        return [dict(name=name, amount_input="1", amount=1.0, notes=None, category_id=self.category.id)
+                for name in names]
+
+    def test_changes_since(self):
+        first = self.db.create_transaction(self.user.id, self.line_items("Latte"), datetime(2024, 3, 1),
+                                           vendor_id=self.vendor.id)
+        empty = self.db.create_transaction(self.user.id, [], datetime(2024, 3, 1))
+        full = self.db.get_line_item_categories(self.user.id)
+
+        second = self.db.create_transaction(self.user.id, self.line_items("Espresso", "Muffin"),
+                                            datetime(2024, 3, 2), vendor_id=self.vendor.id)
+        self.db.delete_transaction(self.user.id, first.id)
+        changes = self.db.get_line_item_categories(self.user.id, since=full.synced_at)
+
+        self.assertIn((first.id, self.vendor.id, "Latte", self.category.id), [tuple(row) for row in full.rows])
+        self.assertIn((empty.id, None, None, None), [tuple(row) for row in full.rows])
+        self.assertEqual(sorted(row.name for row in changes.rows), ["Espresso", "Muffin"])
+        self.assertEqual({row.transaction_id for row in changes.rows}, {second.id})
+        self.assertEqual(changes.deleted, [first.id])
+        self.assertGreaterEqual(changes.synced_at, full.synced_at)
+
+    def test_receipt_ocr_vendor_is_matched_case_insensitively(self):
+        receipt = self.db.create_receipt(self.user.id, "image/jpeg", 1024, "suggestions")
+        metadata = dict(status="done", vendor=dict(value="CORNER CAFE", page=0, box=[0, 0, 1, 0.1], known=True))
+        self.db.save_receipt_ocr(receipt.id, 0, metadata, "CORNER CAFE\nLatte 4.50", [])
+
+        row = self.db.get_receipt_ocr(receipt.id, self.user.id)
+
+        self.assertEqual((row.vendor_id, row.text), (self.vendor.id, "CORNER CAFE\nLatte 4.50"))
+        self.assertIsNone(self.db.get_receipt_ocr(receipt.id, self.user.id + 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
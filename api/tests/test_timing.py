@@ -0,0 +1,107 @@
+import unittest
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from api.timing import TimingMiddleware
+from utils import timing
+
+
+def make_app(engine) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(TimingMiddleware)
+
+    @app.get("/items/{id}")
+    def items(id: int):
+        # Sync endpoints run in the threadpool, like most of the routers.
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        with timing.span("thumbnail"):
+            pass
+        return PlainTextResponse("hello")
+
+    @app.get("/fail")
+    async def fail():
+        raise ValueError("boom")
+
+    return app
+
+
+def parse_server_timing(value: str) -> dict:
+    metrics = dict()
+    for metric in value.split(", "):
+        name, *params = metric.split(";")
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+
+class TimingMiddlewareTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine("sqlite://")
+        timing.instrument_engine(cls.engine, slow_query_seconds=60)
+        cls.client = TestClient(make_app(cls.engine), raise_server_exceptions=False)
+
+    def test_server_timing_header(self):
+        response = self.client.get("/items/7")
+
+        metrics = parse_server_timing(response.headers["server-timing"])
+        self.assertEqual(set(metrics), {"total", "db", "thumbnail"})
+        self.assertEqual(metrics["db"]["desc"], '"2 statements"')
+        self.assertLessEqual(float(metrics["db"]["dur"]), float(metrics["total"]["dur"]))
+
+    def test_request_is_logged_with_the_route_template(self):
+        with self.assertLogs("receep.requests", "INFO") as logs:
+            self.client.get("/items/7")
+
+        line = logs.output[0]
+        self.assertIn("method=GET route=/items/{id} status=200", line)
+        self.assertIn("statements=2", line)
+        self.assertIn("thumbnail_ms=", line)
+        self.assertIn("bytes=5", line)
+
+    def test_failed_request_is_logged(self):
+        with self.assertLogs("receep.requests", "INFO") as logs:
+            self.assertEqual(self.client.get("/fail").status_code, 500)
+
+        self.assertIn("route=/fail status=500", logs.output[0])
+
+
+class InstrumentEngineTests(unittest.TestCase):
+    def test_statements_outside_requests_are_not_counted(self):
+        engine = create_engine("sqlite://")
+        timing.instrument_engine(engine, slow_query_seconds=60)
+
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        with timing.span("thumbnail"):
+            pass
+        self.assertIsNone(timing.current_request.get())
+
+    def test_slow_queries_are_logged_without_parameters(self):
+        engine = create_engine("sqlite://")
+        timing.instrument_engine(engine, slow_query_seconds=0)
+
+        with self.assertLogs("receep", "WARNING") as logs, engine.connect() as conn:
+            conn.execute(text("SELECT :secret"), dict(secret="hunter2"))
+
+        self.assertIn("Slow query.", logs.output[0])
+        self.assertIn("SELECT ?", logs.output[0])
+        self.assertNotIn("hunter2", logs.output[0])
+
+    def test_failed_statements_do_not_leak_timers(self):
+        engine = create_engine("sqlite://")
+        timing.instrument_engine(engine, slow_query_seconds=60)
+
+        with engine.connect() as conn:
+            with self.assertRaises(Exception):
+                conn.execute(text("SELECT * FROM missing"))
+            conn.execute(text("SELECT 1"))
+            self.assertEqual(conn.info["query_started"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from api import typeahead
+from api.serializers import VENDOR
+from api.typeahead import (FUZZY_MATCH, PREFIX_MATCH, SUBSTRING_MATCH, WORD_PREFIX_MATCH, TypeaheadCache,
+                           match_tier)
+
+
+def vendor_row(id, name, usage):
+    return SimpleNamespace(id=id, user_id=1, name=name, updated_at=None, usage=usage)
+
+
+class FakeDatabase:
+    def __init__(self, rows):
+        self.rows = rows
+        self.version = 1
+        self.loads = []
+
+    def load(self, user_id, prefix=None, limit=None):
+        self.loads.append(prefix)
+        rows = [r for r in self.rows if prefix is None or r.name.lower().startswith(prefix)]
+        if prefix is not None:
+            rows.sort(key=lambda r: -r.usage)
+        return rows[:limit]
+
+    def get_version(self, user_id):
+        return self.version
+
+
+class MatchTierTests(unittest.TestCase):
+    def test_tiers(self):
+        self.assertEqual(match_tier("martin's", "mart"), PREFIX_MATCH)
+        self.assertEqual(match_tier("wal mart", "mart"), WORD_PREFIX_MATCH)
+        self.assertEqual(match_tier("walmart", "mart"), SUBSTRING_MATCH)
+        self.assertEqual(match_tier("marathon taxi", "mart"), FUZZY_MATCH)
+        self.assertIsNone(match_tier("costco", "mart"))
+
+
+class TypeaheadCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDatabase([
+            vendor_row(1, "Walmart", 50),
+            vendor_row(2, "Martin's", 1),
+            vendor_row(3, "Mart Express", 7),
+            vendor_row(4, "Costco", 99),
+        ])
+        self.cache = TypeaheadCache(VENDOR, self.db.load, self.db.get_version)
+
+    def test_ranks_by_tier_then_usage(self):
+        items = self.cache.search(user_id=1, query="Mart", limit=10)
+
+        self.assertEqual([i["id"] for i in items], [3, 2, 1])
+        self.assertEqual(items[0]["usage_count"], 7)
+
+    def test_empty_query_returns_most_used(self):
+        items = self.cache.search(user_id=1, query="", limit=2)
+
+        self.assertEqual([i["id"] for i in items], [4, 1])
+
+    def test_reloads_only_when_the_version_changes(self):
+        self.cache.search(user_id=1, query="a", limit=10)
+        self.cache.search(user_id=1, query="b", limit=10)
+        self.assertEqual(len(self.db.loads), 1)
+
+        self.db.rows.append(vendor_row(5, "Bakery", 3))
+        self.db.version += 1
+
+        items = self.cache.search(user_id=1, query="bak", limit=10)
+        self.assertEqual(len(self.db.loads), 2)
+        self.assertEqual([i["id"] for i in items], [5])
+
+    def test_falls_back_to_prefix_lookups_for_large_users(self):
+        with mock.patch.object(typeahead, "MAX_CACHED_NAMES", 2):
+            items = self.cache.search(user_id=1, query="Mart", limit=10)
+
+        self.assertEqual([i["id"] for i in items], [3, 2])
+        self.assertEqual(self.db.loads, [None, "mart"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,179 @@
-from logging import Formatter, Handler
+"""
+Log records are handed to a queue on the calling thread, which is an event loop or a request thread, and written
+by a single listener thread. A slow or stalled disk delays the listener, not requests. When the queue is full,
+records are dropped and counted in receep_log_records_dropped_total rather than blocking the caller.
+"""
+import fcntl
+import json
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging import (ERROR, INFO, WARNING, Filter, Formatter, Handler, LogRecord, StreamHandler, getLogger)
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Optional
+
+from utils.metrics import Counter
 
 FMT = "[%(levelname)s] %(filename)s:%(lineno)d %(funcName)s %(message)s"
+LOG_DIR = os.getenv("LOG_DIR", "/var/log/receep/api")
+# "text" or "json", one object per line.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Each log file is rotated at this size, keeping LOG_BACKUP_COUNT older files. 0 disables rotation.
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Share of the per-request lines of the receep.requests logger that are kept.
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "1"))
+QUEUE_SIZE = 10000
+
+LOG_RECORDS_DROPPED = Counter("receep_log_records_dropped_total", "Log records dropped because the queue was full.")
+
+# Attributes of every LogRecord. Anything else on a record was passed with extra= and goes into the JSON output.
+RECORD_ATTRIBUTES = frozenset(LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+_listener: Optional[QueueListener] = None
+_queue_handlers: List[Handler] = []
 
 
 def set_format(handler: Handler) -> Handler:
-    handler.formatter = Formatter(FMT)
+    handler.formatter = JsonFormatter() if LOG_FORMAT == "json" else Formatter(FMT)
     return handler
+
+
+class JsonFormatter(Formatter):
+    def format(self, record: LogRecord) -> str:
+        entry = dict(
+            time=datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            level=record.levelname,
+            logger=record.name,
+            location=f"{record.filename}:{record.lineno}",
+            function=record.funcName,
+            message=record.getMessage(),
+        )
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(Filter):
+    """
+    Keeps a random share of the records below WARNING. Warnings and errors are always kept.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: LogRecord) -> bool:
+        return record.levelno >= WARNING or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    def prepare(self, record: LogRecord) -> LogRecord:
+        """
+        Resolves the message and the traceback now, since the arguments may change before the listener formats
+        the record. Unlike QueueHandler.prepare, it leaves the formatting and the extra fields to the target handlers.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """
+    A RotatingFileHandler for a file that several worker processes append to. Rollover happens under a lock file,
+    by whichever worker first sees the file over the limit, and the other workers reopen the new file.
+    """
+
+    def emit(self, record: LogRecord) -> None:
+        if self.stream is not None and self._rotated_elsewhere():
+            self.stream.close()
+            self.stream = self._open()
+        super().emit(record)
+
+    def _rotated_elsewhere(self) -> bool:
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def doRollover(self) -> None:
+        with open(f"{self.baseFilename}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another worker may have rotated it while this one waited for the lock.
+            if not self._rotated_elsewhere():
+                super().doRollover()
+            elif self.stream is not None:
+                self.stream.close()
+                self.stream = self._open()
+
+
+def _file_handler(name: str) -> Handler:
+    return set_format(SharedRotatingFileHandler(os.path.join(LOG_DIR, name), maxBytes=LOG_MAX_BYTES,
+                                                backupCount=LOG_BACKUP_COUNT))
+
+
+def configure_logging() -> None:
+    """
+    Routes the receep and uvicorn.error loggers through the queue, and starts the listener thread.
+    Called on app startup, in every worker; calling it again does nothing until shutdown_logging().
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    app_file = _file_handler("app.log")
+    app_file.addFilter(Filter("receep"))
+    uvicorn_file = _file_handler("uvicorn.log")
+    uvicorn_file.addFilter(Filter("uvicorn"))
+
+    records = queue.Queue(QUEUE_SIZE)
+    _listener = QueueListener(records, set_format(StreamHandler()), app_file, uvicorn_file)
+    _listener.start()
+
+    for name, level in (("receep", INFO), ("uvicorn.error", ERROR)):
+        handler = DroppingQueueHandler(records)
+        logger = getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(handler)
+        _queue_handlers.append(handler)
+
+    if REQUEST_LOG_SAMPLE_RATE < 1:
+        getLogger("receep.requests").addFilter(SampleFilter(REQUEST_LOG_SAMPLE_RATE))
+
+
+def shutdown_logging() -> None:
+    """
+    Writes out the queued records and closes the files. Called on app shutdown.
+    """
+    global _listener
+    if _listener is None:
+        return
+
+    for name in ("receep", "uvicorn.error"):
+        for handler in _queue_handlers:
+            getLogger(name).removeHandler(handler)
+    _queue_handlers.clear()
+    requests_logger = getLogger("receep.requests")
+    for sample_filter in [f for f in requests_logger.filters if isinstance(f, SampleFilter)]:
+        requests_logger.removeFilter(sample_filter)
+
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
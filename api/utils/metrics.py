@@ -0,0 +1,301 @@
+"""
+A small metrics registry, rendered in the Prometheus text exposition format by GET /metrics.
+
+Metrics are module-level objects, updated from any thread. Labels are passed as keyword arguments and must be
+low-cardinality: route templates and known content types, never ids or raw client input.
+
+Values are kept per process, but gunicorn runs several workers behind one port and a scrape reaches any of them.
+With METRICS_DIR set, every worker writes its values to <pid>.json in that directory, every METRICS_WRITE_SECONDS
+and when it answers a scrape, and the scrape adds up the files of all workers. When a worker exits, the gunicorn
+master folds its counters and histograms into archive.json and drops its gauges, so counters do not go back when
+workers are recycled.
+"""
+import fcntl
+import glob
+import json
+import math
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Prometheus' default buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Shared by the workers of one server, and emptied when it starts. Unset, /metrics reports the answering process.
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_WRITE_SECONDS = float(os.getenv("METRICS_WRITE_SECONDS", "5"))
+ARCHIVE_FILE = "archive.json"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None, registry: Optional["Registry"] = None):
+        """
+        function, if given, is called on every scrape for the value of an unlabelled metric.
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = dict()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"Expected labels {self.labelnames}. {self.name=} {labels=}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        if self.function is not None:
+            return self.function()
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> dict:
+        """
+        The current values, in the form written to METRICS_DIR.
+        """
+        if self.function is not None:
+            values = [((), float(self.function()))]
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return dict(type=self.type, help=self.help, labelnames=self.labelnames, values=values)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 registry: Optional["Registry"] = None):
+        super().__init__(name, help, labelnames, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: [count per bucket, ..., count above the last bucket, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = dict()
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self) -> dict:
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        return dict(type=self.type, help=self.help, labelnames=self.labelnames, buckets=self.buckets,
+                    values=series)
+
+
+class Registry:
+    def __init__(self, directory: Optional[str] = None):
+        """
+        directory, if given, is shared with the other workers. See the module docstring.
+        """
+        self.directory = directory
+        self._metrics: Dict[str, Metric] = dict()
+        self._writer: Optional[threading.Thread] = None
+        self._stop_writer = threading.Event()
+        # The writer thread and a scrape may write at the same time.
+        self._write_lock = threading.Lock()
+
+    def register(self, metric: Metric) -> None:
+        """
+        A module loaded twice (ex. by tests) replaces its metrics. Two different metrics may not share a name.
+        """
+        existing = self._metrics.get(metric.name)
+        if existing is not None and (existing.type, existing.labelnames) != (metric.type, metric.labelnames):
+            raise ValueError(f"Metric already registered. {metric.name=}")
+        self._metrics[metric.name] = metric
+
+    def collect(self) -> Dict[str, dict]:
+        return {name: metric.collect() for name, metric in self._metrics.items()}
+
+    def expose(self) -> str:
+        """
+        With a directory, the sum of every worker's values. Otherwise this process's.
+        """
+        if self.directory is None:
+            return _render(self.collect())
+
+        self.write()
+        with self._lock_files(fcntl.LOCK_SH):
+            return _render(_merge(_read(path) for path in glob.glob(os.path.join(self.directory, "*.json"))))
+
+    def write(self) -> None:
+        """
+        Replaces this process's file in the directory.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with self._write_lock:
+            _write(f"{path}.tmp", self.collect())
+            os.replace(f"{path}.tmp", path)
+
+    def archive_process(self, pid: int) -> None:
+        """
+        Folds the counters and histograms of an exited worker into the archive, and forgets its gauges.
+        Called by the gunicorn master.
+        """
+        path = os.path.join(self.directory, f"{pid}.json")
+        archive = os.path.join(self.directory, ARCHIVE_FILE)
+        with self._lock_files(fcntl.LOCK_EX):
+            if not os.path.exists(path):
+                return
+            _write(f"{archive}.tmp", _merge([_read(archive), _read(path)], gauges=False))
+            os.replace(f"{archive}.tmp", archive)
+            os.remove(path)
+
+    def start_writer(self) -> None:
+        """
+        Writes this process's file every METRICS_WRITE_SECONDS on a daemon thread. Called on app startup, in every
+        worker; does nothing without a directory.
+        """
+        if self.directory is None or self._writer is not None:
+            return
+
+        def run():
+            while not self._stop_writer.wait(METRICS_WRITE_SECONDS):
+                self.write()
+
+        self._stop_writer.clear()
+        self._writer = threading.Thread(target=run, name="metrics-writer", daemon=True)
+        self._writer.start()
+
+    def stop_writer(self) -> None:
+        """
+        Writes the final values, for the archive. Called on app shutdown.
+        """
+        if self._writer is None:
+            return
+        self._stop_writer.set()
+        self._writer.join()
+        self._writer = None
+        self.write()
+
+    @contextmanager
+    def _lock_files(self, operation: int):
+        """
+        Readers take a shared lock, so that they never see a worker's values both archived and in its own file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+
+def _write(path: str, metrics: Dict[str, dict]) -> None:
+    with open(path, "w") as f:
+        json.dump(metrics, f)
+
+
+def _read(path: str) -> Dict[str, dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+def _merge(snapshots: Iterable[Dict[str, dict]], gauges: bool = True) -> Dict[str, dict]:
+    """
+    Adds up the values of several processes. Histograms are added bucket by bucket.
+    """
+    merged: Dict[str, dict] = dict()
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if metric["type"] == "gauge" and not gauges:
+                continue
+            if name not in merged:
+                merged[name] = dict(metric, values=defaultdict(float))
+            values = merged[name]["values"]
+            for key, value in metric["values"]:
+                key = tuple(key)
+                if isinstance(value, list):
+                    values[key] = [a + b for a, b in zip(values[key], value)] if key in values else list(value)
+                else:
+                    values[key] += value
+
+    for metric in merged.values():
+        metric["values"] = list(metric["values"].items())
+    return merged
+
+
+def _samples(name: str, metric: dict) -> List[Tuple[str, Dict[str, str], float]]:
+    if metric["type"] != "histogram":
+        return [(name, dict(zip(metric["labelnames"], key)), value) for key, value in metric["values"]]
+
+    samples = []
+    for key, values in metric["values"]:
+        labels = dict(zip(metric["labelnames"], key))
+        cumulative = 0
+        for bound, count in zip(tuple(metric["buckets"]) + (math.inf,), values[:-1]):
+            cumulative += count
+            samples.append((f"{name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+        samples.append((f"{name}_sum", labels, values[-1]))
+        samples.append((f"{name}_count", labels, cumulative))
+    return samples
+
+
+def _render(metrics: Dict[str, dict]) -> str:
+    lines = []
+    for name, metric in metrics.items():
+        lines.append(f"# HELP {name} {_escape(metric['help'], quotes=False)}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for sample_name, labels, value in _samples(name, metric):
+            if labels:
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample_name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value: str, quotes: bool = True) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry(METRICS_DIR)
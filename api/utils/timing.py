@@ -0,0 +1,91 @@
+"""
+Per-request timings. The request's RequestTiming lives in a context variable, so code running on its behalf,
+including in FastAPI's threadpool, adds to it without passing it around. Outside of a request, recording is a no-op.
+"""
+import logging
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import Engine, event
+
+from utils.metrics import Histogram
+
+logger = logging.getLogger("receep")
+
+# Longest statement text logged with a slow query.
+SLOW_QUERY_LOG_CHARS = 500
+
+STATEMENT_SECONDS = Histogram("receep_db_statement_duration_seconds", "Time to execute each SQL statement.")
+
+
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.statements = 0
+        # Seconds per span name. Ex. {"thumbnail": 0.12}
+        self.spans: Dict[str, float] = dict()
+
+    def add_span(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+
+# Set by the timing middleware for the duration of each request.
+current_request: ContextVar[Optional[RequestTiming]] = ContextVar("current_request", default=None)
+
+# Engines that instrument_engine() has attached its listeners to.
+_instrumented: "weakref.WeakSet[Engine]" = weakref.WeakSet()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Adds the time spent in the block to the current request's span of that name.
+    """
+    timing = current_request.get()
+    if timing is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add_span(name, time.perf_counter() - started)
+
+
+def instrument_engine(engine: Engine, slow_query_seconds: float) -> None:
+    """
+    Counts the statements and the time in the database of every request, records each statement's time in
+    STATEMENT_SECONDS, and logs statements slower than slow_query_seconds, whether or not they run in a request.
+    Parameters are not logged; they hold user data. Instrumenting the same engine again does nothing.
+    """
+    if engine in _instrumented:
+        return
+    _instrumented.add(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        STATEMENT_SECONDS.observe(elapsed)
+        timing = current_request.get()
+        if timing is not None:
+            timing.db_seconds += elapsed
+            timing.statements += 1
+        if elapsed >= slow_query_seconds:
+            logger.warning(f"Slow query. elapsed_ms={elapsed * 1000:.1f} "
+                           f"statement={' '.join(statement.split())[:SLOW_QUERY_LOG_CHARS]!r}")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # after_cursor_execute is not called for failed statements.
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
@@ -1,8 +1,14 @@
-import axiosss from "axios";
+import axiosss, { AxiosError, InternalAxiosRequestConfig } from "axios";
 import Cookies from "js-cookie";
 import ReconnectingWebSocket from "reconnecting-websocket";
 
-const WS_ENABLED = false;
+const WS_ENABLED = true;
+
+const REFRESH_URL = "/api/token/refresh";
+// Requests whose 401 means bad credentials rather than an expired access token.
+const NO_REFRESH_URLS = ["/api/login", "/api/signup", "/api/invite/accept", REFRESH_URL];
+// Refresh this long before the access token expires.
+const REFRESH_MARGIN_MS = 60 * 1000;
 
 // Create an Axios instance
 export const axios = axiosss.create();
@@ -17,6 +23,69 @@ axios.interceptors.request.use(
   },
 );
 
+type RetriableConfig = InternalAxiosRequestConfig & { _retried?: boolean };
+
+axios.interceptors.response.use(
+  (response) => response,
+  (error: AxiosError) => {
+    const config = error.config as RetriableConfig | undefined;
+    if (error.response?.status !== 401 || !config || config._retried || NO_REFRESH_URLS.includes(config.url ?? "")) {
+      return Promise.reject(error);
+    }
+
+    // The access token expired; renew it and replay the request once.
+    config._retried = true;
+    return refreshJwt().then(
+      () => axios(config),
+      () => Promise.reject(error),
+    );
+  },
+);
+
+let refreshing: Promise<string> | undefined;
+let refreshTimer: ReturnType<typeof setTimeout> | undefined;
+
+/**
+ * Exchanges the HttpOnly refresh cookie for a new access token.
+ * Concurrent callers share one request: the refresh token is single use.
+ */
+export const refreshJwt = (): Promise<string> => {
+  if (!refreshing) {
+    refreshing = axiosss
+      .post(REFRESH_URL)
+      .then((r) => {
+        setJwt(r.data.token);
+        return r.data.token as string;
+      })
+      .finally(() => {
+        refreshing = undefined;
+      });
+  }
+  return refreshing;
+};
+
+const getTokenExpiry = (token: string): number | undefined => {
+  try {
+    const payload = token.split(".")[1].replace(/-/g, "+").replace(/_/g, "/");
+    return JSON.parse(atob(payload)).exp * 1000;
+  } catch {
+    return undefined;
+  }
+};
+
+const scheduleRefresh = (token: string) => {
+  clearTimeout(refreshTimer);
+  const expiry = getTokenExpiry(token);
+  if (!expiry) {
+    return;
+  }
+
+  refreshTimer = setTimeout(
+    () => refreshJwt().catch(console.error),
+    Math.max(expiry - Date.now() - REFRESH_MARGIN_MS, 0),
+  );
+};
+
 export type WebsocketMessage = {
   topic: string;
   payload: object;
@@ -28,15 +97,27 @@ const WEBSOCKET_LISTENERS: WebsocketListener[] = [];
 
 if (WS_ENABLED) {
   const WEBSOCKET_URL = (() => {
-    const token = Cookies.get("jwt");
-    const { protocol, hostname, port } = window.location;
-    let wsProtocol = protocol === "https" ? "wss" : "ws";
-    return `${wsProtocol}://${hostname}:${port}/api/ws?token=${token}`;
+    // The browser sends the jwt cookie with the handshake.
+    const { protocol, host } = window.location;
+    const wsProtocol = protocol === "https:" ? "wss" : "ws";
+    return `${wsProtocol}://${host}/api/ws`;
   })();
 
-  new ReconnectingWebSocket(WEBSOCKET_URL).onmessage = ({ data }) => {
-    const message = JSON.parse(data);
-    WEBSOCKET_LISTENERS.forEach((listener) => listener(message));
+  const notify = (message: WebsocketMessage) => WEBSOCKET_LISTENERS.forEach((listener) => listener(message));
+
+  const socket = new ReconnectingWebSocket(WEBSOCKET_URL);
+  let hasConnected = false;
+
+  socket.onopen = () => {
+    // Changes made while disconnected were not pushed, so listeners should catch up.
+    if (hasConnected) {
+      notify({ topic: "reconnected", payload: {} });
+    }
+    hasConnected = true;
+  };
+
+  socket.onmessage = ({ data }) => {
+    notify(JSON.parse(data));
   };
 }
 
@@ -56,4 +137,10 @@ export const setJwt = (token: string) => {
     secure: process.env.NODE_ENV === "production",
     sameSite: "Strict",
   });
+  scheduleRefresh(token);
 };
+
+const existingJwt = Cookies.get("jwt");
+if (existingJwt) {
+  scheduleRefresh(existingJwt);
+}
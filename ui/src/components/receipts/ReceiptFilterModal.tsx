@@ -3,22 +3,18 @@ import { Info } from "lucide-preact";
 
 import { Receipt } from "@/types";
 
-import { sigUserInfo } from "@/store";
+import { ReceiptFilterParams, setReceiptFilterParams } from "@/gvars";
 
 type ReceiptFilter = {
   name: string;
   tooltip: string;
   predicate: (r: Receipt) => boolean;
+  // The equivalent server-side filter, used when fetching more receipts.
+  params: () => ReceiptFilterParams;
   isSelected?: boolean;
 };
 
 const sigReceiptFilters = signal<ReceiptFilter[]>([
-  {
-    name: "Show my receipts only",
-    tooltip: "Hides receipt uploaded by other users.",
-    predicate: (r) => r.user_id === sigUserInfo.value?.user_id,
-    isSelected: true,
-  },
   {
     name: "Show unvetted receipts only",
     tooltip: "Hides receipts that have associated transactions.",
@@ -26,6 +22,7 @@ const sigReceiptFilters = signal<ReceiptFilter[]>([
       const hasTransaction = r.transactions && r.transactions.length > 0;
       return !hasTransaction;
     },
+    params: () => ({ has_transactions: false }),
     isSelected: false,
   },
 ]);
@@ -36,6 +33,9 @@ const sigReceiptFilters = signal<ReceiptFilter[]>([
 export const applySelectedFilters = (r: Receipt): boolean =>
   sigReceiptFilters.value.filter((f) => f.isSelected).reduce((acc, { predicate }) => acc && predicate(r), true);
 
+const getSelectedFilterParams = (): ReceiptFilterParams =>
+  sigReceiptFilters.value.filter((f) => f.isSelected).reduce((acc, { params }) => ({ ...acc, ...params() }), {});
+
 const ReceiptFilterModal = () => {
   return (
     <dialog id="receipt-filter-modal" className="modal">
@@ -62,6 +62,7 @@ const ReceiptFilterModal = () => {
                         }
                         return acc;
                       }, [] as ReceiptFilter[]);
+                      setReceiptFilterParams(getSelectedFilterParams());
                     }}
                     className="checkbox checkbox-primary"
                   />
@@ -5,7 +5,7 @@ import PivotTableUI from "react-pivottable/PivotTableUI";
 
 import { axios } from "@/api";
 import { sigCategories, sigVendors } from "@/store";
-import { TZ_OFFSET_HRS, getYearTimestamps } from "@/utils/dates";
+import { TZ_NAME, getYearTimestamps } from "@/utils/dates";
 
 import "react-pivottable/pivottable.css";
 
@@ -22,9 +22,9 @@ type ExpenseLineItem = {
   amount: number;
 };
 
-type PaginatedReportResponse = {
-  items: ExpenseLineItem[];
-  next_offset: number;
+type ColumnarReportResponse = {
+  count: number;
+  columns: { [K in keyof ExpenseLineItem]: ExpenseLineItem[K][] };
 };
 
 const REPORT_PRESETS: {
@@ -43,29 +43,27 @@ const REPORT_PRESETS: {
 };
 
 const fetchReportData = async (start: number, end: number): Promise<ExpenseLineItem[]> => {
-  const fetchNext = (offset: number): Promise<PaginatedReportResponse> =>
-    axios
-      .get("/api/reports/annual-expense-report/paginated", {
-        params: {
-          start: start / 1000,
-          end: end / 1000,
-          offset,
-          tz: TZ_OFFSET_HRS, // The API returns Y/M/D in UTC by default. Providing this query param adjusts the values to the local timezone.
-        },
-      })
-      .then((r) => r.data);
-
-  const allItems: ExpenseLineItem[] = [];
-  let offset = 0;
-
-  do {
-    // keep fetching the next page until there is none.
-    const { items, next_offset } = await fetchNext(offset);
-    allItems.push(...items);
-    offset = items.length > 0 ? next_offset : 0;
-  } while (offset > 0);
-
-  return allItems;
+  // The whole year in one response, column-oriented.
+  const { count, columns }: ColumnarReportResponse = await axios
+    .get("/api/reports/annual-expense-report/columns", {
+      params: {
+        start: start / 1000,
+        end: end / 1000,
+        timezone: TZ_NAME, // The API returns Y/M/D in UTC by default. Providing this query param adjusts the values to the local timezone.
+      },
+    })
+    .then((r) => r.data);
+
+  return Array.from({ length: count }, (_, i) => ({
+    category_id: columns.category_id[i],
+    vendor_id: columns.vendor_id[i],
+    tx_id: columns.tx_id[i],
+    year: columns.year[i],
+    month: columns.month[i],
+    day: columns.day[i],
+    day_of_week: columns.day_of_week[i],
+    amount: columns.amount[i],
+  }));
 };
 
 const DateRangePicker = ({ onSubmit }: { onSubmit: (start: number, end: number) => void }) => {
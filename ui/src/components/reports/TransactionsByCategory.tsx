@@ -8,7 +8,7 @@ import { axios } from "@/api";
 import { ROUTE_PATHS } from "@/const";
 import { sigCategories, sigVendors } from "@/store";
 import { Category } from "@/types";
-import { TZ_OFFSET_HRS } from "@/utils/dates";
+import { TZ_NAME } from "@/utils/dates";
 import { getCategoryReportPath } from "@/utils/paths";
 
 import "react-pivottable/pivottable.css";
@@ -45,7 +45,7 @@ const fetchLineItems = async (categoryId: number): Promise<CategoryLineItem[]> =
   const fetchNext = (offset: number): Promise<PaginatedReportResponse> =>
     axios
       .get("/api/reports/line-items-by-category/paginated", {
-        params: { category_id: categoryId, offset, tz: TZ_OFFSET_HRS },
+        params: { category_id: categoryId, offset, timezone: TZ_NAME },
       })
       .then((r) => r.data);
 
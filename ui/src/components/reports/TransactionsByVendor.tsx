@@ -8,7 +8,7 @@ import { axios } from "@/api";
 import { ROUTE_PATHS } from "@/const";
 import { sigCategories, sigVendors } from "@/store";
 import { Vendor } from "@/types";
-import { TZ_OFFSET_HRS } from "@/utils/dates";
+import { TZ_NAME } from "@/utils/dates";
 import { getVendorReportPath } from "@/utils/paths";
 
 import "react-pivottable/pivottable.css";
@@ -45,7 +45,7 @@ const fetchLineItems = async (vendorId: number): Promise<VendorLineItem[]> => {
   const fetchNext = (offset: number): Promise<PaginatedReportResponse> =>
     axios
       .get("/api/reports/line-items-by-vendor/paginated", {
-        params: { vendor_id: vendorId, offset, tz: TZ_OFFSET_HRS },
+        params: { vendor_id: vendorId, offset, timezone: TZ_NAME },
       })
       .then((r) => r.data);
 
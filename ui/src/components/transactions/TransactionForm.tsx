@@ -5,6 +5,7 @@ import { Category, Transaction, Vendor } from "@/types";
 
 import { axios } from "@/api";
 import { ROUTE_PATHS } from "@/const";
+import { fetchSuggestions, searchCategories, searchVendors } from "@/gvars";
 import useAutoTax from "@/hooks/useAutoTax";
 import useSimpleConfirmationDialog from "@/hooks/useSimpleConfirmationDialog";
 import {
@@ -178,6 +179,9 @@ const TransactionForm = ({ transaction, returnTo }: { transaction: Transaction;
         onCloneSuccess={handleCloneSuccess}
         onCreateVendor={handleCreateVendor}
         onCreateCategory={handleCreateCategory}
+        onSearchVendors={searchVendors}
+        onSearchCategories={searchCategories}
+        onSuggest={fetchSuggestions}
       />
     </>
   );
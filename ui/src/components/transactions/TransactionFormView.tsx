@@ -7,9 +7,10 @@ import { useCallback, useEffect, useMemo, useState } from "preact/hooks";
 import DatePicker from "react-datepicker";
 import { Controller, useFieldArray, useForm } from "react-hook-form";
 import toast from "react-hot-toast";
+import { InputActionMeta } from "react-select";
 import CreatableSelect from "react-select/creatable";
 
-import { Category, Receipt, Transaction, UserInfo, Vendor } from "@/types";
+import { Category, Receipt, SuggestionQuery, Suggestions, Transaction, UserInfo, Vendor } from "@/types";
 
 import ReceiptDownloadButton from "@/components/receipts/ReceiptDownloadButton";
 import { ReceiptHighres, ReceiptThumbnail } from "@/components/receipts/ReceiptImg";
@@ -46,6 +47,12 @@ export type TransactionFormViewProps = {
   onCreateVendor: (name: string) => Promise<number>;
   /** Called when the user creates a new category inline. Should resolve to the new category's ID. */
   onCreateCategory: (name: string) => Promise<number>;
+  /** Called as the user types in the vendor dropdown, so the caller can load matching vendors into `vendors`. */
+  onSearchVendors?: (query: string) => void;
+  /** Called as the user types in a category dropdown, so the caller can load matching categories into `categories`. */
+  onSearchCategories?: (query: string) => void;
+  /** Called for new transactions when the vendor or the receipt changes, to prefill the empty fields. */
+  onSuggest?: (query: SuggestionQuery) => Promise<Suggestions>;
 };
 
 const TransactionFormView = ({
@@ -59,6 +66,9 @@ const TransactionFormView = ({
   onCloneSuccess,
   onCreateVendor,
   onCreateCategory,
+  onSearchVendors,
+  onSearchCategories,
+  onSuggest,
 }: TransactionFormViewProps) => {
   const taxRateExistsInConfig = useMemo(() => (userInfo.config.tax_rate || 0) > 0, [userInfo]);
   const { register, handleSubmit, control, setValue, watch } = useForm<FormData>({
@@ -84,6 +94,46 @@ const TransactionFormView = ({
     setValue("enableAutoTax", enableAutoTax);
   }, [isNewTransaction, taxRateExistsInConfig, lineItems, firstLineItemCategoryId, categories, setValue]);
 
+  const vendorId = watch("vendor_id");
+  const receiptId = watch("receipt_id");
+
+  // Prefill the vendor and the empty categories of a new transaction. Fields the user already set are kept.
+  useEffect(() => {
+    if (!isNewTransaction || !onSuggest) {
+      return;
+    }
+
+    let isCurrent = true;
+    onSuggest({
+      vendor_id: vendorId || undefined,
+      receipt_id: receiptId || undefined,
+      name: lineItems[0]?.name || undefined,
+    })
+      .then(({ vendor, categories: suggestedCategories }) => {
+        if (!isCurrent) {
+          return;
+        }
+        if (vendor && !vendorId) {
+          setValue("vendor_id", vendor.id);
+        }
+        const [bestCategory] = suggestedCategories;
+        if (bestCategory) {
+          lineItems.forEach((lineItem, index) => {
+            if (!lineItem.category_id) {
+              setValue(`line_items.${index}.category_id`, bestCategory.id);
+            }
+          });
+        }
+      })
+      .catch((e) => {
+        console.error(e);
+      });
+    return () => {
+      isCurrent = false;
+    };
+    // Only the vendor and the receipt trigger a suggestion; typing in the line items does not.
+  }, [isNewTransaction, onSuggest, vendorId, receiptId]);
+
   const categoryOptions = useMemo(
     () =>
       categories
@@ -124,6 +174,12 @@ const TransactionFormView = ({
    * End of hooks
    * ---------------- */
 
+  const searchOnInput = (search?: (query: string) => void) => (input: string, { action }: InputActionMeta) => {
+    if (search && input && action === "input-change") {
+      search(input);
+    }
+  };
+
   const createVendor = (name: string) => {
     const vendor: Vendor = {
       id: DEFAULT_FIELD_ID,
@@ -297,6 +353,7 @@ const TransactionFormView = ({
                 placeholder="Select a vendor..."
                 filterOption={fuzzyFilterOption}
                 onCreateOption={createVendor}
+                onInputChange={searchOnInput(onSearchVendors)}
                 // @ts-ignore
                 onChange={({ value }) => onChange(value)}
               />
@@ -387,6 +444,7 @@ const TransactionFormView = ({
                     placeholder="Select a category..."
                     filterOption={fuzzyFilterOption}
                     onCreateOption={(categoryName) => createCategory(fieldName, categoryName)}
+                    onInputChange={searchOnInput(onSearchCategories)}
                     // @ts-ignore
                     onChange={({ value }) => {
                       onChange(value);
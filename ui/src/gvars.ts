@@ -2,8 +2,9 @@ import { Signal, signal } from "@preact/signals";
 import toast from "react-hot-toast";
 
 import { axios } from "@/api";
-import { Transaction } from "@/types";
+import { SuggestionQuery, Suggestions, Transaction } from "@/types";
 import { sigCategories, sigReceipts, sigTransactions, sigVendors, sigUserInfo, upsertCategories, upsertReceipts, upsertTransactions, upsertVendors } from "@/store";
+import { resetSync, syncStores } from "@/sync";
 
 export const sigInitialLoadResult = signal<"PENDING" | "SUCCEEDED" | "FAILED">("PENDING");
 
@@ -37,8 +38,19 @@ const categoryPagination = signal<PaginationState>({
   isExhausted: false,
 });
 
+export type ReceiptFilterParams = {
+  has_transactions?: boolean;
+};
+
+let receiptFilterParams: ReceiptFilterParams = {};
+
 const fetchPaginatedData =
-  <T>(url: string, sigPagination: Signal<PaginationState>, upsert: ({ items }: { items: T[] }) => void) =>
+  <T>(
+    url: string,
+    sigPagination: Signal<PaginationState>,
+    upsert: ({ items }: { items: T[] }) => void,
+    getFilterParams: () => object = () => ({}),
+  ) =>
   () => {
     if (sigPagination.value.isExhausted) {
       return Promise.resolve();
@@ -46,7 +58,7 @@ const fetchPaginatedData =
 
     return axios
       .get(url, {
-        params: { ...sigPagination.value },
+        params: { ...sigPagination.value, ...getFilterParams() },
       })
       .then((r) => r.data)
       .then(({ next_offset, items }: { next_offset: number; items: T[] }) => {
@@ -57,33 +69,21 @@ const fetchPaginatedData =
       });
   };
 
-// TODO: should not need to fetch everything on initial load.
-// The UI should be able to handle partial data and fetch more as needed. Ex. vendor dropdown in the transaction form.
-const fetchUntilExhausted = <T>(
-  url: string, sigPagination: Signal<PaginationState>, upsert: ({ items }: { items: T[] }) => void
-) => () => {
-  return new Promise<void>((resolve, reject) => {
-    const fetchFunction = fetchPaginatedData(url, sigPagination, upsert);
-
-    const fetchNext = () => {
-      fetchFunction()
-        .then(() => {
-          if (!sigPagination.value.isExhausted) {
-            fetchNext();
-          } else {
-            resolve();
-          }
-        })
-        .catch((e) => {
-          reject(e);
-        });
-    };
-
-    fetchNext();
-  });
-};
+export const fetchReceipts = fetchPaginatedData(
+  "/api/receipts/paginated",
+  receiptPagination,
+  upsertReceipts,
+  () => receiptFilterParams,
+);
 
-export const fetchReceipts = fetchPaginatedData("/api/receipts/paginated", receiptPagination, upsertReceipts);
+/**
+ * Restarts receipt pagination with the given server-side filters, so that only matching receipts are fetched.
+ */
+export const setReceiptFilterParams = (params: ReceiptFilterParams) => {
+  receiptFilterParams = params;
+  receiptPagination.value = { ...receiptPagination.value, offset: 0, isExhausted: false };
+  return fetchReceipts();
+};
 
 export const fetchTransactions = fetchPaginatedData(
   "/api/transactions/paginated",
@@ -106,9 +106,42 @@ export const searchTransactionsByVendor = (vendorName: string): Promise<void> =>
     });
 };
 
-const fetchVendors = fetchUntilExhausted("/api/vendors/paginated", vendorPagination, upsertVendors);
+const fetchVendors = fetchPaginatedData("/api/vendors/paginated", vendorPagination, upsertVendors);
 
-const fetchCategories = fetchUntilExhausted("/api/categories/paginated", categoryPagination, upsertCategories);
+const fetchCategories = fetchPaginatedData("/api/categories/paginated", categoryPagination, upsertCategories);
+
+const TYPEAHEAD_LIMIT = 20;
+
+const fetchTypeahead =
+  <T>(url: string, upsert: ({ items }: { items: T[] }) => void) =>
+  (query: string): Promise<void> => {
+    return axios
+      .get(url, { params: { q: query, limit: TYPEAHEAD_LIMIT } })
+      .then((r) => r.data)
+      .then(({ items }: { items: T[] }) => {
+        upsert({ items });
+      })
+      .catch((e) => {
+        console.error(e);
+      });
+  };
+
+/**
+ * Loads the user's vendors matching the query into the store. The stores may only hold the first page of
+ * vendors (ex. when the delta sync failed), so dropdowns call this as the user types.
+ */
+export const searchVendors = fetchTypeahead("/api/vendors/typeahead", upsertVendors);
+
+/**
+ * Same as searchVendors, for categories.
+ */
+export const searchCategories = fetchTypeahead("/api/categories/typeahead", upsertCategories);
+
+/**
+ * Suggests the vendor and the categories of a transaction from the user's past transactions and the receipt's OCR.
+ */
+export const fetchSuggestions = (query: SuggestionQuery): Promise<Suggestions> =>
+  axios.get("/api/transactions/suggestions", { params: query }).then((r) => r.data);
 
 const fetchUserInfo = () =>
   axios
@@ -131,6 +164,24 @@ const fetchUserInfo = () =>
       // TODO: handle error
     });
 
+/**
+ * Loads receipts, transactions, vendors and categories through the delta sync endpoint.
+ * Falls back to the first page of each paginated endpoint if the sync fails; vendors and categories beyond
+ * the first page are then looked up on demand through the typeahead endpoints.
+ */
+const fetchStores = () =>
+  syncStores()
+    .then(() => {
+      // The stores now hold every row, so there is nothing left to paginate through.
+      [receiptPagination, transactionPagination, vendorPagination, categoryPagination].forEach((sigPagination) => {
+        sigPagination.value = { ...sigPagination.value, isExhausted: true };
+      });
+    })
+    .catch((e) => {
+      console.error(e);
+      return Promise.all([fetchReceipts(), fetchTransactions(), fetchVendors(), fetchCategories()]);
+    });
+
 const initialPaginationState = (): PaginationState => ({ offset: 0, limit: 50, isExhausted: false });
 
 export const refreshAllData = () => {
@@ -144,11 +195,12 @@ export const refreshAllData = () => {
   sigVendors.value = [];
   sigCategories.value = [];
   sigUserInfo.value = undefined;
+  resetSync();
   return fetchInitialData();
 };
 
 export const fetchInitialData = () => {
-  Promise.allSettled([fetchReceipts(), fetchTransactions(), fetchUserInfo(), fetchVendors(), fetchCategories()])
+  Promise.allSettled([fetchStores(), fetchUserInfo()])
     .then((result) => result.filter(({ status }) => status === "fulfilled"))
     .then((isSuccessful) => {
       if (isSuccessful) {
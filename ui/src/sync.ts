@@ -0,0 +1,149 @@
+import { Category, Receipt, Transaction, Vendor } from "@/types";
+
+import { WebsocketListener, axios, subscribe } from "@/api";
+import {
+  removeCategory,
+  removeReceipt,
+  removeTransaction,
+  removeVendor,
+  sigCategories,
+  sigReceipts,
+  sigTransactions,
+  sigVendors,
+  upsertCategories,
+  upsertReceipts,
+  upsertTransactions,
+  upsertVendors,
+} from "@/store";
+
+const SNAPSHOT_KEY = "receep-sync-snapshot";
+
+type SyncedResource = "receipts" | "transactions" | "vendors" | "categories";
+
+type SyncResponse = {
+  token: string;
+  full: boolean; // true when the server ignored the token and sent everything.
+  receipts: Receipt[];
+  transactions: Transaction[];
+  vendors: Vendor[];
+  categories: Category[];
+  deleted: Partial<Record<SyncedResource, number[]>>;
+};
+
+type SyncSnapshot = Omit<SyncResponse, "full" | "deleted">;
+
+const REMOVERS: Record<SyncedResource, (id: number) => void> = {
+  receipts: removeReceipt,
+  transactions: removeTransaction,
+  vendors: removeVendor,
+  categories: removeCategory,
+};
+
+let syncToken: string | undefined;
+
+const loadSnapshot = (): SyncSnapshot | undefined => {
+  try {
+    const raw = localStorage.getItem(SNAPSHOT_KEY);
+    return raw ? JSON.parse(raw) : undefined;
+  } catch (e) {
+    console.error(e);
+    return undefined;
+  }
+};
+
+const saveSnapshot = () => {
+  const snapshot: SyncSnapshot = {
+    token: syncToken!,
+    receipts: sigReceipts.value,
+    transactions: sigTransactions.value,
+    vendors: sigVendors.value,
+    categories: sigCategories.value,
+  };
+
+  try {
+    localStorage.setItem(SNAPSHOT_KEY, JSON.stringify(snapshot));
+  } catch (e) {
+    // Most likely the storage quota. The next page load will do a full sync.
+    console.error(e);
+    localStorage.removeItem(SNAPSHOT_KEY);
+  }
+};
+
+/**
+ * Forgets the sync token and the cached snapshot so that the next sync fetches everything.
+ */
+export const resetSync = () => {
+  syncToken = undefined;
+  localStorage.removeItem(SNAPSHOT_KEY);
+};
+
+/**
+ * Hydrates the stores from the cached snapshot (first call only), then applies the changes since the last sync.
+ */
+export const syncStores = () => {
+  if (!syncToken) {
+    const snapshot = loadSnapshot();
+    if (snapshot) {
+      syncToken = snapshot.token;
+      upsertReceipts({ items: snapshot.receipts });
+      upsertTransactions({ items: snapshot.transactions });
+      upsertVendors({ items: snapshot.vendors });
+      upsertCategories({ items: snapshot.categories });
+    }
+  }
+
+  return axios
+    .get("/api/sync", { params: { since: syncToken } })
+    .then((r) => r.data)
+    .then(({ token, full, receipts, transactions, vendors, categories, deleted }: SyncResponse) => {
+      if (full) {
+        sigReceipts.value = [];
+        sigTransactions.value = [];
+        sigVendors.value = [];
+        sigCategories.value = [];
+      }
+
+      upsertReceipts({ items: receipts });
+      upsertTransactions({ items: transactions });
+      upsertVendors({ items: vendors });
+      upsertCategories({ items: categories });
+
+      (Object.keys(deleted) as SyncedResource[]).forEach((resource) => {
+        deleted[resource]!.forEach((id) => REMOVERS[resource](id));
+      });
+
+      syncToken = token;
+      saveSnapshot();
+    });
+};
+
+let isLiveSyncRunning = false;
+let isLiveSyncQueued = false;
+
+/**
+ * Syncs when the server pushes a change notification. Notifications that arrive during a sync are folded into
+ * one follow-up sync.
+ */
+const onChangeNotification: WebsocketListener = (message) => {
+  if (message.topic !== "changes" && message.topic !== "reconnected") {
+    return;
+  }
+
+  if (isLiveSyncRunning) {
+    isLiveSyncQueued = true;
+    return;
+  }
+
+  isLiveSyncRunning = true;
+  syncStores()
+    .catch((e) => console.error(e))
+    .finally(() => {
+      isLiveSyncRunning = false;
+      if (isLiveSyncQueued) {
+        isLiveSyncQueued = false;
+        onChangeNotification(message);
+      }
+    });
+};
+
+subscribe(onChangeNotification);
@@ -36,6 +36,23 @@ export type Transaction = {
   amount: number;
 };
 
+export type OcrGuess<T> = {
+  value: T;
+  page: number;
+  // [x0, y0, x1, y1] as fractions of the page, in the orientation given by OcrMetadata.rotation.
+  box: [number, number, number, number];
+};
+
+export type OcrMetadata = {
+  status?: "done" | "failed";
+  version?: number;
+  engine?: "tesseract" | "pdftotext";
+  rotation?: number;
+  total?: OcrGuess<number> | null;
+  date?: OcrGuess<string> | null;
+  vendor?: (OcrGuess<string> & { known: boolean }) | null;
+};
+
 export type Receipt = {
   id: number;
   user_id: number;
@@ -46,7 +63,26 @@ export type Receipt = {
   transactions: Transaction[];
   is_uploading: boolean;
   rotation: number;
-  ocr_metadata: Record<string, number>;
+  ocr_metadata: OcrMetadata;
+};
+
+export type CategorySuggestion = {
+  id: number;
+  score: number; // Between 0 and 1
+  source: "line_item" | "ocr" | "vendor" | "overall";
+  count: number;
+};
+
+export type Suggestions = {
+  // Set when the receipt's OCR named one of the user's vendors and no vendor was given.
+  vendor: { id: number; source: "ocr" } | null;
+  categories: CategorySuggestion[];
+};
+
+export type SuggestionQuery = {
+  vendor_id?: number;
+  receipt_id?: number;
+  name?: string;
 };
 
 export type Vendor = {
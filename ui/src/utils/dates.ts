@@ -1,6 +1,8 @@
 import { formatDistanceToNow } from "date-fns";
 
 export const TZ_OFFSET_HRS = -new Date().getTimezoneOffset() / 60;
+// IANA name, ex. "America/Vancouver". The reports API converts dates with it, DST included.
+export const TZ_NAME = Intl.DateTimeFormat().resolvedOptions().timeZone;
 
 // TODO: ensure this function reflects the current timezone.
 export const toRelativeTime = (epoch: number): string => {
@@ -18,7 +20,8 @@ export const toAbsoluteDate = (epoch: number): string => {
   return date.toISOString().split("T")[0];
 };
 
+// The local year's bounds, in ms.
 export const getYearTimestamps = (y: number) => ({
-  start: new Date(y, 0, 1).getTime() + TZ_OFFSET_HRS * 3600000,
-  end: new Date(y, 11, 31, 23, 59, 59, 999).getTime(),
+  start: new Date(y, 0, 1).getTime(),
+  end: new Date(y + 1, 0, 1).getTime() - 1,
 });